@@ -1,39 +1,86 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+import time
+import logging
+import threading
+
+from tratamento import (
+    dtypes_moeda, converter_colunas_moeda, normalizar_categorias,
+    classificar, carregar_regras_classificacao, impressao_regras,
+    COLUNAS_CATEGORICAS_RECEITA, COLUNAS_CATEGORICAS_DESPESA
+)
+from armazenamento import (
+    ler_camada_curada, camada_curada_existe, agregar_camada_curada, chave_cache, anexar_ou_publicar,
+    ler_particoes, versao_particoes, substituir_particoes, codigo_particao, codigo_do_nome,
+    registro_cargas, registrar_carga, carga_incremental,
+    carregar_manifesto, ARQUIVO_VERSAO_DADOS, ARQUIVO_PARTICOES,
+    CacheLRU, impressao_entradas
+)
+from instrumentacao import (
+    iniciar_execucao, medir_secao, totais_por_secao, exportar_jsonl, exportar_prometheus, salvar_prometheus
+)
+from analise import (
+    construir_cubo_despesa, construir_cubo_receita, agregar, preparar_visao, preparar_visoes_ano,
+    agregar_arvore, formatar_rotulos_valor,
+    DIMENSOES_RECEITA, MEDIDAS_RECEITA, DIMENSOES_DESPESA, MEDIDAS_DESPESA,
+    COLUNAS_HIERARQUIA_RECEITA, COLUNAS_HIERARQUIA_DESPESA, ROTULO_OUTROS,
+    kpis_balanco, kpis_do_snapshot, kpis_receita, kpis_item, funil_execucao, correlacao_receita_despesa,
+    ranking, serie_mensal, balanco_mensal, mapa_calor_mensal,
+    fluxo_integrado, sankey_cadeia_despesa, sankey_natureza_elemento, sankey_receita,
+    IndiceTabela
+)
 
 # ==============================================================================
 # 1. CONFIGURAÇÃO INICIAL DA PÁGINA
 # ==============================================================================
 st.set_page_config(page_title="Dashboard Orçamentário POA", page_icon="🔮", layout="wide")
 
+# Instrumentação: cada rerun coleta os tempos, linhas e memória das seções medidas
+# (carga, agregações do analise.py, montagem de figuras). O painel de depuração na
+# sidebar é opcional (PAINEL_DEBUG=1 ou ?debug=1 na URL); com PAINEL_METRICAS_ARQUIVO,
+# os totais do processo são gravados no formato do Prometheus ao fim dos reruns (inclusive
+# os interrompidos por `parar()`), no máximo a cada PAINEL_METRICAS_INTERVALO segundos (padrão 15).
+inicio_execucao = time.perf_counter()
+registros_execucao = iniciar_execucao()
+modo_debug = os.environ.get('PAINEL_DEBUG') == '1' or st.query_params.get('debug') == '1'
+versao_painel = os.environ.get('PAINEL_VERSAO', 'dev')
+
+def exportar_metricas():
+    """Grava os totais do processo em PAINEL_METRICAS_ARQUIVO (Prometheus), se configurado."""
+    if os.environ.get('PAINEL_METRICAS_ARQUIVO'):
+        salvar_prometheus(os.environ['PAINEL_METRICAS_ARQUIVO'], versao_painel, intervalo=float(os.environ.get('PAINEL_METRICAS_INTERVALO', 15)))
+
+def parar():
+    """
+    Interrompe o rerun (st.stop) exportando antes as métricas: o fim do script, onde
+    elas são gravadas normalmente, não é alcançado.
+    """
+    exportar_metricas()
+    st.stop()
+
 # ==============================================================================
 # 2. FUNÇÕES UTILITÁRIAS (FORMATADORES E TRATAMENTO DE DADOS)
 # ==============================================================================
 
-def limpar_moeda(valor):
-    """
-    Converte strings de moeda brasileira (ex: '1.000,00') para float Python.
-    Trata valores nulos e vazios.
-    """
-    if pd.isna(valor) or valor == '':
-        return 0.0
-    valor_str = str(valor).strip()
-    if ',' in valor_str:
-        valor_str = valor_str.replace('.', '').replace(',', '.')
-    try:
-        return float(valor_str)
-    except ValueError:
-        return 0.0
-
 def formatar_br(valor):
     """
     Aplica formatação visual de moeda brasileira (R$ X.XXX,XX) para exibição nos gráficos e KPIs.
     """
     return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
+def rotulos_sankey(nos):
+    """
+    Rótulos HTML dos nós do Sankey: nome e valor total (R$ x.xM ou R$ x,xxx).
+    """
+    return [
+        f"<span style='font-size:13px'>{rotulo}</span><br><span style='font-size:11px; opacity:0.8'>{f'R$ {v/1e6:,.1f}M' if v > 1e6 else f'R$ {v:,.0f}'}</span>"
+        for rotulo, v in zip(nos['rotulo'], nos['valor'])
+    ]
+
 # ==============================================================================
 # 3. ESTILIZAÇÃO (CSS PERSONALIZADO)
 # ==============================================================================
@@ -120,6 +167,119 @@ def box_educativo(titulo, termos_chaves):
         for t in termos_chaves:
             st.markdown(f"• {obter_conceito(t)}")
 
+# Linhas por página das tabelas detalhadas (só a página visível vai para o navegador)
+TAMANHO_PAGINA = 100
+
+def seletor_pagina(total, chave, tamanho=TAMANHO_PAGINA):
+    """
+    Seletor de página das tabelas paginadas no servidor. Retorna o número da página (1-based).
+    A chave inclui o total para voltar à primeira página quando os filtros mudam.
+    """
+    qtd_paginas = max(1, -(-total // tamanho))
+    col_pag, col_info = st.columns([1, 3])
+    with col_pag:
+        numero = st.number_input("Página:", min_value=1, max_value=qtd_paginas, value=1, step=1, key=f"{chave}_{total}")
+    with col_info:
+        inicio = (numero - 1) * tamanho
+        st.caption(f"Exibindo {min(inicio + 1, total)}–{min(inicio + tamanho, total)} de {total} registros ({qtd_paginas} página(s))")
+    return numero
+
+# Atributos dos traços (e de node/link/marker) que carregam um valor por ponto: são eles
+# que dominam o tamanho serializado de uma figura
+ATRIBUTOS_POR_PONTO = (
+    'x', 'y', 'z', 'labels', 'parents', 'values', 'ids', 'text', 'customdata', 'hovertext',
+    'source', 'target', 'value', 'label', 'colors', 'color',
+)
+BYTES_POR_PONTO = 24
+BYTES_BASE_FIGURA = 4 * 2**10
+
+def tamanho_figura(fig):
+    """
+    Estimativa do tamanho serializado da figura (bytes) pela contagem de pontos dos
+    traços, sem serializá-la: o JSON só é gerado pelo st.plotly_chart na renderização.
+    """
+    if fig is None:
+        return 0
+    pontos = 0
+    for traco in fig.data:
+        for objeto in (traco, getattr(traco, 'node', None), getattr(traco, 'link', None), getattr(traco, 'marker', None)):
+            if objeto is None:
+                continue
+            for atributo in ATRIBUTOS_POR_PONTO:
+                if atributo in objeto:
+                    valor = objeto[atributo]
+                    if isinstance(valor, (tuple, list, np.ndarray)):
+                        pontos += len(valor)
+    return BYTES_BASE_FIGURA + BYTES_POR_PONTO * pontos
+
+@st.cache_resource
+def cache_figuras():
+    """
+    Cache de figuras compartilhado entre sessões, limitado pelo tamanho estimado do JSON
+    de cada figura (PAINEL_CACHE_FIGURAS_MB, padrão 64 MB).
+    """
+    limite_mb = int(os.environ.get('PAINEL_CACHE_FIGURAS_MB', 64))
+    return CacheLRU(limite_mb * 2**20, tamanho=tamanho_figura)
+
+def figura_cache(id_grafico, entradas, construir):
+    """
+    Retorna a figura do gráfico `id_grafico` para as `entradas` que a determinam, montando-a
+    com `construir()` só na primeira vez. As entradas são a identidade do cubo de origem
+    (`id_cubos`) e os controles do gráfico (filtros, caminho, zoom, mínimo), não os recortes
+    refeitos a cada rerun: nos reruns em que os filtros não mudam, a chave sai sem percorrer
+    os dados e a montagem da figura (e a preparação feita dentro de `construir`) é pulada.
+    """
+    with medir_secao(f"figura.{id_grafico}"):
+        chave = (id_grafico, impressao_entradas(*entradas))
+        return cache_figuras().obter(chave, construir)
+
+def painel_instrumentacao(registros, segundos_execucao):
+    """
+    Painel de depuração (sidebar): seções medidas neste rerun, na ordem de execução e
+    recuadas por aninhamento, totais acumulados no processo e exportação das medições.
+    """
+    with st.sidebar.expander("🛠️ Instrumentação (Debug)", expanded=True):
+        st.metric("Rerun", f"{segundos_execucao * 1000:,.0f} ms", help="Tempo de parede do script inteiro nesta execução.")
+        st.caption(f"Versão dos dados: {versao_atual}")
+        if not registros:
+            st.caption("Nenhuma seção medida neste rerun.")
+        else:
+            df_reg = pd.DataFrame(registros)
+            df_reg['secao'] = ['· ' * n + s for n, s in zip(df_reg['nivel'], df_reg['secao'])]
+            df_reg['ms'] = df_reg['segundos'] * 1000
+            df_reg['MB'] = df_reg['bytes'] / 2**20
+            st.caption("Seções deste rerun")
+            st.dataframe(
+                df_reg[['secao', 'ms', 'linhas', 'linhas_saida', 'MB']],
+                column_config={
+                    "ms": st.column_config.NumberColumn(format="%.1f"),
+                    "MB": st.column_config.NumberColumn(
+                        "Δ memória do processo (MB)", format="%.2f",
+                        help="Variação da memória do processo inteiro durante a seção: inclui o que outras sessões alocaram no mesmo intervalo."
+                    ),
+                },
+                use_container_width=True, hide_index=True
+            )
+
+        df_tot = pd.DataFrame.from_dict(totais_por_secao(), orient='index')
+        if not df_tot.empty:
+            df_tot['ms_medio'] = df_tot['segundos'] / df_tot['execucoes'] * 1000
+            st.caption("Totais do processo (maiores tempos acumulados)")
+            st.dataframe(
+                df_tot.sort_values('segundos', ascending=False)[['execucoes', 'segundos', 'ms_medio', 'linhas']],
+                column_config={"segundos": st.column_config.NumberColumn(format="%.2f"), "ms_medio": st.column_config.NumberColumn(format="%.1f")},
+                use_container_width=True
+            )
+
+        st.download_button(
+            "Registros do rerun (JSON Lines)", exportar_jsonl(registros, versao=versao_painel, versao_dados=versao_atual),
+            file_name="instrumentacao.jsonl", mime="application/jsonl"
+        )
+        st.download_button(
+            "Totais do processo (Prometheus)", exportar_prometheus(versao_painel),
+            file_name="metrics.prom", mime="text/plain"
+        )
+
 def guia_visual(texto_markdown):
     """
     Cria um botão de ajuda (Popover) com instruções de interpretação dos gráficos.
@@ -132,28 +292,155 @@ def guia_visual(texto_markdown):
 # 5. CARREGAMENTO E TRATAMENTO DE DADOS (ETL)
 # ==============================================================================
 
-@st.cache_data
-def carregar_dados():
-    # Pega o diretório onde este script (app.py) está rodando
-    diretorio_raiz = os.path.dirname(__file__)
+# Exercícios cobertos pelo painel e colunas efetivamente usadas pelos gráficos
+anos_permitidos = [2019, 2020, 2021, 2022, 2023]
+colunas_receita_app = ['ano_exercicio', 'mes', 'nome_origem', 'nome_especie', 'nome_tipo', 'valor_realizado', 'valor_orcado']
+colunas_despesa_app = [
+    'ano_exercicio', 'mes', 'nome_orgao', 'desc_funcao', 'desc_categoria', 'desc_natureza', 'desc_elemento',
+    'valor_orcado', 'valor_empenhado', 'valor_liquidado', 'valor_realizado'
+]
+
+# Cache em disco / plano de dados compartilhado (Arrow IPC mapeado em memória).
+# Com várias réplicas no mesmo host, aponte PAINEL_PASTA_DADOS para memória compartilhada
+# (ex.: /dev/shm/painel_poa): uma réplica carrega e publica, as demais só anexam.
+pasta_dados_compartilhados = os.environ.get(
+    'PAINEL_PASTA_DADOS', os.path.join(os.path.dirname(__file__), 'data', 'cache')
+)
+
+# Motor de consultas: 'pandas' (padrão) carrega todas as linhas dos anos do painel;
+# 'consulta' (PAINEL_MOTOR=consulta) roda filtros e agregações sobre a camada curada
+# e materializa só os cubos e as linhas do item aberto nas tabelas detalhadas.
+# Requer a camada curada do ETL.py; sem ela, o painel segue no modo pandas.
+pasta_curada_app = os.path.join(os.path.dirname(__file__), 'data', 'curado')
+modo_consulta = os.environ.get('PAINEL_MOTOR', 'pandas') == 'consulta' and all(
+    camada_curada_existe(os.path.join(pasta_curada_app, t)) for t in ('receitas', 'despesas')
+)
+
+# Versão dos dados: a do manifesto publicado pelo ETL (data/versao_dados.json) ou, sem ele,
+# a impressão digital (tamanho/mtime) dos arquivos de dados. Todos os caches de dados são
+# chaveados por ela, ou, nos recortes por seleção de anos, pelos checksums das partições
+# (ano, mês) desses anos: quando o ETL regrava um mês, só os caches dos anos afetados mudam.
+# A versão servida é trocada a quente, depois de aquecida (ver `versao_ativa`).
+pasta_dados_app = os.path.join(os.path.dirname(__file__), 'data')
+caminho_versao_dados = os.path.join(pasta_dados_app, ARQUIVO_VERSAO_DADOS)
+fontes_dados = [
+    pasta_curada_app,
+    os.path.join(pasta_dados_app, 'receitas', 'receita.csv'),
+    os.path.join(pasta_dados_app, 'despesas', 'despesas_unificado.csv'),
+    os.path.join(pasta_dados_app, 'dados_sankey_tcc.csv'),
+    os.path.join(pasta_dados_app, 'kpis_snapshot.csv'),
+]
+
+def marca_fontes():
+    """
+    Assinatura barata das origens (sem manifesto): tamanho e mtime dos arquivos, das pastas
+    da camada curada e dos seus _particoes.json, regravados a cada escrita do ETL.
+    """
+    caminhos = fontes_dados + [
+        os.path.join(pasta_curada_app, t, nome) for t in ('receitas', 'despesas') for nome in ('', ARQUIVO_PARTICOES)
+    ]
+    marca = []
+    for caminho in caminhos:
+        try:
+            info = os.stat(caminho)
+            marca.append((caminho, info.st_size, info.st_mtime_ns))
+        except OSError:
+            marca.append((caminho, None, None))
+    return tuple(marca)
+
+@st.cache_data(max_entries=4)
+def versao_sem_manifesto(marca):
+    """
+    Versão e partições dos dados sem o manifesto do ETL. Percorrer a camada curada a cada
+    rerun custaria um stat por arquivo: o resultado é memoizado pela `marca` (ver `marca_fontes`).
+    """
+    versao = chave_cache(fontes_dados)
+    particoes = {t: ler_particoes(os.path.join(pasta_curada_app, t)) for t in ('receitas', 'despesas')}
+    return versao, particoes
+
+def ler_versao_dados():
+    """
+    Versão dos dados em disco: {'versao', 'regras', 'particoes'}. As regras de
+    classificação, aplicadas pelo app na carga, entram pela impressão digital do arquivo.
+    """
+    manifesto = carregar_manifesto(caminho_versao_dados)
+    if manifesto.get('versao'):
+        versao, particoes = manifesto['versao'], manifesto.get('particoes', {})
+    else:
+        versao, particoes = versao_sem_manifesto(marca_fontes())
+    regras = chave_cache([os.path.join(pasta_dados_app, 'regras_classificacao.csv')])[:8]
+    return {
+        'versao': f"{versao}-{regras}",
+        'regras': regras,
+        'particoes': {t: particoes.get(t, {}) for t in ('receitas', 'despesas')},
+    }
+
+def versao_dados(dados, anos=None):
+    """
+    Chave de cache dos dados dos `anos` (todos se None) na versão `dados`. Com a camada
+    curada, muda só quando algum mês desses anos (ou as regras) muda; sem ela, é a versão geral.
+    """
+    if anos is None or not all(dados['particoes'].values()):
+        return dados['versao']
+    return '-'.join([versao_particoes(dados['particoes'][t], anos) for t in ('receitas', 'despesas')] + [dados['regras']])
+
+@st.cache_resource
+def ultimas_cargas():
+    """
+    Última carga incremental de cada tipo no processo (ver `registro_cargas`), com
+    referências fracas aos frames publicados nos caches. Repassado às funções `montar_*`,
+    que também rodam fora das sessões.
+    """
+    return registro_cargas()
+
+def reler_particoes(df, alteradas, ler):
+    """
+    Troca em `df` as linhas das partições `alteradas` (nos anos do painel) pelas de
+    `ler(ano, meses)`, um ano por vez (poda de partição por ano e mês). Retorna um frame
+    novo: `df` vem dos caches e é compartilhado entre sessões.
+    """
+    df = df.copy(deep=False)
+    por_ano = {}
+    for nome in alteradas:
+        if codigo_do_nome(nome) // 100 in anos_permitidos:
+            por_ano.setdefault(codigo_do_nome(nome) // 100, []).append(nome)
+    for ano, nomes in por_ano.items():
+        df = substituir_particoes(df, ler(ano, [codigo_do_nome(n) % 100 for n in nomes]), nomes)
+    return df
+
+def ler_fontes_dados(diretorio_raiz):
+    """
+    Lê receitas e despesas das origens (camada curada ou CSVs) e normaliza as hierarquias.
+    """
+    # Caminho rápido: camada curada (Parquet) gerada pelo ETL.py, já tipada e normalizada.
+    # Lê apenas as partições dos anos do painel e as colunas usadas pelos gráficos.
+    pasta_curada = os.path.join(diretorio_raiz, 'data', 'curado')
+    df_rec = ler_camada_curada(os.path.join(pasta_curada, 'receitas'), anos=anos_permitidos, colunas=colunas_receita_app)
+    df_desp = ler_camada_curada(os.path.join(pasta_curada, 'despesas'), anos=anos_permitidos, colunas=colunas_despesa_app)
+    if df_rec is not None and df_desp is not None:
+        normalizar_categorias(df_rec, COLUNAS_CATEGORICAS_RECEITA)
+        normalizar_categorias(df_desp, COLUNAS_CATEGORICAS_DESPESA)
+        return df_rec, df_desp
     
+    # Fallback: leitura dos CSVs (dataset curado ausente ou pyarrow não instalado)
     # Monta o caminho para a pasta data de forma segura
     path_receitas = os.path.join(diretorio_raiz, 'data', 'receitas', 'receita.csv')
     path_despesas = os.path.join(diretorio_raiz, 'data', 'despesas', 'despesas_unificado.csv')
     
-    # --- Debug (Opcional: Ajuda a ver erros no console do Streamlit se o arquivo não existir) ---
+    # Sem chamadas ao Streamlit aqui (roda também na thread de aquecimento): quem exibe
+    # o erro é `carregar_dados`
     if not os.path.exists(path_receitas):
-        st.error(f"Erro: Arquivo não encontrado em {path_receitas}")
-        st.stop()
+        raise FileNotFoundError(f"Erro: Arquivo não encontrado em {path_receitas}")
         
-    # Conversores para garantir que colunas numéricas sejam lidas corretamente
-    conversores_rec = {'valor_arrecadado': limpar_moeda, 'valor_orcado': limpar_moeda}
+    # Colunas monetárias lidas como texto (engine C) e convertidas em lote
+    colunas_moeda_rec = ['valor_arrecadado', 'valor_orcado']
     
     # Tratamento de encoding (UTF-8 padrão, com fallback para Latin1 se necessário)
     try:
-        df_rec = pd.read_csv(path_receitas, sep=';', encoding='utf-8', converters=conversores_rec)
+        df_rec = pd.read_csv(path_receitas, sep=';', encoding='utf-8', dtype=dtypes_moeda(colunas_moeda_rec))
     except:
-        df_rec = pd.read_csv(path_receitas, sep=';', encoding='latin1', converters=conversores_rec)
+        df_rec = pd.read_csv(path_receitas, sep=';', encoding='latin1', dtype=dtypes_moeda(colunas_moeda_rec))
+    converter_colunas_moeda(df_rec, colunas_moeda_rec)
         
     df_rec.rename(columns={'ano': 'ano_exercicio', 'valor_arrecadado': 'valor_realizado'}, inplace=True)
     
@@ -173,21 +460,372 @@ def carregar_dados():
         'vlliq': 'valor_liquidado'
     }, inplace=True)
     
-    # Padronização de strings (Upper case e strip)
-    if 'desc_funcao' in df_desp.columns: df_desp['desc_funcao'] = df_desp['desc_funcao'].astype(str).str.strip().str.upper()
-    if 'nome_orgao' in df_desp.columns: df_desp['nome_orgao'] = df_desp['nome_orgao'].astype(str).str.strip().str.upper()
+    # Padronização de strings (Upper case e strip) e codificação categórica das hierarquias
+    normalizar_categorias(df_rec, COLUNAS_CATEGORICAS_RECEITA)
+    normalizar_categorias(df_desp, COLUNAS_CATEGORICAS_DESPESA)
         
     return df_rec, df_desp
 
-df_receita, df_despesa = carregar_dados()
+def montar_dados(dados, cargas):
+    """
+    Receitas e despesas normalizadas e classificadas da versão `dados`.
+    Ficam publicadas em `pasta_dados_compartilhados` (Arrow IPC) sob uma chave das
+    impressões digitais das origens e das regras: após um restart, ou numa nova réplica,
+    a carga é a abertura mapeada em memória desse arquivo, sem parse dos CSVs.
+    Com uma versão nova (ver `versao_dados`), só os meses alterados são relidos.
+    """
+    # Pega o diretório onde este script (app.py) está rodando
+    diretorio_raiz = os.path.dirname(__file__)
+    pasta_dados = os.path.join(diretorio_raiz, 'data')
+    path_regras = os.path.join(pasta_dados, 'regras_classificacao.csv')
+
+    # Marcadores booleanos (receita própria, tributária, transferência, corrente/capital)
+    # calculados na carga a partir da tabela de regras e publicados junto com os dados
+    regras = carregar_regras_classificacao(path_regras)
+
+    def completa():
+        with medir_secao('carga.fontes') as registro:
+            df_rec, df_desp = ler_fontes_dados(diretorio_raiz)
+            classificar(df_rec, regras)
+            classificar(df_desp, regras)
+            registro['linhas'] = len(df_rec) + len(df_desp)
+        return df_rec, df_desp
+
+    def ler_linhas(tabela, colunas, categoricas):
+        def ler(ano, meses):
+            df = ler_camada_curada(os.path.join(pasta_curada_app, tabela), anos=[ano], colunas=colunas, filtros={'mes': meses})
+            return classificar(normalizar_categorias(df, categoricas), regras)
+        return ler
+
+    def parcial(anterior, alteradas):
+        with medir_secao('carga.particoes') as registro:
+            df_rec = reler_particoes(anterior[0], alteradas['receitas'], ler_linhas('receitas', colunas_receita_app, COLUNAS_CATEGORICAS_RECEITA))
+            df_desp = reler_particoes(anterior[1], alteradas['despesas'], ler_linhas('despesas', colunas_despesa_app, COLUNAS_CATEGORICAS_DESPESA))
+            registro['linhas'] = sum(len(a) for a in alteradas.values())
+        return normalizar_categorias(df_rec, COLUNAS_CATEGORICAS_RECEITA), normalizar_categorias(df_desp, COLUNAS_CATEGORICAS_DESPESA)
+
+    def carregar():
+        df_rec, df_desp = carga_incremental(cargas, 'linhas', dados['particoes'], completa, parcial, base=regras)
+        return {'receitas': df_rec, 'despesas': df_desp}
+
+    fontes = [
+        os.path.join(pasta_dados, 'curado'),
+        os.path.join(pasta_dados, 'receitas', 'receita.csv'),
+        os.path.join(pasta_dados, 'despesas', 'despesas_unificado.csv'),
+        path_regras,
+    ]
+    chave = chave_cache(fontes, anos_permitidos, colunas_receita_app, colunas_despesa_app, regras)
+    with medir_secao('carga.dados') as registro:
+        frames = anexar_ou_publicar(os.path.join(pasta_dados_compartilhados, 'carga'), chave, ['receitas', 'despesas'], carregar)
+        registro['linhas_saida'] = len(frames['receitas']) + len(frames['despesas'])
+    # A próxima carga parte da cópia mapeada (a privada de `carregar()` já foi liberada)
+    resultado = frames['receitas'], frames['despesas']
+    registrar_carga(cargas, 'linhas', dados['particoes'], regras, resultado)
+    return resultado
+
+# As cargas guardam duas versões: a servida e a que está sendo aquecida para a troca.
+@st.cache_resource(max_entries=2)
+def carregar_dados(versao, _dados):
+    """
+    Receitas e despesas (`montar_dados`), compartilhadas sem cópia entre sessões e entre
+    réplicas (somente leitura). `_dados` é a versão completa (partições), fora da chave do cache.
+    """
+    pronto = retirar_aquecido(versao, 'dados')
+    if pronto is not None:
+        return pronto
+    try:
+        return montar_dados(_dados, ultimas_cargas())
+    except FileNotFoundError as erro:
+        st.error(str(erro))
+        parar()
+
+def montar_cubos(dados, cargas, frames=None):
+    """
+    Cubos de agregados (ano, mês e hierarquias) da versão `dados`, montados a partir das
+    linhas em `frames` (modo pandas) ou agregados na camada curada (modo consulta).
+    Os gráficos fazem roll-up a partir deles em vez de reagrupar as linhas brutas.
+    Com uma versão nova, só os meses alterados são reagregados e trocados nos cubos.
+    Os marcadores das regras de classificação são dimensões dos cubos: com outras regras
+    (mesmas partições), a carga é completa.
+    """
+    regras = carregar_regras_classificacao(os.path.join(os.path.dirname(__file__), 'data', 'regras_classificacao.csv'))
+    if modo_consulta:
+        def agregar_cubo(tabela, dimensoes, medidas, categoricas):
+            def ler(anos, meses=None):
+                filtros = None if meses is None else {'mes': meses}
+                cubo = agregar_camada_curada(os.path.join(pasta_curada_app, tabela), dimensoes, medidas, anos=anos, filtros=filtros)
+                return classificar(normalizar_categorias(cubo, categoricas), regras)
+            return ler
+        cubo_receita = agregar_cubo('receitas', DIMENSOES_RECEITA, MEDIDAS_RECEITA, COLUNAS_CATEGORICAS_RECEITA)
+        cubo_despesa = agregar_cubo('despesas', DIMENSOES_DESPESA, MEDIDAS_DESPESA, COLUNAS_CATEGORICAS_DESPESA)
+        ler_rec = lambda ano, meses: cubo_receita([ano], meses)
+        ler_desp = lambda ano, meses: cubo_despesa([ano], meses)
+        completa = lambda: (cubo_receita(anos_permitidos), cubo_despesa(anos_permitidos))
+    else:
+        df_rec, df_desp = frames
+        ler_rec = lambda ano, meses: construir_cubo_receita(df_rec[codigo_particao(df_rec).isin([ano * 100 + m for m in meses])])
+        ler_desp = lambda ano, meses: construir_cubo_despesa(df_desp[codigo_particao(df_desp).isin([ano * 100 + m for m in meses])])
+        completa = lambda: (construir_cubo_receita(df_rec), construir_cubo_despesa(df_desp))
+
+    def parcial(anterior, alteradas):
+        cubo_rec = reler_particoes(anterior[0], alteradas['receitas'], ler_rec)
+        cubo_desp = reler_particoes(anterior[1], alteradas['despesas'], ler_desp)
+        return normalizar_categorias(cubo_rec, COLUNAS_CATEGORICAS_RECEITA), normalizar_categorias(cubo_desp, COLUNAS_CATEGORICAS_DESPESA)
+
+    nome = 'cubos_consulta' if modo_consulta else 'cubos'
+    resultado = carga_incremental(cargas, nome, dados['particoes'], completa, parcial, base=regras)
+    registrar_carga(cargas, nome, dados['particoes'], regras, resultado)
+    return resultado
+
+@st.cache_resource(max_entries=2)
+def carregar_cubos(versao, _dados):
+    """
+    Cubos de agregados (`montar_cubos`), montados uma vez por carga de dados e
+    compartilhados sem cópia entre sessões (somente leitura).
+    """
+    pronto = retirar_aquecido(versao, 'cubos')
+    if pronto is not None:
+        return pronto
+    frames = None if modo_consulta else carregar_dados(versao, _dados)
+    return montar_cubos(_dados, ultimas_cargas(), frames)
+
+def montar_visoes_ano(anos, cubos, frames=None):
+    """
+    (rec_ano, desp_ano, cubo_rec_ano, cubo_ano) dos `anos`, já com `mes_num` e hierarquias
+    preenchidas. Sem `frames` (modo consulta) as linhas brutas não são carregadas
+    (rec_ano e desp_ano são None): as tabelas detalhadas usam `linhas_do_item`.
+    """
+    cubo_rec, cubo_desp = cubos
+    if frames is None:
+        return (
+            None, None,
+            preparar_visao(cubo_rec, list(anos), COLUNAS_HIERARQUIA_RECEITA, "NÃO CLASSIFICADO"),
+            preparar_visao(cubo_desp, list(anos), COLUNAS_HIERARQUIA_DESPESA, "NÃO INFORMADO"),
+        )
+    return preparar_visoes_ano(frames[0], frames[1], cubo_rec, cubo_desp, anos)
+
+@st.cache_resource(max_entries=32)
+def obter_visoes_ano(anos, versao, _dados):
+    """
+    Recortes por seleção de anos (tupla ordenada, ver `montar_visoes_ano`), memorizados
+    entre reruns e sessões. Compartilhados sem cópia: somente leitura (use .copy() antes
+    de alterar). `versao` = versao_dados(_dados, anos): as seleções sem meses alterados
+    pelo último refresh continuam no cache.
+    """
+    pronto = retirar_aquecido(_dados['versao'], ('visoes', anos))
+    if pronto is not None:
+        return pronto
+    cubos = carregar_cubos(_dados['versao'], _dados)
+    frames = None if modo_consulta else carregar_dados(_dados['versao'], _dados)
+    return montar_visoes_ano(anos, cubos, frames)
+
+@st.cache_resource(max_entries=32)
+def obter_arvore(tabela, anos, versao, caminho, profundidade, valor_minimo, _dados):
+    """
+    Árvore pré-agregada (`agregar_arvore`) do cubo de `tabela` ('receitas'/'despesas') nos
+    `anos`, memorizada por versão e controles: o gráfico em cache e a legenda de "OUTROS"
+    usam a mesma agregação, feita uma vez. Somente leitura.
+    """
+    _, _, cubo_rec, cubo_desp = obter_visoes_ano(anos, versao, _dados)
+    cubo = cubo_rec if tabela == 'receitas' else cubo_desp
+    return agregar_arvore(cubo, list(caminho), profundidade, valor_minimo=valor_minimo)
+
+@st.cache_data(max_entries=64)
+def consultar_linhas_item(tabela, anos, coluna, valor, versao):
+    """
+    Modo consulta: lê da camada curada só as linhas de `coluna == valor` nos `anos`.
+    O rótulo de nulos das visões ("NÃO INFORMADO"/"NÃO CLASSIFICADO") também seleciona os nulos.
+    """
+    hierarquia, rotulo_vazio = {
+        'receitas': (COLUNAS_HIERARQUIA_RECEITA, "NÃO CLASSIFICADO"),
+        'despesas': (COLUNAS_HIERARQUIA_DESPESA, "NÃO INFORMADO"),
+    }[tabela]
+    colunas = colunas_receita_app if tabela == 'receitas' else colunas_despesa_app
+    filtro = [valor, None] if valor == rotulo_vazio else valor
+    df = ler_camada_curada(os.path.join(pasta_curada_app, tabela), anos=list(anos), colunas=colunas, filtros={coluna: filtro})
+    normalizar_categorias(df, COLUNAS_CATEGORICAS_RECEITA if tabela == 'receitas' else COLUNAS_CATEGORICAS_DESPESA)
+    visao = preparar_visao(df, list(anos), hierarquia, rotulo_vazio)
+    return visao[visao[coluna] == valor]
+
+def linhas_do_item(visao, tabela, anos, coluna, valor, versao):
+    """
+    Linhas brutas de um item para as tabelas detalhadas: recorte da visão já carregada
+    (modo pandas) ou consulta filtrada à camada curada (modo consulta).
+    """
+    if visao is None:
+        return consultar_linhas_item(tabela, anos, coluna, valor, versao)
+    return visao[visao[coluna] == valor]
+
+@st.cache_resource(max_entries=32)
+def obter_indice_tabela(tabela, anos, coluna, valor, versao, _dados):
+    """
+    Índice de busca e ordenação das linhas de um item (tabelas detalhadas paginadas):
+    montado uma vez por item e seleção de anos, compartilhado entre sessões.
+    """
+    rec_ano, desp_ano, _, _ = obter_visoes_ano(anos, versao, _dados)
+    if tabela == 'receitas':
+        linhas = linhas_do_item(rec_ano, tabela, anos, coluna, valor, versao)
+        return IndiceTabela(linhas, 'nome_tipo', colunas=['mes', 'nome_especie', 'nome_tipo', 'valor_realizado'])
+    linhas = linhas_do_item(desp_ano, tabela, anos, coluna, valor, versao)
+    return IndiceTabela(linhas, 'desc_elemento', colunas=['mes', 'desc_elemento', 'valor_orcado', 'valor_empenhado', 'valor_liquidado', 'valor_realizado'])
+
+@st.cache_data(max_entries=2)
+def carregar_snapshot_kpis(versao):
+    """
+    Tabela de KPIs por ano / ano x mês materializada pelo ETL.py (ou None se ausente).
+    É lida antes dos dados detalhados para o cabeçalho aparecer de imediato. Se as regras
+    de classificação mudaram desde o ETL, o snapshot é descartado (None) e os KPIs são
+    calculados a partir dos cubos, já reclassificados, até o próximo ETL.
+    """
+    pasta_dados = os.path.join(os.path.dirname(__file__), 'data')
+    path_kpis = os.path.join(pasta_dados, 'kpis_snapshot.csv')
+    if not os.path.exists(path_kpis):
+        return None
+    snapshot = pd.read_csv(path_kpis, sep=';', decimal=',', float_precision='round_trip', dtype={'regras': str})
+    regras = impressao_regras(carregar_regras_classificacao(os.path.join(pasta_dados, 'regras_classificacao.csv')))
+    if 'regras' not in snapshot.columns or (snapshot['regras'] != regras).any():
+        logging.getLogger('painel').info("Snapshot de KPIs gerado com outras regras de classificação: KPIs calculados ao vivo")
+        return None
+    return snapshot
+
+@st.cache_resource(max_entries=2)
+def obter_anos_nos_dados(versao, _dados):
+    snapshot = carregar_snapshot_kpis(versao)
+    if snapshot is not None:
+        return sorted(snapshot['ano_exercicio'].unique())
+    if modo_consulta:
+        cubo_rec, _ = carregar_cubos(versao, _dados)
+        return sorted(cubo_rec['ano_exercicio'].unique())
+    df_rec, _ = carregar_dados(versao, _dados)
+    return sorted(df_rec['ano_exercicio'].unique())
+
+def ler_sankey_pronto(path_sankey):
+    """
+    Tabela do Sankey gerada pelo ETL.py, publicada no mesmo plano de dados compartilhado.
+    """
+    def carregar():
+        return {'sankey': pd.read_csv(path_sankey, sep=';', decimal=',')}
+    chave = chave_cache([path_sankey])
+    return anexar_ou_publicar(os.path.join(pasta_dados_compartilhados, 'sankey'), chave, ['sankey'], carregar)['sankey']
+
+@st.cache_resource(max_entries=2)
+def carregar_sankey_pronto(path_sankey, versao):
+    """Tabela do Sankey (`ler_sankey_pronto`), relida só quando a `versao` dos dados muda."""
+    return ler_sankey_pronto(path_sankey)
 
 # Caminho seguro para o arquivo do Sankey
 diretorio_raiz = os.path.dirname(__file__)
 path_sankey = os.path.join(diretorio_raiz, 'data', 'dados_sankey_tcc.csv')
 
+# --- 5.1 Versão Ativa dos Dados (Troca a Quente Após o ETL) ---
+# A versão nova é montada por uma thread só com as funções comuns (`montar_*`): os caches
+# do Streamlit e os elementos st.* pertencem à execução de uma sessão. A thread deixa o
+# resultado no estado compartilhado, e a primeira execução seguinte troca a versão e
+# popula os caches com ele (os `carregar_*`/`obter_*` retiram o que já foi montado).
+INTERVALO_NOVA_TENTATIVA = 60
+
+@st.cache_resource
+def estado_versoes():
+    """
+    Troca de versão, compartilhada entre sessões: versão servida (`ativa`), em aquecimento
+    (`aquecendo`), aquecida e ainda não servida (`pronta`, com o que foi montado em
+    `prontos`) e o instante da última falha de aquecimento de cada versão (`falhas`).
+    """
+    return {'trava': threading.Lock(), 'ativa': None, 'aquecendo': None, 'pronta': None, 'prontos': {}, 'falhas': {}}
+
+def retirar_aquecido(versao, nome):
+    """Resultado `nome` montado pela thread de aquecimento para a `versao` (e o descarta), ou None."""
+    estado = estado_versoes()
+    with estado['trava']:
+        return estado['prontos'].get(versao, {}).pop(nome, None)
+
+def montar_versao(dados, cargas):
+    """
+    Monta a versão `dados` sem chamadas ao Streamlit: linhas (modo pandas), cubos e o recorte
+    do último ano (seleção padrão), e publica o Sankey do ETL no plano de dados compartilhado.
+    """
+    frames = None if modo_consulta else montar_dados(dados, cargas)
+    cubos = montar_cubos(dados, cargas, frames)
+    anos = sorted(a for a in cubos[0]['ano_exercicio'].unique() if a in anos_permitidos) or anos_permitidos
+    padrao = (int(anos[-1]),)
+    prontos = {'cubos': cubos, ('visoes', padrao): montar_visoes_ano(padrao, cubos, frames)}
+    if frames is not None:
+        prontos['dados'] = frames
+    if os.path.exists(path_sankey):
+        ler_sankey_pronto(path_sankey)
+    return prontos
+
+def aquecer(dados, estado, cargas):
+    """
+    Thread de aquecimento: monta a versão nova fora das sessões e a deixa `pronta`; as
+    sessões seguem na anterior até lá. Se falhar, a marca de aquecimento é limpa e a
+    versão é retentada após INTERVALO_NOVA_TENTATIVA segundos.
+    """
+    versao = dados['versao']
+    try:
+        with medir_secao('carga.aquecimento'):
+            prontos = montar_versao(dados, cargas)
+    except Exception:
+        logging.getLogger('painel').exception("Falha ao aquecer a versão %s dos dados", versao)
+        with estado['trava']:
+            estado['falhas'][versao] = time.monotonic()
+            if estado['aquecendo'] == versao:
+                estado['aquecendo'] = None
+        return
+    with estado['trava']:
+        # Só a última versão aquecida fica retida: uma anterior ainda não servida é descartada
+        estado['pronta'], estado['prontos'] = dados, {versao: prontos}
+        estado['falhas'].pop(versao, None)
+        if estado['aquecendo'] == versao:
+            estado['aquecendo'] = None
+
+def popular_caches(dados):
+    """Primeira execução da versão trocada: leva aos caches o que a thread montou."""
+    versao = dados['versao']
+    carregar_snapshot_kpis(versao)
+    if os.path.exists(path_sankey):
+        carregar_sankey_pronto(path_sankey, versao)
+    anos = [a for a in obter_anos_nos_dados(versao, dados) if a in anos_permitidos] or anos_permitidos
+    obter_visoes_ano((anos[-1],), versao_dados(dados, (anos[-1],)), dados)
+    # O que não foi consumido (ex.: recorte de outro ano padrão) é liberado
+    estado = estado_versoes()
+    with estado['trava']:
+        estado['prontos'].pop(versao, None)
+
+def versao_ativa():
+    """
+    Versão dos dados servida nesta execução. A primeira execução do processo usa a versão
+    em disco (carga a frio). Quando o ETL publica outra, uma única thread a aquece enquanto
+    todas as sessões seguem na anterior; a execução que encontra a versão pronta faz a troca
+    (atribuição de `ativa`) e popula os caches. Nenhuma sessão espera a carga nova, e ela
+    roda uma vez por processo (não uma por sessão).
+    """
+    em_disco = ler_versao_dados()
+    estado = estado_versoes()
+    cargas = ultimas_cargas()
+    trocada = None
+    with estado['trava']:
+        if estado['ativa'] is None:
+            estado['ativa'] = em_disco
+        if estado['pronta'] is not None:
+            estado['ativa'], trocada, estado['pronta'] = estado['pronta'], estado['pronta'], None
+        versao = em_disco['versao']
+        falha = estado['falhas'].get(versao)
+        recente = falha is not None and time.monotonic() - falha < INTERVALO_NOVA_TENTATIVA
+        if versao not in (estado['ativa']['versao'], estado['aquecendo']) and not recente:
+            estado['aquecendo'] = versao
+            threading.Thread(target=aquecer, args=(em_disco, estado, cargas), name='aquecimento-dados', daemon=True).start()
+        ativa = estado['ativa']
+    if trocada is not None:
+        popular_caches(trocada)
+    return ativa
+
+dados_ativos = versao_ativa()
+versao_atual = dados_ativos['versao']
+
 # Verifica se existe antes de ler
 if os.path.exists(path_sankey):
-    df_sankey_ready = pd.read_csv(path_sankey, sep=';', decimal=',')
+    df_sankey_ready = carregar_sankey_pronto(path_sankey, versao_atual)
 else:
     st.error("Arquivo 'dados_sankey_tcc.csv' não encontrado na pasta data.")
     # Cria um dataframe vazio para não quebrar o app
@@ -199,8 +837,7 @@ else:
 st.sidebar.title("Configurações")
 st.sidebar.markdown("### 📅 Exercício Fiscal")
 
-anos_permitidos = [2019, 2020, 2021, 2022, 2023]
-anos_nos_dados = sorted(df_receita['ano_exercicio'].unique())
+anos_nos_dados = obter_anos_nos_dados(versao_atual, dados_ativos)
 anos_disp = [a for a in anos_nos_dados if a in anos_permitidos]
 if not anos_disp: anos_disp = anos_permitidos
 opcoes_ano = anos_disp + ["COMPARADOR DE ANOS"]
@@ -235,9 +872,13 @@ with st.sidebar.expander("🔍 Siglas Comuns"):
 
 st.markdown("---")
 
-# Aplicação dos filtros temporais nos dataframes
-rec_ano = df_receita[df_receita['ano_exercicio'].isin(lista_anos_filtro)]
-desp_ano = df_despesa[df_despesa['ano_exercicio'].isin(lista_anos_filtro)]
+# Aplicação dos filtros temporais: recortes memorizados por seleção de anos.
+# Os cubos são a base de todos os gráficos; as linhas brutas ficam para as tabelas.
+# Cada módulo carrega os recortes só depois de exibir o seu cabeçalho.
+chave_anos = tuple(sorted(lista_anos_filtro))
+versao_anos = versao_dados(dados_ativos, chave_anos)
+# Identidade de cubo_rec_ano/cubo_ano: com os controles de cada gráfico, forma a chave das figuras em cache
+id_cubos = (chave_anos, versao_anos)
 
 # ==============================================================================
 # 8. MÓDULO: DESPESAS X RECEITAS (BALANÇO GERAL)
@@ -248,27 +889,25 @@ if visao_selecionada == "DESPESAS X RECEITAS":
     st.caption("Monitor de Saúde Financeira: Entradas vs Saídas")
     box_educativo("O Equilíbrio das Contas", ["orcamento", "superavit"])
     
-    # Cálculo de KPIs Globais
-    total_rec = rec_ano['valor_realizado'].sum()
-    total_desp = desp_ano['valor_realizado'].sum()
-    resultado = total_rec - total_desp
+    # KPIs Globais (inclui a estimativa de Receita Própria vs Total): vêm do snapshot do ETL,
+    # sem tocar nos dados detalhados; sem snapshot, são calculados a partir dos cubos
+    kpis = kpis_do_snapshot(carregar_snapshot_kpis(versao_atual), chave_anos)
+    if kpis is None:
+        _, _, cubo_rec_ano, cubo_ano = obter_visoes_ano(chave_anos, versao_anos, dados_ativos)
+        kpis = kpis_balanco(cubo_rec_ano, cubo_ano)
+    total_rec, total_desp, resultado = kpis['total_receita'], kpis['total_despesa'], kpis['resultado']
+    autonomia_pct = kpis['autonomia_pct']
     status_cor = "#00FF99" if resultado >= 0 else "#FF0055"
-    
-    # Estimativa de Receita Própria vs Total
-    if 'nome_origem' in rec_ano.columns:
-        rec_propria = rec_ano[rec_ano['nome_origem'].str.contains('TRIBUTÁRIA|PATRIMONIAL|SERVIÇOS', case=False, na=False)]['valor_realizado'].sum()
-    else:
-        rec_propria = 0
-    autonomia_pct = (rec_propria / total_rec * 100) if total_rec > 0 else 0
 
     # Exibição dos Cards (KPIs)
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
     kpi1.metric("💰 RECEITA TOTAL", formatar_br(total_rec), delta="Entradas de Caixa")
     kpi2.metric("💸 DESPESA TOTAL", formatar_br(total_desp), delta="-Saídas de Caixa", delta_color="inverse")
-    kpi3.metric("⚖️ RESULTADO", formatar_br(resultado), delta=f"{(resultado/total_rec*100):.1f}% de Margem" if total_rec else None, delta_color="normal" if resultado >=0 else "inverse")
+    kpi3.metric("⚖️ RESULTADO", formatar_br(resultado), delta=f"{kpis['margem_pct']:.1f}% de Margem" if total_rec else None, delta_color="normal" if resultado >=0 else "inverse")
     kpi4.metric("🏛️ AUTONOMIA FISCAL", f"{autonomia_pct:.1f}%", help="% de Receitas Próprias (Tributária, Patrimonial, Serviços) sobre o Total.")
 
     st.markdown("---")
+    rec_ano, desp_ano, cubo_rec_ano, cubo_ano = obter_visoes_ano(chave_anos, versao_anos, dados_ativos)
 
     # Sub-navegação do Módulo
     modo_balanco = st.radio(
@@ -328,61 +967,33 @@ if visao_selecionada == "DESPESAS X RECEITAS":
         with c_sk2:
             top_n_desp = st.slider("🔍 Zoom Despesas (Top Funções):", 3, 20, 8)
 
-        # Preparação dos dados para o Sankey
-        # Lado Esquerdo: Receitas
-        grp_rec = rec_ano.groupby('nome_origem')['valor_realizado'].sum().reset_index()
-        grp_rec.sort_values('valor_realizado', ascending=False, inplace=True)
-        top_origens = grp_rec.head(top_n_rec)['nome_origem'].tolist()
-        rec_ano['origem_sankey'] = rec_ano['nome_origem'].apply(lambda x: x if x in top_origens else 'OUTRAS FONTES')
-        
-        df_flow_in = rec_ano.groupby('origem_sankey')['valor_realizado'].sum().reset_index()
-        df_flow_in['source'] = df_flow_in['origem_sankey']
-        df_flow_in['target'] = "TESOURO MUNICIPAL"
-        df_flow_in['color_link'] = "rgba(0, 255, 153, 0.3)"
-
-        # Lado Direito: Despesas
-        grp_desp = desp_ano.groupby('desc_funcao')['valor_realizado'].sum().reset_index()
-        grp_desp.sort_values('valor_realizado', ascending=False, inplace=True)
-        top_funcoes = grp_desp.head(top_n_desp)['desc_funcao'].tolist()
-        desp_ano['funcao_sankey'] = desp_ano['desc_funcao'].apply(lambda x: x if x in top_funcoes else 'OUTRAS FUNÇÕES')
-        
-        df_flow_out = desp_ano.groupby('funcao_sankey')['valor_realizado'].sum().reset_index()
-        df_flow_out['source'] = "TESOURO MUNICIPAL"
-        df_flow_out['target'] = df_flow_out['funcao_sankey']
-        df_flow_out['color_link'] = "rgba(255, 0, 85, 0.3)"
-
-        # União dos fluxos e construção do gráfico
-        all_flows = pd.concat([df_flow_in[['source', 'target', 'valor_realizado', 'color_link']], 
-                               df_flow_out[['source', 'target', 'valor_realizado', 'color_link']]])
-        
-        all_nodes = list(pd.concat([all_flows['source'], all_flows['target']]).unique())
-        node_map = {name: i for i, name in enumerate(all_nodes)}
-        
-        node_colors = []
-        for n in all_nodes:
-            if n == "TESOURO MUNICIPAL": node_colors.append("#FFFFFF")
-            elif n in df_flow_in['source'].values: node_colors.append("#00FF99")
-            else: node_colors.append("#FF0055")
-
-        fig_sankey_int = go.Figure(data=[go.Sankey(
-            node=dict(
-                pad=15, thickness=20, line=dict(color="black", width=0.5),
-                label=all_nodes, color=node_colors,
-                hovertemplate='%{label}<br>Total: R$ %{value:,.2f}<extra></extra>'
-            ),
-            link=dict(
-                source=all_flows['source'].map(node_map),
-                target=all_flows['target'].map(node_map),
-                value=all_flows['valor_realizado'],
-                color=all_flows['color_link']
+        def construir_sankey_integrado():
+            # Preparação dos dados para o Sankey (Receitas à esquerda, Despesas à direita)
+            all_flows, all_nodes, node_colors = fluxo_integrado(cubo_rec_ano, cubo_ano, top_n_rec, top_n_desp)
+            node_map = {name: i for i, name in enumerate(all_nodes)}
+
+            fig = go.Figure(data=[go.Sankey(
+                node=dict(
+                    pad=15, thickness=20, line=dict(color="black", width=0.5),
+                    label=all_nodes, color=node_colors,
+                    hovertemplate='%{label}<br>Total: R$ %{value:,.2f}<extra></extra>'
+                ),
+                link=dict(
+                    source=all_flows['source'].map(node_map),
+                    target=all_flows['target'].map(node_map),
+                    value=all_flows['valor_realizado'],
+                    color=all_flows['color_link']
+                )
+            )])
+            
+            fig.update_layout(
+                title="Fluxo Integrado de Recursos",
+                height=600, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)",
+                font=dict(family="Orbitron", size=12)
             )
-        )])
-        
-        fig_sankey_int.update_layout(
-            title="Fluxo Integrado de Recursos",
-            height=600, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)",
-            font=dict(family="Orbitron", size=12)
-        )
+            return fig
+
+        fig_sankey_int = figura_cache('sankey_integrado', (id_cubos, top_n_rec, top_n_desp), construir_sankey_integrado)
         st.plotly_chart(fig_sankey_int, use_container_width=True)
 
         st.markdown("---")
@@ -397,15 +1008,7 @@ if visao_selecionada == "DESPESAS X RECEITAS":
         * **Atenção:** Se a linha vermelha cruzar a verde e ficar por cima, significa que naquele mês o município gastou mais do que arrecadou (Déficit Mensal).
         """)
         
-        r_mes = rec_ano.groupby(['mes'])['valor_realizado'].sum().reset_index()
-        d_mes = desp_ano.groupby(['mes'])['valor_realizado'].sum().reset_index()
-        
-        df_time = pd.merge(r_mes, d_mes, on='mes', suffixes=('_rec', '_desp'))
-        try:
-            df_time['mes_num'] = pd.to_numeric(df_time['mes'])
-            df_time.sort_values('mes_num', inplace=True)
-        except:
-            pass
+        df_time = balanco_mensal(cubo_rec_ano, cubo_ano)
             
         fig_line_mix = go.Figure()
         fig_line_mix.add_trace(go.Scatter(x=df_time['mes'], y=df_time['valor_realizado_rec'], mode='lines+markers', name='Receitas', line=dict(color='#00FF99', width=3)))
@@ -421,44 +1024,51 @@ if visao_selecionada == "DESPESAS X RECEITAS":
         
         with col_c1:
             st.markdown("#### 📥 Origem (Receitas)")
-            if 'nome_especie' in rec_ano.columns:
-                df_sun_r = rec_ano.copy()
-                cols_rec_fix = ['nome_origem', 'nome_especie']
-                for c in cols_rec_fix:
-                    df_sun_r[c] = df_sun_r[c].fillna("NÃO CLASSIFICADO").replace('', 'NÃO CLASSIFICADO')
-                
-                df_sun_r_agg = df_sun_r.groupby(['nome_origem', 'nome_especie'])['valor_realizado'].sum().reset_index()
-                df_sun_r_agg = df_sun_r_agg[df_sun_r_agg['valor_realizado'] > 0]
-                
-                fig_sun_rec = px.sunburst(df_sun_r_agg, path=['nome_origem', 'nome_especie'], values='valor_realizado', color_discrete_sequence=px.colors.sequential.Emrld)
-                fig_sun_rec.update_layout(height=350, margin=dict(t=0, b=0, l=0, r=0), paper_bgcolor="rgba(0,0,0,0)")
+            if 'nome_especie' in cubo_rec_ano.columns:
+                def construir_sunburst_origem():
+                    df_sun_r = agregar(cubo_rec_ano, ['nome_origem', 'nome_especie'], medidas=['valor_realizado'], dropna=False)
+                    cols_rec_fix = ['nome_origem', 'nome_especie']
+                    for c in cols_rec_fix:
+                        df_sun_r[c] = df_sun_r[c].replace('', 'NÃO CLASSIFICADO')
+                    
+                    df_sun_r_agg = agregar_arvore(df_sun_r, ['nome_origem', 'nome_especie'])
+                    
+                    fig = px.sunburst(df_sun_r_agg, path=['nome_origem', 'nome_especie'], values='valor_realizado', color_discrete_sequence=px.colors.sequential.Emrld)
+                    fig.update_layout(height=350, margin=dict(t=0, b=0, l=0, r=0), paper_bgcolor="rgba(0,0,0,0)")
+                    return fig
+
+                fig_sun_rec = figura_cache('sunburst_origem', (id_cubos,), construir_sunburst_origem)
                 st.plotly_chart(fig_sun_rec, use_container_width=True)
         
         with col_c2:
             st.markdown("#### 📤 Destino (Despesas)")
-            if 'desc_funcao' in desp_ano.columns:
-                df_sun_d = desp_ano.copy()
-                cols_desp_fix = ['desc_funcao', 'desc_categoria']
-                for c in cols_desp_fix:
-                    df_sun_d[c] = df_sun_d[c].fillna("NÃO CLASSIFICADO").replace('', 'NÃO CLASSIFICADO')
-                
-                df_sun_d_agg = df_sun_d.groupby(['desc_funcao', 'desc_categoria'])['valor_realizado'].sum().reset_index()
-                df_sun_d_agg = df_sun_d_agg[df_sun_d_agg['valor_realizado'] > 0]
-
-                fig_sun_desp = px.sunburst(df_sun_d_agg, path=['desc_funcao', 'desc_categoria'], values='valor_realizado', color_discrete_sequence=px.colors.sequential.RdBu)
-                fig_sun_desp.update_layout(height=350, margin=dict(t=0, b=0, l=0, r=0), paper_bgcolor="rgba(0,0,0,0)")
+            if 'desc_funcao' in cubo_ano.columns:
+                def construir_sunburst_destino():
+                    df_sun_d = agregar(cubo_ano, ['desc_funcao', 'desc_categoria'], medidas=['valor_realizado'], dropna=False)
+                    cols_desp_fix = ['desc_funcao', 'desc_categoria']
+                    for c in cols_desp_fix:
+                        df_sun_d[c] = df_sun_d[c].replace('', 'NÃO CLASSIFICADO')
+                    
+                    df_sun_d_agg = agregar_arvore(df_sun_d, ['desc_funcao', 'desc_categoria'])
+
+                    fig = px.sunburst(df_sun_d_agg, path=['desc_funcao', 'desc_categoria'], values='valor_realizado', color_discrete_sequence=px.colors.sequential.RdBu)
+                    fig.update_layout(height=350, margin=dict(t=0, b=0, l=0, r=0), paper_bgcolor="rgba(0,0,0,0)")
+                    return fig
+
+                fig_sun_desp = figura_cache('sunburst_destino', (id_cubos,), construir_sunburst_destino)
                 st.plotly_chart(fig_sun_desp, use_container_width=True)
 
     # --- ABA 2: VISÃO DETALHADA (DRILL-DOWN) ---
     elif modo_balanco == "VISÃO DETALHADA (Por Área)":
         st.markdown("### 🔭 Zoom: Análise Específica por Área")
         
-        lista_funcoes = sorted(desp_ano['desc_funcao'].unique())
+        lista_funcoes = sorted(cubo_ano['desc_funcao'].unique())
         funcao_sel = st.selectbox("Selecione a Função de Governo (Área de Gasto):", lista_funcoes)
         
         # Contextualização da área selecionada
-        df_d_foco = desp_ano[desp_ano['desc_funcao'] == funcao_sel]
-        v_gasto_area = df_d_foco['valor_realizado'].sum()
+        filtro_area = {'desc_funcao': funcao_sel}
+        funil_area = funil_execucao(cubo_ano, filtros=filtro_area)
+        v_gasto_area = funil_area['valor'].iloc[-1]
         pct_orcamento = (v_gasto_area / total_desp * 100) if total_desp > 0 else 0
         
         col_det1, col_det2, col_det3 = st.columns([1, 1, 2])
@@ -476,14 +1086,8 @@ if visao_selecionada == "DESPESAS X RECEITAS":
         
         with c_funil:
             st.subheader("Funil de Execução")
-            vals = [
-                df_d_foco['valor_orcado'].sum(), 
-                df_d_foco['valor_empenhado'].sum(), 
-                df_d_foco['valor_liquidado'].sum(), 
-                df_d_foco['valor_realizado'].sum()
-            ]
             fig_fun = go.Figure(go.Funnel(
-                y=["Orçado", "Empenhado", "Liquidado", "Pago"], x=vals,
+                y=funil_area['etapa'].tolist(), x=funil_area['valor'].tolist(),
                 texttemplate="%{value:,.2s}", marker={"color": ["#002233", "#005577", "#0099AA", "#00F3FF"]}
             ))
             fig_fun.update_layout(height=300, showlegend=False, paper_bgcolor="rgba(0,0,0,0)", margin=dict(t=20, b=20))
@@ -491,16 +1095,16 @@ if visao_selecionada == "DESPESAS X RECEITAS":
             
         with c_timeline:
             st.subheader("Timeline: Desembolso Específico")
-            if 'mes' in df_d_foco.columns:
-                time_foco = df_d_foco.groupby('mes')['valor_realizado'].sum().reset_index()
+            if 'mes' in cubo_ano.columns:
+                time_foco = serie_mensal(cubo_ano, filtros=filtro_area)
                 fig_tf = px.bar(time_foco, x='mes', y='valor_realizado', title=f"Pagamentos Mensais - {funcao_sel}")
                 fig_tf.update_traces(marker_color='#00F3FF')
                 fig_tf.update_layout(height=300, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)")
                 st.plotly_chart(fig_tf, use_container_width=True)
 
         st.subheader("Onde o dinheiro desta área foi parar?")
-        if 'desc_elemento' in df_d_foco.columns:
-            top_elem = df_d_foco.groupby('desc_elemento')['valor_realizado'].sum().nlargest(10).reset_index()
+        if 'desc_elemento' in cubo_ano.columns:
+            top_elem = ranking(cubo_ano, 'desc_elemento', n=10, filtros=filtro_area)
             fig_bar_elem = px.bar(top_elem, x='valor_realizado', y='desc_elemento', orientation='h', title="Top 10 Itens de Despesa")
             fig_bar_elem.update_layout(yaxis=dict(autorange="reversed"), template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)")
             st.plotly_chart(fig_bar_elem, use_container_width=True)
@@ -514,23 +1118,15 @@ if visao_selecionada == "DESPESAS X RECEITAS":
         with col_sel_comp1:
             eixo_x = st.selectbox("Eixo X (Causa?):", ["Receita Total", "Receita Tributária (Própria)", "Transferências"])
         with col_sel_comp2:
-            eixo_y = st.multiselect("Eixo Y (Efeito?):", lista_funcoes if 'lista_funcoes' in locals() else sorted(desp_ano['desc_funcao'].unique()), default=["SAÚDE", "EDUCAÇÃO"] if "SAÚDE" in sorted(desp_ano['desc_funcao'].unique()) else None)
+            eixo_y = st.multiselect("Eixo Y (Efeito?):", lista_funcoes if 'lista_funcoes' in locals() else sorted(cubo_ano['desc_funcao'].unique()), default=["SAÚDE", "EDUCAÇÃO"] if "SAÚDE" in sorted(cubo_ano['desc_funcao'].unique()) else None)
 
         if not eixo_y:
             st.warning("Selecione pelo menos uma função de despesa.")
-            st.stop()
+            parar()
 
         # Preparação dos dados para correlação (Scatterplot)
-        rec_mes = rec_ano.groupby(['mes'])['valor_realizado'].sum().reset_index()
-        
-        if eixo_x == "Receita Tributária (Própria)":
-             rec_mes = rec_ano[rec_ano['nome_origem'].str.contains('TRIBUTÁRIA', na=False)].groupby(['mes'])['valor_realizado'].sum().reset_index()
-        elif eixo_x == "Transferências":
-             rec_mes = rec_ano[rec_ano['nome_origem'].str.contains('TRANSFER', na=False)].groupby(['mes'])['valor_realizado'].sum().reset_index()
-        
-        rec_mes.rename(columns={'valor_realizado': 'Valor_X'}, inplace=True)
-        desp_comp = desp_ano[desp_ano['desc_funcao'].isin(eixo_y)].groupby(['mes', 'desc_funcao'])['valor_realizado'].sum().reset_index()
-        df_corr = pd.merge(desp_comp, rec_mes, on='mes')
+        marcadores_eixo_x = {"Receita Tributária (Própria)": 'eh_tributaria', "Transferências": 'eh_transferencia'}
+        df_corr = correlacao_receita_despesa(cubo_rec_ano, cubo_ano, marcadores_eixo_x.get(eixo_x), eixo_y)
         
         col_graph1, col_graph2 = st.columns([2, 1])
         
@@ -546,8 +1142,12 @@ if visao_selecionada == "DESPESAS X RECEITAS":
             
         with col_graph2:
             st.subheader("Matriz de Intensidade")
-            fig_hm = px.density_heatmap(df_corr, x='desc_funcao', y='Valor_X', z='valor_realizado', nbinsy=10, title="Concentração de Gastos")
-            fig_hm.update_layout(height=400, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)")
+            def construir_matriz_intensidade():
+                fig = px.density_heatmap(df_corr, x='desc_funcao', y='Valor_X', z='valor_realizado', nbinsy=10, title="Concentração de Gastos")
+                fig.update_layout(height=400, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)")
+                return fig
+
+            fig_hm = figura_cache('matriz_intensidade', (id_cubos, eixo_x, tuple(eixo_y)), construir_matriz_intensidade)
             st.plotly_chart(fig_hm, use_container_width=True)
 
 # ==============================================================================
@@ -555,6 +1155,7 @@ if visao_selecionada == "DESPESAS X RECEITAS":
 # ==============================================================================
 elif visao_selecionada == "APENAS DESPESAS":
     st.header(f"Análise de Despesas - {label_ano_titulo}")
+    rec_ano, desp_ano, cubo_rec_ano, cubo_ano = obter_visoes_ano(chave_anos, versao_anos, dados_ativos)
     
     # Seletor de Agrupamento
     criterio = st.radio("Critério de Análise:", options=["POR FUNÇÃO", "POR ÓRGÃO"], horizontal=True)
@@ -574,7 +1175,7 @@ elif visao_selecionada == "APENAS DESPESAS":
         """)
       
     cols_necessarias = ['valor_orcado', 'valor_empenhado', 'valor_liquidado', 'valor_realizado']
-    if all(col in desp_ano.columns for col in cols_necessarias):
+    if all(col in cubo_ano.columns for col in cols_necessarias):
         
         guia_visual(f"""
         O **Funil de Execução** mostra a "perda de carga" do orçamento:
@@ -585,10 +1186,9 @@ elif visao_selecionada == "APENAS DESPESAS":
         """)
         
         k1, k2, k3, k4 = st.columns(4)
-        v_orc = desp_ano['valor_orcado'].sum()
-        v_emp = desp_ano['valor_empenhado'].sum()
-        v_liq = desp_ano['valor_liquidado'].sum()
-        v_pag = desp_ano['valor_realizado'].sum()
+        funil = funil_execucao(cubo_ano)
+        v_orc, v_emp, v_liq, v_pag = funil['valor'].tolist()
+        pct_funil = funil['pct_anterior'].tolist()
        
         # Debug para conferência no terminal do servidor (não afeta o usuário)
         print(f"\n--- CONFERÊNCIA DE VALORES ({label_ano_titulo}) ---")
@@ -599,22 +1199,16 @@ elif visao_selecionada == "APENAS DESPESAS":
         print("-" * 50 + "\n")
 
         k1.metric("1. ORÇADO (Planejado)", f"R$ {v_orc:,.2f}")
-        k2.metric("2. EMPENHADO (Reservado)", f"R$ {v_emp:,.2f}", delta=f"{(v_emp/v_orc*100):.1f}% do Orçamento" if v_orc else "0%")
-        k3.metric("3. LIQUIDADO (Executado)", f"R$ {v_liq:,.2f}", delta=f"{(v_liq/v_emp*100):.1f}% do Empenho" if v_emp else "0%")
-        k4.metric("4. PAGO (Efetivado)", f"R$ {v_pag:,.2f}", delta=f"{(v_pag/v_liq*100):.1f}% do Liquidado" if v_liq else "0%")
+        k2.metric("2. EMPENHADO (Reservado)", f"R$ {v_emp:,.2f}", delta=f"{pct_funil[1]:.1f}% do Orçamento" if v_orc else "0%")
+        k3.metric("3. LIQUIDADO (Executado)", f"R$ {v_liq:,.2f}", delta=f"{pct_funil[2]:.1f}% do Empenho" if v_emp else "0%")
+        k4.metric("4. PAGO (Efetivado)", f"R$ {v_pag:,.2f}", delta=f"{pct_funil[3]:.1f}% do Liquidado" if v_liq else "0%")
         
-        # Função auxiliar para formatar rótulos do Funil
-        def fmt_curto(v):
-            if v >= 1e9: return f"R$ {v/1e9:.2f}B"
-            elif v >= 1e6: return f"R$ {v/1e6:.1f}M"
-            return f"R$ {v:,.0f}"
-
-        valores = [v_orc, v_emp, v_liq, v_pag]
-        textos_curtos = [fmt_curto(v) for v in valores]
+        # Rótulos curtos do Funil (R$ x.xxB / x.xM / x,xxx)
+        textos_curtos = formatar_rotulos_valor(funil['valor'], bilhoes=True).tolist()
 
         fig_funnel = go.Figure(go.Funnel(
-            y = ["Orçado", "Empenhado", "Liquidado", "Pago"],
-            x = valores,
+            y = funil['etapa'].tolist(),
+            x = funil['valor'].tolist(),
             text = textos_curtos,
             textinfo = "text+percent initial",
             textposition = "auto",
@@ -652,13 +1246,10 @@ elif visao_selecionada == "APENAS DESPESAS":
 
     col_ranking = col_analise if "Visão Macro" in opcao_ranking else 'desc_elemento'
     
-    if col_ranking in desp_ano.columns:
-        df_ranking = desp_ano.groupby(col_ranking)['valor_realizado'].sum().reset_index()
-        df_ranking = df_ranking.sort_values(by='valor_realizado', ascending=False).head(qtd_top_bar)
+    if col_ranking in cubo_ano.columns:
+        df_ranking = ranking(cubo_ano, col_ranking, n=qtd_top_bar)
         
-        df_ranking['label_txt'] = df_ranking['valor_realizado'].apply(
-            lambda x: f"R$ {x/1e9:.2f}B" if x >= 1e9 else (f"R$ {x/1e6:.1f}M" if x >= 1e6 else f"R$ {x:,.0f}")
-        )
+        df_ranking['label_txt'] = formatar_rotulos_valor(df_ranking['valor_realizado'], bilhoes=True)
 
         fig_bar_top = px.bar(
             df_ranking, x='valor_realizado', y=col_ranking, orientation='h', text='label_txt', title=None
@@ -697,84 +1288,39 @@ elif visao_selecionada == "APENAS DESPESAS":
 
     cols_fluxo = ['desc_categoria', 'desc_natureza', 'desc_elemento']
     
-    if all(c in desp_ano.columns for c in cols_fluxo):
+    if all(c in cubo_ano.columns for c in cols_fluxo):
         
         c_sankey1, c_sankey2 = st.columns([2, 1])
         with c_sankey1:
             qtd_elementos = st.slider("Quantidade de Elementos (Detalhe Final):", min_value=5, max_value=100, value=20, step=5)
         
-        # Filtro de dados para não poluir o gráfico
-        df_sankey_gen = desp_ano.copy()
-        df_sankey_gen[cols_fluxo] = df_sankey_gen[cols_fluxo].fillna("NÃO INFORMADO")
-        
-        top_elementos = df_sankey_gen.groupby('desc_elemento')['valor_realizado'].sum().nlargest(qtd_elementos).index.tolist()
-        df_filtered = df_sankey_gen[df_sankey_gen['desc_elemento'].isin(top_elementos)]
-        df_agg = df_filtered.groupby(cols_fluxo)['valor_realizado'].sum().reset_index()
-
-        altura_dinamica = max(600, len(top_elementos) * 35)
-
-        # Construção dos nós e links
-        nodes = []
-        links = []
-        node_map = {}
-        
-        def add_node(key, label, color="rgba(0, 243, 255, 0.5)"):
-            if key not in node_map:
-                node_map[key] = len(nodes)
-                nodes.append({"label": label, "color": color})
-            return node_map[key]
-
-        add_node("ROOT", "DESPESAS TOTAIS", "#FFFFFF")
-
-        for idx, row in df_agg.iterrows():
-            v = row['valor_realizado']
-            c_lbl = row['desc_categoria']
-            n_lbl = row['desc_natureza']
-            e_lbl = row['desc_elemento']
+        def construir_sankey_cadeia():
+            # Nós e links (Raiz ➝ Categoria ➝ Natureza ➝ Elemento), só com os maiores elementos
+            nos_sk, df_links_agg, qtd_exibidos = sankey_cadeia_despesa(cubo_ano, qtd_elementos)
+            altura_dinamica = max(600, qtd_exibidos * 35)
+            final_labels = rotulos_sankey(nos_sk)
+
+            fig = go.Figure(data=[go.Sankey(
+                node = dict(
+                    pad = 20, thickness = 10, line = dict(color = "black", width = 0.5),
+                    label = final_labels, color = nos_sk['cor'].tolist(),
+                    x = [0.01 if i==0 else None for i in range(len(nos_sk))] 
+                ),
+                link = dict(
+                    source = df_links_agg['source'], target = df_links_agg['target'],
+                    value = df_links_agg['value'], color = df_links_agg['color']
+                ),
+                textfont = dict(family="Orbitron", size=12, color="white")
+            )])
 
-            key_c = f"CAT_{c_lbl}"
-            key_n = f"NAT_{c_lbl}_{n_lbl}"
-            key_e = f"ELM_{c_lbl}_{n_lbl}_{e_lbl}"
+            fig.update_layout(
+                title="Decomposição Encadeada da Despesa", height=altura_dinamica, autosize=True,
+                template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=12),
+                margin=dict(t=40, b=40, l=10, r=10)
+            )
+            return fig
 
-            base_color = "#00F3FF" if "CORRENTES" in c_lbl else "#00FF99"
-            
-            i_root = node_map["ROOT"]
-            i_c = add_node(key_c, c_lbl, base_color)
-            i_n = add_node(key_n, n_lbl, base_color)
-            i_e = add_node(key_e, e_lbl, base_color)
-
-            links.append({'source': i_root, 'target': i_c, 'value': v, 'color': 'rgba(255,255,255,0.1)'})
-            links.append({'source': i_c,    'target': i_n, 'value': v, 'color': 'rgba(0, 243, 255, 0.2)' if "CORRENTES" in c_lbl else 'rgba(0, 255, 153, 0.2)'})
-            links.append({'source': i_n,    'target': i_e, 'value': v, 'color': 'rgba(50,50,50, 0.3)'})
-
-        df_links = pd.DataFrame(links)
-        df_links_agg = df_links.groupby(['source', 'target', 'color'])['value'].sum().reset_index()
-
-        final_labels = []
-        for i, n in enumerate(nodes):
-            val_in = df_links_agg[df_links_agg['target'] == i]['value'].sum()
-            if val_in == 0: val_in = df_links_agg[df_links_agg['source'] == i]['value'].sum()
-            val_fmt = f"R$ {val_in/1e6:,.1f}M" if val_in > 1e6 else f"R$ {val_in:,.0f}"
-            final_labels.append(f"<span style='font-size:13px'>{n['label']}</span><br><span style='font-size:11px; opacity:0.8'>{val_fmt}</span>")
-
-        fig_sankey = go.Figure(data=[go.Sankey(
-            node = dict(
-                pad = 20, thickness = 10, line = dict(color = "black", width = 0.5),
-                label = final_labels, color = [n['color'] for n in nodes],
-                x = [0.01 if i==0 else None for i in range(len(nodes))] 
-            ),
-            link = dict(
-                source = df_links_agg['source'], target = df_links_agg['target'],
-                value = df_links_agg['value'], color = df_links_agg['color']
-            ),
-            textfont = dict(family="Orbitron", size=12, color="white")
-        )])
-
-        fig_sankey.update_layout(
-            title="Decomposição Encadeada da Despesa", height=altura_dinamica, autosize=True,
-            template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=12),
-            margin=dict(t=40, b=40, l=10, r=10)
-        )
+        fig_sankey = figura_cache('sankey_cadeia_despesa', (id_cubos, qtd_elementos), construir_sankey_cadeia)
         st.plotly_chart(fig_sankey, use_container_width=True)
     else:
         st.warning("Colunas necessárias para o fluxo não encontradas.")   
@@ -790,55 +1336,58 @@ elif visao_selecionada == "APENAS DESPESAS":
     with c_tree2:
         zoom_split = st.slider("Profundidade:", 1, 4, 2, key="slider_zoom_split", help="Nível de detalhe da hierarquia")
     with c_tree3:
-        min_val_split = st.slider("Ocultar valores menores que:", 0, 2000000, 100000, step=100000, format="R$ %d", key="slider_val_split")
+        min_val_split = st.slider("Agrupar em OUTROS valores menores que:", 0, 2000000, 100000, step=100000, format="R$ %d", key="slider_val_split")
 
-    if 'desc_categoria' in desp_ano.columns:
-        df_split = desp_ano.copy()
-        df_split['desc_categoria'] = df_split['desc_categoria'].fillna("OUTROS")
+    if 'eh_corrente' in cubo_ano.columns:
+        df_split = cubo_ano
         
-        df_correntes = df_split[df_split['desc_categoria'].str.contains("CORRENTES", case=False, na=False)]
-        df_capital = df_split[df_split['desc_categoria'].str.contains("CAPITAL", case=False, na=False)]
+        df_correntes = df_split[df_split['eh_corrente']]
+        df_capital = df_split[df_split['eh_capital']]
         
         path_split = ['desc_funcao', 'desc_natureza', 'desc_elemento']
         path_valid = [c for c in path_split if c in df_split.columns]
 
         if path_valid:
-            def criar_arvore_categoria(df_input, titulo, cor_escala):
-                df_f = df_input[df_input['valor_realizado'] >= min_val_split]
-                if df_f.empty: return None
-                
-                if tipo_tree_split == "Treemap (Blocos)":
-                    fig = px.treemap(
-                        df_f, path=path_valid, values='valor_realizado',
-                        color='valor_realizado', color_continuous_scale=cor_escala,
-                        maxdepth=zoom_split, title=titulo
-                    )
-                else:
-                    fig = px.sunburst(
-                        df_f, path=path_valid, values='valor_realizado',
-                        color='valor_realizado', color_continuous_scale=cor_escala,
-                        maxdepth=zoom_split, title=titulo
+            def criar_arvore_categoria(df_input, marcador, titulo, cor_escala):
+                def construir():
+                    # Árvore pré-agregada na profundidade escolhida, folhas pequenas em "OUTROS"
+                    df_f = agregar_arvore(df_input, path_valid, zoom_split, valor_minimo=min_val_split)
+                    if df_f.empty: return None
+                    path_arvore = path_valid[:zoom_split]
+                    
+                    if tipo_tree_split == "Treemap (Blocos)":
+                        fig = px.treemap(
+                            df_f, path=path_arvore, values='valor_realizado',
+                            color='valor_realizado', color_continuous_scale=cor_escala, title=titulo
+                        )
+                    else:
+                        fig = px.sunburst(
+                            df_f, path=path_arvore, values='valor_realizado',
+                            color='valor_realizado', color_continuous_scale=cor_escala, title=titulo
+                        )
+                    
+                    fig.update_layout(
+                        margin=dict(t=40, l=0, r=0, b=0), height=500, template="plotly_dark",
+                        paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=12)
                     )
-                
-                fig.update_layout(
-                    margin=dict(t=40, l=0, r=0, b=0), height=500, template="plotly_dark",
-                    paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=12)
-                )
-                fig.update_traces(textinfo="label+percent entry")
-                return fig
+                    fig.update_traces(textinfo="label+percent entry")
+                    return fig
+
+                entradas = (id_cubos, marcador, titulo, cor_escala, path_valid, zoom_split, min_val_split, tipo_tree_split)
+                return figura_cache('arvore_categoria', entradas, construir)
 
             col_c1, col_c2 = st.columns(2)
             with col_c1:
                 st.markdown("#### 🔵 Despesas Correntes")
                 st.caption(f"Total: {formatar_br(df_correntes['valor_realizado'].sum())}")
-                fig_corr = criar_arvore_categoria(df_correntes, "", "Teal")
+                fig_corr = criar_arvore_categoria(df_correntes, 'eh_corrente', "", "Teal")
                 if fig_corr: st.plotly_chart(fig_corr, use_container_width=True)
                 else: st.info("Sem dados visíveis para este filtro.")
 
             with col_c2:
                 st.markdown("#### 🟢 Despesas de Capital")
                 st.caption(f"Total: {formatar_br(df_capital['valor_realizado'].sum())}")
-                fig_cap = criar_arvore_categoria(df_capital, "", "Greens")
+                fig_cap = criar_arvore_categoria(df_capital, 'eh_capital', "", "Greens")
                 if fig_cap: st.plotly_chart(fig_cap, use_container_width=True)
                 else: st.info("Sem dados visíveis para este filtro.")
         else:
@@ -853,16 +1402,9 @@ elif visao_selecionada == "APENAS DESPESAS":
     # --- ABA 1: VISÃO MACRO (Despesas) ---
     if modo_despesa == "VISÃO MACRO":
         
-        # Tratamento para garantir integridade dos gráficos
-        cols_hierarquia = ['desc_funcao', 'nome_orgao', 'desc_categoria', 'desc_natureza', 'desc_elemento']
-        for c in cols_hierarquia:
-            if c in desp_ano.columns:
-                desp_ano[c] = desp_ano[c].fillna("NÃO INFORMADO")
-
         # 1. Gráfico de Evolução Mensal
         st.subheader("Evolução Temporal da Despesa Paga")
-        desp_ano['mes_num'] = pd.to_numeric(desp_ano['mes'], errors='coerce')
-        evolucao_mensal = desp_ano.groupby(['mes_num', 'mes'])['valor_realizado'].sum().reset_index().sort_values('mes_num')
+        evolucao_mensal = serie_mensal(cubo_ano)
         
         fig_line = px.line(evolucao_mensal, x='mes', y='valor_realizado', markers=True, title="Tendência de Pagamentos (Mês a Mês)")
         fig_line.update_traces(line_color='#00F3FF', line_width=3, marker_size=8)
@@ -886,50 +1428,56 @@ elif visao_selecionada == "APENAS DESPESAS":
         with c_vis2:
             nivel_zoom = st.slider("🔍 Nível de Detalhe (Zoom):", min_value=1, max_value=5, value=2)
         with c_vis3:
-            val_min = st.slider("🧹 Filtro de Ruído (Ocultar < R$):", min_value=0, max_value=100_000_000, value=0, step=500_000, format="R$ %d")
+            val_min = st.slider("🧹 Filtro de Ruído (Agrupar em OUTROS < R$):", min_value=0, max_value=100_000_000, value=0, step=500_000, format="R$ %d")
 
         if criterio == "POR FUNÇÃO":
             path_treemap = ['desc_funcao', 'nome_orgao', 'desc_categoria', 'desc_natureza', 'desc_elemento']
         else:
             path_treemap = ['nome_orgao', 'desc_funcao', 'desc_categoria', 'desc_natureza', 'desc_elemento']
             
-        path_final = [c for c in path_treemap if c in desp_ano.columns]
+        path_final = [c for c in path_treemap if c in cubo_ano.columns]
 
         if path_final:
-            df_tree_clean = desp_ano[desp_ano['valor_realizado'] >= val_min]
+            # Pré-agregação no servidor: só os nós até o nível de zoom vão para o navegador
+            controles_tree = (tuple(path_final), nivel_zoom, val_min)
+            df_tree_clean = obter_arvore('despesas', chave_anos, versao_anos, *controles_tree, dados_ativos)
+            path_zoom = path_final[:nivel_zoom]
             
             if not df_tree_clean.empty:
-                if tipo_grafico == "Retangular":
-                    fig_decomp = px.treemap(
-                        df_tree_clean, path=path_final, values='valor_realizado',
-                        color='valor_realizado', color_continuous_scale='Mint',
-                        maxdepth=nivel_zoom, hover_data={'valor_realizado': ':.2f'}
-                    )
-                    fig_decomp.update_traces(marker=dict(line=dict(color='#000000', width=0.5)), textinfo="label+percent entry")
-                else:
-                    fig_decomp = px.sunburst(
-                        df_tree_clean, path=path_final, values='valor_realizado',
-                        color='valor_realizado', color_continuous_scale='Mint', maxdepth=nivel_zoom
-                    )
-                    fig_decomp.update_traces(textinfo="label+percent entry", insidetextorientation='radial')
-
-                fig_decomp.update_layout(height=750, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=14), margin=dict(t=30, l=0, r=0, b=10))
+                def construir_decomposicao():
+                    if tipo_grafico == "Retangular":
+                        fig = px.treemap(
+                            df_tree_clean, path=path_zoom, values='valor_realizado',
+                            color='valor_realizado', color_continuous_scale='Mint',
+                            hover_data={'valor_realizado': ':.2f'}
+                        )
+                        fig.update_traces(marker=dict(line=dict(color='#000000', width=0.5)), textinfo="label+percent entry")
+                    else:
+                        fig = px.sunburst(
+                            df_tree_clean, path=path_zoom, values='valor_realizado',
+                            color='valor_realizado', color_continuous_scale='Mint'
+                        )
+                        fig.update_traces(textinfo="label+percent entry", insidetextorientation='radial')
+
+                    fig.update_layout(height=750, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=14), margin=dict(t=30, l=0, r=0, b=10))
+                    return fig
+
+                fig_decomp = figura_cache('decomposicao_despesa', (id_cubos, *controles_tree, tipo_grafico), construir_decomposicao)
                 st.plotly_chart(fig_decomp, use_container_width=True)
                 
-                # Feedback sobre filtros
-                ocultos = len(desp_ano) - len(df_tree_clean)
-                val_oculto = desp_ano[desp_ano['valor_realizado'] < val_min]['valor_realizado'].sum()
-                if ocultos > 0:
-                    st.caption(f"ℹ️ Visualização filtrada: {ocultos} registros menores ocultos (Totalizando {formatar_br(val_oculto)} fora da visão).")
+                # Feedback sobre o agrupamento
+                em_outros = df_tree_clean['agrupado']
+                if em_outros.any():
+                    st.caption(f"ℹ️ Itens menores reunidos em '{ROTULO_OUTROS}' (Totalizando {formatar_br(df_tree_clean.loc[em_outros, 'valor_realizado'].sum())}).")
             else:
-                st.warning(f"⚠️ Nenhum registro encontrado acima de R$ {val_min:,.2f}. Tente diminuir o filtro de ruído.")
+                st.warning("⚠️ Nenhum valor positivo para montar a hierarquia.")
         else:
             st.warning("Colunas de hierarquia não encontradas.")
         st.markdown("---")
 
         # 3. Scatter Plot (Orçado vs Pago)
         st.subheader(f"Eficiência: Orçado vs Pago ({lbl_analise})")
-        agg_scatter = desp_ano.groupby(col_analise)[['valor_orcado', 'valor_realizado']].sum().reset_index()
+        agg_scatter = agregar(cubo_ano, [col_analise], medidas=['valor_orcado', 'valor_realizado'])
         agg_scatter = agg_scatter[agg_scatter['valor_orcado'] > 0]
         
         fig_sc = px.scatter(
@@ -947,56 +1495,52 @@ elif visao_selecionada == "APENAS DESPESAS":
 
         # 4. Heatmap de Intensidade
         st.subheader(f"Mapa de Calor: Intensidade de Gastos")
-        heat_data = desp_ano.groupby(['mes_num', col_analise])['valor_realizado'].sum().reset_index()
-        heat_data.sort_values(by=col_analise, ascending=False, inplace=True)
+        def construir_mapa_calor():
+            heat_data = mapa_calor_mensal(cubo_ano, col_analise, decrescente=True)
+
+            fig = px.density_heatmap(heat_data, x='mes_num', y=col_analise, z='valor_realizado', color_continuous_scale='Viridis', nbinsx=12)
+            fig.update_layout(height=600, template="plotly_dark", font=dict(family="Orbitron"), paper_bgcolor="rgba(0,0,0,0)", xaxis=dict(dtick=1, title="Mês do Exercício"), yaxis=dict(title=None))
+            return fig
 
-        fig_heat = px.density_heatmap(heat_data, x='mes_num', y=col_analise, z='valor_realizado', color_continuous_scale='Viridis', nbinsx=12)
-        fig_heat.update_layout(height=600, template="plotly_dark", font=dict(family="Orbitron"), paper_bgcolor="rgba(0,0,0,0)", xaxis=dict(dtick=1, title="Mês do Exercício"), yaxis=dict(title=None))
+        fig_heat = figura_cache('mapa_calor_despesa', (id_cubos, col_analise), construir_mapa_calor)
         st.plotly_chart(fig_heat, use_container_width=True)
 
     # --- ABA 2: VISÃO DETALHADA (Despesas) ---
     elif modo_despesa == "VISÃO DETALHADA":
         st.markdown("### 💠 Deep Dive: Análise Focada")
         
-        lista_itens = sorted(desp_ano[col_analise].unique())
+        lista_itens = sorted(cubo_ano[col_analise].unique())
         if not lista_itens:
             st.warning("Sem dados para os filtros atuais.")
-            st.stop()
+            parar()
             
         col_sel, col_stats = st.columns([1, 3])
         with col_sel:
             escolha = st.selectbox(f"Selecione {lbl_analise}:", lista_itens)
             
-        df_foco = desp_ano[desp_ano[col_analise] == escolha]
-        
-        # Estatísticas contextuais
-        total_geral_ano = desp_ano['valor_realizado'].sum()
-        total_foco = df_foco['valor_realizado'].sum()
-        perc_do_total = (total_foco / total_geral_ano) * 100 if total_geral_ano > 0 else 0
+        # Gráficos e KPIs saem do cubo; as linhas brutas só alimentam a tabela granular (índice paginado)
+        cubo_foco = cubo_ano[cubo_ano[col_analise] == escolha]
         
-        ranking_df = desp_ano.groupby(col_analise)['valor_realizado'].sum().sort_values(ascending=False).reset_index()
-        try:
-            rank_pos = ranking_df[ranking_df[col_analise] == escolha].index[0] + 1
-            total_itens = len(ranking_df)
-            txt_rank = f"#{rank_pos} de {total_itens}"
-        except:
-            txt_rank = "-"
+        # Estatísticas contextuais (participação, posição no ranking, elementos ativos)
+        ctx_foco = kpis_item(cubo_ano, col_analise, escolha)
+        totais_foco = ctx_foco['totais']
+        perc_do_total = ctx_foco['perc_do_total']
+        txt_rank = f"#{ctx_foco['posicao']} de {ctx_foco['qtd_itens']}" if ctx_foco['posicao'] else "-"
 
         with col_stats:
             c_s1, c_s2, c_s3 = st.columns(3)
             c_s1.metric("📊 Relevância no Orçamento", f"{perc_do_total:.1f}%", help=f"Quanto {escolha} representa do total do município.")
             c_s2.metric("🏆 Ranking de Gastos", txt_rank, help=f"Posição no ranking de maiores gastos por {lbl_analise}")
-            projs_ativos = df_foco[df_foco['valor_realizado'] > 0]['desc_elemento'].nunique()
-            c_s3.metric("🏗️ Elementos Ativos", projs_ativos, help="Quantidade de tipos de despesas executadas.")
+            c_s3.metric("🏗️ Elementos Ativos", ctx_foco['elementos_ativos'], help="Quantidade de tipos de despesas executadas.")
 
         st.markdown("---")
 
         # Painel Executivo (KPIs da Seleção)
         st.subheader(f"📟 Painel Executivo: {escolha}")
-        v_orc_f = df_foco['valor_orcado'].sum()
-        v_emp_f = df_foco['valor_empenhado'].sum()
-        v_liq_f = df_foco['valor_liquidado'].sum()
-        v_pag_f = df_foco['valor_realizado'].sum()
+        v_orc_f = totais_foco['valor_orcado']
+        v_emp_f = totais_foco['valor_empenhado']
+        v_liq_f = totais_foco['valor_liquidado']
+        v_pag_f = totais_foco['valor_realizado']
         
         k1, k2, k3, k4 = st.columns(4)
         k1.metric("ORÇADO", formatar_br(v_orc_f), border=True)
@@ -1004,7 +1548,9 @@ elif visao_selecionada == "APENAS DESPESAS":
         k3.metric("LIQUIDADO", formatar_br(v_liq_f), delta=f"{(v_liq_f/v_emp_f*100):.1f}% do Emp" if v_emp_f else "0%", border=True)
         k4.metric("PAGO", formatar_br(v_pag_f), delta=f"{(v_pag_f/v_liq_f*100):.1f}% do Liq" if v_liq_f else "0%", border=True)
         
-        st.plotly_chart(plot_gauge(v_pag_f, v_orc_f, f"Taxa de Execução Orçamentária ({escolha})"), use_container_width=True)
+        titulo_gauge = f"Taxa de Execução Orçamentária ({escolha})"
+        fig_gauge = figura_cache('gauge_execucao', (v_pag_f, v_orc_f, titulo_gauge), lambda: plot_gauge(v_pag_f, v_orc_f, titulo_gauge))
+        st.plotly_chart(fig_gauge, use_container_width=True)
         st.markdown("---")
 
         # Ranking Interno (Drill-down)
@@ -1013,9 +1559,8 @@ elif visao_selecionada == "APENAS DESPESAS":
         with c_rank_det1:
             qtd_top_det = st.slider("Qtd. Itens:", 5, 20, 5, key="slider_rank_detalhe")
         
-        df_rank_foco = df_foco.groupby('desc_elemento')['valor_realizado'].sum().reset_index()
-        df_rank_foco = df_rank_foco.sort_values(by='valor_realizado', ascending=False).head(qtd_top_det)
-        df_rank_foco['label_txt'] = df_rank_foco['valor_realizado'].apply(lambda x: f"R$ {x/1e6:.1f}M" if x >= 1e6 else f"R$ {x:,.0f}")
+        df_rank_foco = ranking(cubo_foco, 'desc_elemento', n=qtd_top_det)
+        df_rank_foco['label_txt'] = formatar_rotulos_valor(df_rank_foco['valor_realizado'])
 
         fig_bar_det = px.bar(df_rank_foco, x='valor_realizado', y='desc_elemento', orientation='h', text='label_txt')
         fig_bar_det.update_traces(marker_color='#00F3FF', marker_line_color='#FFFFFF', marker_line_width=1, textposition='outside', cliponaxis=False)
@@ -1025,27 +1570,30 @@ elif visao_selecionada == "APENAS DESPESAS":
 
         # Correntes vs Capital (Focado)
         st.subheader("⚖️ Detalhamento: Correntes vs Capital")
-        if 'desc_categoria' in df_foco.columns:
-            df_corr_f = df_foco[df_foco['desc_categoria'].str.contains("CORRENTES", case=False, na=False)]
-            df_cap_f = df_foco[df_foco['desc_categoria'].str.contains("CAPITAL", case=False, na=False)]
+        if 'eh_corrente' in cubo_foco.columns:
+            df_corr_f = cubo_foco[cubo_foco['eh_corrente']]
+            df_cap_f = cubo_foco[cubo_foco['eh_capital']]
             
             c_split1, c_split2 = st.columns(2)
             
-            def plot_tree_simple(df_in, color_scale):
-                if df_in.empty: return None
-                fig = px.treemap(df_in, path=['desc_natureza', 'desc_elemento'], values='valor_realizado', color='valor_realizado', color_continuous_scale=color_scale)
-                fig.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", margin=dict(t=0,l=0,r=0,b=0), height=300)
-                return fig
+            def plot_tree_simple(df_in, marcador, color_scale):
+                def construir():
+                    df_arvore = agregar_arvore(df_in, ['desc_natureza', 'desc_elemento'])
+                    if df_arvore.empty: return None
+                    fig = px.treemap(df_arvore, path=['desc_natureza', 'desc_elemento'], values='valor_realizado', color='valor_realizado', color_continuous_scale=color_scale)
+                    fig.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", margin=dict(t=0,l=0,r=0,b=0), height=300)
+                    return fig
+                return figura_cache('arvore_foco', (id_cubos, col_analise, escolha, marcador, color_scale), construir)
 
             with c_split1:
                 st.markdown(f"**🔵 Despesas Correntes** (R$ {df_corr_f['valor_realizado'].sum()/1e6:,.1f}M)")
-                fig_c = plot_tree_simple(df_corr_f, "Teal")
+                fig_c = plot_tree_simple(df_corr_f, 'eh_corrente', "Teal")
                 if fig_c: st.plotly_chart(fig_c, use_container_width=True)
                 else: st.info("Sem registros.")
 
             with c_split2:
                 st.markdown(f"**🟢 Despesas de Capital** (R$ {df_cap_f['valor_realizado'].sum()/1e6:,.1f}M)")
-                fig_k = plot_tree_simple(df_cap_f, "Greens")
+                fig_k = plot_tree_simple(df_cap_f, 'eh_capital', "Greens")
                 if fig_k: st.plotly_chart(fig_k, use_container_width=True)
                 else: st.info("Sem registros.")
         st.markdown("---")
@@ -1055,24 +1603,30 @@ elif visao_selecionada == "APENAS DESPESAS":
         with c_l3_1:
             st.markdown("#### 🍩 Distribuição Interativa")
             st.caption("Clique nas fatias para expandir os níveis (Categoria ➝ Natureza)")
-            if 'desc_categoria' in df_foco.columns and 'desc_natureza' in df_foco.columns:
-                df_sun = df_foco.groupby(['desc_categoria', 'desc_natureza'])['valor_realizado'].sum().reset_index()
-                fig_sun = px.sunburst(df_sun, path=['desc_categoria', 'desc_natureza'], values='valor_realizado', color='valor_realizado', color_continuous_scale='GnBu')
-                fig_sun.update_traces(textinfo='label+percent entry')
-                fig_sun.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", margin=dict(t=0, b=0, l=0, r=0), height=350)
+            if 'desc_categoria' in cubo_foco.columns and 'desc_natureza' in cubo_foco.columns:
+                def construir_sunburst_foco():
+                    df_sun = agregar_arvore(cubo_foco, ['desc_categoria', 'desc_natureza'])
+                    fig = px.sunburst(df_sun, path=['desc_categoria', 'desc_natureza'], values='valor_realizado', color='valor_realizado', color_continuous_scale='GnBu')
+                    fig.update_traces(textinfo='label+percent entry')
+                    fig.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", margin=dict(t=0, b=0, l=0, r=0), height=350)
+                    return fig
+
+                fig_sun = figura_cache('sunburst_foco_despesa', (id_cubos, col_analise, escolha), construir_sunburst_foco)
                 st.plotly_chart(fig_sun, use_container_width=True)
             else:
                 st.info("Dados hierárquicos indisponíveis.")
 
         with c_l3_2:
             st.markdown("#### 📅 Sazonalidade (Heatmap)")
-            if 'desc_natureza' in df_foco.columns:
-                heat_foco = df_foco.groupby(['mes', 'desc_natureza'])['valor_realizado'].sum().reset_index()
-                heat_foco['mes_num'] = pd.to_numeric(heat_foco['mes'], errors='coerce')
-                heat_foco.sort_values('mes_num', inplace=True)
-                
-                fig_heat_f = px.density_heatmap(heat_foco, x='mes', y='desc_natureza', z='valor_realizado', color_continuous_scale='Tealgrn', nbinsx=12)
-                fig_heat_f.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", yaxis=dict(title=None, tickfont=dict(size=10)), xaxis=dict(title=None), coloraxis_showscale=False, height=350, margin=dict(t=20, b=20, l=0, r=0))
+            if 'desc_natureza' in cubo_foco.columns:
+                def construir_mapa_calor_foco():
+                    heat_foco = mapa_calor_mensal(cubo_foco, 'desc_natureza')
+                    
+                    fig = px.density_heatmap(heat_foco, x='mes', y='desc_natureza', z='valor_realizado', color_continuous_scale='Tealgrn', nbinsx=12)
+                    fig.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", yaxis=dict(title=None, tickfont=dict(size=10)), xaxis=dict(title=None), coloraxis_showscale=False, height=350, margin=dict(t=20, b=20, l=0, r=0))
+                    return fig
+
+                fig_heat_f = figura_cache('mapa_calor_foco_despesa', (id_cubos, col_analise, escolha), construir_mapa_calor_foco)
                 st.plotly_chart(fig_heat_f, use_container_width=True)
         st.markdown("---")
 
@@ -1082,20 +1636,19 @@ elif visao_selecionada == "APENAS DESPESAS":
         
         qtd_sankey_det = st.slider("Quantidade de Elementos na Ponta:", 5, 50, 10, key="slider_sankey_det")
         cols_sankey_foco = ['desc_natureza', 'desc_elemento']
-        if all(c in df_foco.columns for c in cols_sankey_foco):
-            df_sk_f = df_foco.groupby(cols_sankey_foco)['valor_realizado'].sum().reset_index()
-            top_el_f = df_sk_f.groupby('desc_elemento')['valor_realizado'].sum().nlargest(qtd_sankey_det).index
-            df_sk_f = df_sk_f[df_sk_f['desc_elemento'].isin(top_el_f)]
-            
-            all_nodes = list(pd.concat([df_sk_f['desc_natureza'], df_sk_f['desc_elemento']]).unique())
-            map_nodes = {n: i for i, n in enumerate(all_nodes)}
-            height_sk = max(400, len(top_el_f) * 30)
+        if all(c in cubo_foco.columns for c in cols_sankey_foco):
+            def construir_sankey_foco():
+                nos_f, links_f, qtd_exibidos_f = sankey_natureza_elemento(cubo_foco, qtd_sankey_det)
+                height_sk = max(400, qtd_exibidos_f * 30)
+
+                fig = go.Figure(data=[go.Sankey(
+                    node=dict(pad=15, thickness=10, line=dict(color="black", width=0.5), label=[f"{n}" for n in nos_f['rotulo']], color="#00F3FF"),
+                    link=dict(source=links_f['source'], target=links_f['target'], value=links_f['value'], color='rgba(0, 243, 255, 0.2)')
+                )])
+                fig.update_layout(height=height_sk, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=11), title_text=None, margin=dict(t=20, b=20, l=10, r=10))
+                return fig
 
-            fig_sk_f = go.Figure(data=[go.Sankey(
-                node=dict(pad=15, thickness=10, line=dict(color="black", width=0.5), label=[f"{n}" for n in all_nodes], color="#00F3FF"),
-                link=dict(source=df_sk_f['desc_natureza'].map(map_nodes), target=df_sk_f['desc_elemento'].map(map_nodes), value=df_sk_f['valor_realizado'], color='rgba(0, 243, 255, 0.2)')
-            )])
-            fig_sk_f.update_layout(height=height_sk, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=11), title_text=None, margin=dict(t=20, b=20, l=10, r=10))
+            fig_sk_f = figura_cache('sankey_foco_despesa', (id_cubos, col_analise, escolha, qtd_sankey_det), construir_sankey_foco)
             st.plotly_chart(fig_sk_f, use_container_width=True)
         st.markdown("---")
 
@@ -1108,14 +1661,12 @@ elif visao_selecionada == "APENAS DESPESAS":
             with ft_col2:
                 min_table_val = st.number_input("Valor Mínimo (R$):", value=0, step=1000)
 
-        cols_tab = ['mes', 'desc_elemento', 'valor_orcado', 'valor_empenhado', 'valor_liquidado', 'valor_realizado']
-        df_tab = df_foco[cols_tab].copy()
-        
-        df_tab = df_tab[df_tab['valor_realizado'] >= min_table_val]
-        if search_term:
-            df_tab = df_tab[df_tab['desc_elemento'].str.contains(search_term, case=False, na=False)]
-            
-        df_tab.sort_values('valor_realizado', ascending=False, inplace=True)
+        # Busca (trigramas sobre o dicionário de elementos) e ordenação por valor vêm do índice;
+        # só a página visível é montada e enviada
+        indice_foco = obter_indice_tabela('despesas', chave_anos, col_analise, escolha, versao_anos, dados_ativos)
+        total_tab = len(indice_foco.consultar(search_term, min_table_val))
+        pagina_tab = seletor_pagina(total_tab, "pagina_granular")
+        df_tab, _, maior_tab = indice_foco.pagina(search_term, min_table_val, pagina_tab, TAMANHO_PAGINA)
         
         st.dataframe(
             df_tab,
@@ -1126,7 +1677,7 @@ elif visao_selecionada == "APENAS DESPESAS":
                 "valor_empenhado": st.column_config.NumberColumn("Empenhado", format="R$ %.2f"),
                 "valor_liquidado": st.column_config.NumberColumn("Liquidado", format="R$ %.2f"),
                 "valor_realizado": st.column_config.ProgressColumn(
-                    "Pago (Realizado)", format="R$ %.2f", min_value=0, max_value=df_tab['valor_realizado'].max() if not df_tab.empty else 1000
+                    "Pago (Realizado)", format="R$ %.2f", min_value=0, max_value=maior_tab if maior_tab is not None else 1000
                 )
             },
             hide_index=True, use_container_width=True, height=400
@@ -1134,11 +1685,11 @@ elif visao_selecionada == "APENAS DESPESAS":
 
     # --- ABA 3: COMPARADOR (Despesas) ---
     else:
-        lista_completa = sorted(desp_ano[col_analise].unique())
+        lista_completa = sorted(cubo_ano[col_analise].unique())
         selecao = st.multiselect(f"Comparar {lbl_analise}s:", lista_completa, default=lista_completa[:2] if len(lista_completa)>1 else lista_completa)
         if selecao:
-            df_comp = desp_ano[desp_ano[col_analise].isin(selecao)]
-            comp_vals = df_comp.groupby(col_analise)[['valor_orcado', 'valor_realizado']].sum().reset_index()
+            df_comp = cubo_ano[cubo_ano[col_analise].isin(selecao)]
+            comp_vals = agregar(df_comp, [col_analise], medidas=['valor_orcado', 'valor_realizado'])
             comp_melt = comp_vals.melt(id_vars=col_analise, value_vars=['valor_orcado', 'valor_realizado'], var_name='Tipo', value_name='Valor')
             
             fig_comp = px.bar(comp_melt, x='Valor', y=col_analise, color='Tipo', barmode='group', color_discrete_map={'valor_orcado': '#555555', 'valor_realizado': '#00F3FF'}, title="Meta (Orçado) vs Realidade (Pago)")
@@ -1154,10 +1705,10 @@ elif visao_selecionada == "APENAS DESPESAS":
 # ==============================================================================
 elif visao_selecionada == "APENAS RECEITAS":
     st.header(f"Análise de Receitas - {label_ano_titulo}")
+    rec_ano, desp_ano, cubo_rec_ano, cubo_ano = obter_visoes_ano(chave_anos, versao_anos, dados_ativos)
     
-    t_real_rec = rec_ano['valor_realizado'].sum()
-    qtd_meses = rec_ano['mes'].nunique()
-    media_mensal = t_real_rec / qtd_meses if qtd_meses > 0 else 0
+    kpis_rec = kpis_receita(cubo_rec_ano)
+    t_real_rec, media_mensal = kpis_rec['total_receita'], kpis_rec['media_mensal']
 
     col_r1, col_r2 = st.columns(2)
     with st.expander("📖 Glossário de Receitas e Siglas", expanded=False):
@@ -1179,12 +1730,8 @@ elif visao_selecionada == "APENAS RECEITAS":
     modo_receita = st.radio("Modo de Visualização", options=["VISÃO MACRO", "VISÃO DETALHADA"], horizontal=True, key="radio_modo_rec")
     st.markdown("<br>", unsafe_allow_html=True)
 
-    # Preparação para uso em todas as abas
-    rec_ano['mes_num'] = pd.to_numeric(rec_ano['mes'], errors='coerce')
+    # Hierarquia usada em todas as abas (nulos já preenchidos nos recortes do ano)
     cols_hierarquia_rec = ['nome_origem', 'nome_especie', 'nome_tipo']
-    for c in cols_hierarquia_rec:
-        if c in rec_ano.columns:
-            rec_ano[c] = rec_ano[c].fillna("NÃO CLASSIFICADO")
 
     # --- ABA 1: VISÃO MACRO (Receitas) ---
     if modo_receita == "VISÃO MACRO":
@@ -1196,7 +1743,7 @@ elif visao_selecionada == "APENAS RECEITAS":
         **Estabilidade:** Receitas como ISS tendem a ser mais estáveis, flutuando com a economia.
         """)
         
-        evolucao_rec = rec_ano.groupby(['mes_num', 'mes'])['valor_realizado'].sum().reset_index().sort_values('mes_num')
+        evolucao_rec = serie_mensal(cubo_rec_ano)
         fig_line_rec = px.line(evolucao_rec, x='mes', y='valor_realizado', markers=True, title="Tendência de Entradas (Mês a Mês)")
         fig_line_rec.update_traces(line_color='#00FF99', line_width=3, marker_size=8)
         fig_line_rec.update_layout(height=350, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", xaxis=dict(showgrid=False, title=None), yaxis=dict(showgrid=True, gridcolor='#333', title="Valor Arrecadado"))
@@ -1211,26 +1758,32 @@ elif visao_selecionada == "APENAS RECEITAS":
         with c_vis_r2:
             zoom_rec = st.slider("🔍 Zoom:", 1, 3, 2, key="slider_zoom_rec")
         with c_vis_r3:
-            val_min_rec = st.slider("🧹 Filtro de Ruído (< R$):", 0, 5000000, 0, step=100000, format="R$ %d", key="slider_noise_rec")
+            val_min_rec = st.slider("🧹 Filtro de Ruído (Agrupar em OUTROS < R$):", 0, 5000000, 0, step=100000, format="R$ %d", key="slider_noise_rec")
 
-        df_tree_rec = rec_ano[rec_ano['valor_realizado'] >= val_min_rec]
-        path_rec = [c for c in cols_hierarquia_rec if c in df_tree_rec.columns]
+        path_rec = [c for c in cols_hierarquia_rec if c in cubo_rec_ano.columns]
+        controles_tree_rec = (tuple(path_rec), zoom_rec, val_min_rec)
+        df_tree_rec = obter_arvore('receitas', chave_anos, versao_anos, *controles_tree_rec, dados_ativos) if path_rec else pd.DataFrame()
+        path_rec = path_rec[:zoom_rec]
         
         if not df_tree_rec.empty and path_rec:
-            if tipo_grafico_rec == "Retangular":
-                fig_decomp_rec = px.treemap(
-                    df_tree_rec, path=path_rec, values='valor_realizado',
-                    color='valor_realizado', color_continuous_scale='Emrld', maxdepth=zoom_rec
-                )
-                fig_decomp_rec.update_traces(marker=dict(line=dict(color='#000000', width=0.5)), textinfo="label+percent entry")
-            else:
-                fig_decomp_rec = px.sunburst(
-                    df_tree_rec, path=path_rec, values='valor_realizado',
-                    color='valor_realizado', color_continuous_scale='Emrld', maxdepth=zoom_rec
-                )
-                fig_decomp_rec.update_traces(textinfo="label+percent entry")
-            
-            fig_decomp_rec.update_layout(height=700, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=14), margin=dict(t=30, l=0, r=0, b=10))
+            def construir_decomposicao_receita():
+                if tipo_grafico_rec == "Retangular":
+                    fig = px.treemap(
+                        df_tree_rec, path=path_rec, values='valor_realizado',
+                        color='valor_realizado', color_continuous_scale='Emrld'
+                    )
+                    fig.update_traces(marker=dict(line=dict(color='#000000', width=0.5)), textinfo="label+percent entry")
+                else:
+                    fig = px.sunburst(
+                        df_tree_rec, path=path_rec, values='valor_realizado',
+                        color='valor_realizado', color_continuous_scale='Emrld'
+                    )
+                    fig.update_traces(textinfo="label+percent entry")
+                
+                fig.update_layout(height=700, template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=14), margin=dict(t=30, l=0, r=0, b=10))
+                return fig
+
+            fig_decomp_rec = figura_cache('decomposicao_receita', (id_cubos, *controles_tree_rec, tipo_grafico_rec), construir_decomposicao_receita)
             st.plotly_chart(fig_decomp_rec, use_container_width=True)
         else:
             st.warning("Sem dados suficientes para gerar a hierarquia.")
@@ -1246,10 +1799,9 @@ elif visao_selecionada == "APENAS RECEITAS":
         
         col_rank_rec = 'nome_especie' if "Espécie" in nivel_rank_rec else 'nome_tipo'
         
-        if col_rank_rec in rec_ano.columns:
-            df_rank_rec = rec_ano.groupby(col_rank_rec)['valor_realizado'].sum().reset_index()
-            df_rank_rec = df_rank_rec.sort_values('valor_realizado', ascending=False).head(qtd_top_rec)
-            df_rank_rec['label_txt'] = df_rank_rec['valor_realizado'].apply(lambda x: f"R$ {x/1e6:.1f}M" if x >= 1e6 else f"R$ {x:,.0f}")
+        if col_rank_rec in cubo_rec_ano.columns:
+            df_rank_rec = ranking(cubo_rec_ano, col_rank_rec, n=qtd_top_rec)
+            df_rank_rec['label_txt'] = formatar_rotulos_valor(df_rank_rec['valor_realizado'])
             
             fig_bar_rec = px.bar(df_rank_rec, x='valor_realizado', y=col_rank_rec, orientation='h', text='label_txt')
             fig_bar_rec.update_traces(marker_color='#00FF99', marker_line_color='#FFFFFF', marker_line_width=1, textposition='outside', cliponaxis=False)
@@ -1261,60 +1813,25 @@ elif visao_selecionada == "APENAS RECEITAS":
         st.subheader("🔗 Fluxo de Entrada: Origem $\\to$ Destino")
         qtd_sankey_rec = st.slider("Detalhe do Fluxo (Top Tipos):", 5, 50, 15, key="sl_sankey_rec")
         
-        df_sk_rec = rec_ano.copy()
-        if 'nome_tipo' in df_sk_rec.columns:
-            top_tipos_rec = df_sk_rec.groupby('nome_tipo')['valor_realizado'].sum().nlargest(qtd_sankey_rec).index
-            df_sk_rec = df_sk_rec[df_sk_rec['nome_tipo'].isin(top_tipos_rec)]
-            
-            df_agg_sk = df_sk_rec.groupby(cols_hierarquia_rec)['valor_realizado'].sum().reset_index()
-            
-            nodes_r = []
-            links_r = []
-            node_map_r = {}
-            
-            def add_node_r(key, label, color="rgba(0, 255, 153, 0.5)"):
-                if key not in node_map_r:
-                    node_map_r[key] = len(nodes_r)
-                    nodes_r.append({"label": label, "color": color})
-                return node_map_r[key]
+        if 'nome_tipo' in cubo_rec_ano.columns:
+            def construir_sankey_receita():
+                nos_r, df_l_rec, qtd_tipos_exibidos = sankey_receita(cubo_rec_ano, qtd_sankey_rec)
+                final_labels_r = rotulos_sankey(nos_r)
 
-            add_node_r("ROOT", "RECEITA TOTAL", "#FFFFFF")
-            
-            for _, row in df_agg_sk.iterrows():
-                v = row['valor_realizado']
-                orig = row['nome_origem']
-                esp = row['nome_especie']
-                tip = row['nome_tipo']
-                
-                i_root = node_map_r["ROOT"]
-                i_orig = add_node_r(f"O_{orig}", orig, "#00FF99")
-                i_esp = add_node_r(f"E_{esp}", esp, "#00CC88")
-                i_tip = add_node_r(f"T_{tip}", tip, "#009977")
-                
-                links_r.append({'source': i_root, 'target': i_orig, 'value': v, 'color': 'rgba(255,255,255,0.1)'})
-                links_r.append({'source': i_orig, 'target': i_esp, 'value': v, 'color': 'rgba(0, 255, 153, 0.2)'})
-                links_r.append({'source': i_esp,  'target': i_tip,  'value': v, 'color': 'rgba(0, 204, 136, 0.2)'})
-                
-            df_l_rec = pd.DataFrame(links_r).groupby(['source', 'target', 'color'])['value'].sum().reset_index()
-            
-            final_labels_r = []
-            for i, n in enumerate(nodes_r):
-                val_in = df_l_rec[df_l_rec['target'] == i]['value'].sum()
-                if val_in == 0: val_in = df_l_rec[df_l_rec['source'] == i]['value'].sum()
-                val_fmt = f"R$ {val_in/1e6:,.1f}M" if val_in > 1e6 else f"R$ {val_in:,.0f}"
-                final_labels_r.append(f"<span style='font-size:13px'>{n['label']}</span><br><span style='font-size:11px; opacity:0.8'>{val_fmt}</span>")
-
-            fig_sk_r = go.Figure(data=[go.Sankey(
-                node=dict(pad=15, thickness=10, line=dict(color="black", width=0.5), label=final_labels_r, color=[n['color'] for n in nodes_r]),
-                link=dict(source=df_l_rec['source'], target=df_l_rec['target'], value=df_l_rec['value'], color=df_l_rec['color'])
-            )])
-            fig_sk_r.update_layout(title="Decomposição da Receita", height=max(600, len(top_tipos_rec)*30), template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=12))
+                fig = go.Figure(data=[go.Sankey(
+                    node=dict(pad=15, thickness=10, line=dict(color="black", width=0.5), label=final_labels_r, color=nos_r['cor'].tolist()),
+                    link=dict(source=df_l_rec['source'], target=df_l_rec['target'], value=df_l_rec['value'], color=df_l_rec['color'])
+                )])
+                fig.update_layout(title="Decomposição da Receita", height=max(600, qtd_tipos_exibidos*30), template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", font=dict(family="Orbitron", size=12))
+                return fig
+
+            fig_sk_r = figura_cache('sankey_receita', (id_cubos, qtd_sankey_rec), construir_sankey_receita)
             st.plotly_chart(fig_sk_r, use_container_width=True)
         st.markdown("---")
         
         # Ranking Final
         st.subheader("📊 Ranking Final por Tipo de Receita")
-        top_r = rec_ano.groupby('nome_tipo')['valor_realizado'].sum().sort_values(ascending=False).head(10).reset_index()
+        top_r = ranking(cubo_rec_ano, 'nome_tipo', n=10)
         fig_rank_final = px.bar(top_r, x='valor_realizado', y='nome_tipo', orientation='h', text_auto='.2s')
         fig_rank_final.update_traces(marker_color='#00F3FF')
         fig_rank_final.update_layout(yaxis=dict(autorange="reversed", title=None), xaxis=dict(title="Total Arrecadado"), template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", title="Top 10 Tipos de Arrecadação")
@@ -1325,11 +1842,11 @@ elif visao_selecionada == "APENAS RECEITAS":
         
         st.markdown("### 💠 Deep Dive: Análise de Fonte de Receita")
         
-        lista_origens = sorted(rec_ano['nome_origem'].unique())
+        lista_origens = sorted(cubo_rec_ano['nome_origem'].unique())
         sel_origem = st.selectbox("Selecione a Origem da Receita:", lista_origens)
-        df_foco_rec = rec_ano[rec_ano['nome_origem'] == sel_origem]
+        cubo_foco_rec = cubo_rec_ano[cubo_rec_ano['nome_origem'] == sel_origem]
         
-        total_origem = df_foco_rec['valor_realizado'].sum()
+        total_origem = agregar(cubo_foco_rec, medidas=['valor_realizado'])['valor_realizado']
         perc_total = (total_origem / t_real_rec * 100) if t_real_rec > 0 else 0
         
         c_ctx1, c_ctx2 = st.columns([1, 3])
@@ -1346,26 +1863,35 @@ elif visao_selecionada == "APENAS RECEITAS":
         c_det_r1, c_det_r2 = st.columns(2)
         with c_det_r1:
             st.markdown("#### Composição Interna (Espécie $\\to$ Tipo)")
-            if not df_foco_rec.empty:
-                fig_sun_foco = px.sunburst(df_foco_rec, path=['nome_especie', 'nome_tipo'], values='valor_realizado', color='valor_realizado', color_continuous_scale='Greens')
-                fig_sun_foco.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", height=400)
+            if not cubo_foco_rec.empty:
+                def construir_sunburst_foco_receita():
+                    fig = px.sunburst(agregar_arvore(cubo_foco_rec, ['nome_especie', 'nome_tipo']), path=['nome_especie', 'nome_tipo'], values='valor_realizado', color='valor_realizado', color_continuous_scale='Greens')
+                    fig.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", height=400)
+                    return fig
+
+                fig_sun_foco = figura_cache('sunburst_foco_receita', (id_cubos, sel_origem), construir_sunburst_foco_receita)
                 st.plotly_chart(fig_sun_foco, use_container_width=True)
                 
         with c_det_r2:
             st.markdown("#### Sazonalidade desta Origem")
-            heat_foco_rec = df_foco_rec.groupby(['mes_num', 'nome_especie'])['valor_realizado'].sum().reset_index()
-            fig_heat_fr = px.density_heatmap(heat_foco_rec, x='mes_num', y='nome_especie', z='valor_realizado', color_continuous_scale='Greens', nbinsx=12)
-            fig_heat_fr.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", height=400, xaxis=dict(dtick=1, title="Mês"))
+            def construir_mapa_calor_foco_receita():
+                heat_foco_rec = mapa_calor_mensal(cubo_foco_rec, 'nome_especie')
+                fig = px.density_heatmap(heat_foco_rec, x='mes_num', y='nome_especie', z='valor_realizado', color_continuous_scale='Greens', nbinsx=12)
+                fig.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)", height=400, xaxis=dict(dtick=1, title="Mês"))
+                return fig
+
+            fig_heat_fr = figura_cache('mapa_calor_foco_receita', (id_cubos, sel_origem), construir_mapa_calor_foco_receita)
             st.plotly_chart(fig_heat_fr, use_container_width=True)
         st.markdown("---")
         
         # Tabela Detalhada com Tratamento de Exceções
         st.subheader("🕵️‍♀️ Registros Detalhados")
-        cols_tab_rec = ['mes', 'nome_especie', 'nome_tipo', 'valor_realizado']
+        indice_rec = obter_indice_tabela('receitas', chave_anos, 'nome_origem', sel_origem, versao_anos, dados_ativos)
+        busca_rec = st.text_input("Buscar por Tipo de Receita:", placeholder="Ex: IPTU, ISS...")
         
-        if not df_foco_rec.empty:
-            v_real_max = df_foco_rec['valor_realizado'].max()
-            v_real_min = df_foco_rec['valor_realizado'].min()
+        if len(indice_rec):
+            v_real_max = np.nanmax(indice_rec.valores_desc)
+            v_real_min = np.nanmin(indice_rec.valores_desc)
             
             # Tratamento seguro para range da barra (lida com deduções negativas)
             safe_min = float(min(0, v_real_min))
@@ -1374,8 +1900,12 @@ elif visao_selecionada == "APENAS RECEITAS":
         else:
             safe_min, safe_max = 0.0, 1.0
 
+        total_rec_tab = len(indice_rec.consultar(busca_rec))
+        pagina_rec = seletor_pagina(total_rec_tab, "pagina_registros_rec")
+        df_tab_rec, _, _ = indice_rec.pagina(busca_rec, numero=pagina_rec, tamanho=TAMANHO_PAGINA)
+
         st.dataframe(
-            df_foco_rec[cols_tab_rec].sort_values('valor_realizado', ascending=False),
+            df_tab_rec,
             column_config={
                 "valor_realizado": st.column_config.ProgressColumn(
                     "Arrecadado", format="R$ %.2f", min_value=safe_min, max_value=safe_max
@@ -1384,3 +1914,11 @@ elif visao_selecionada == "APENAS RECEITAS":
             use_container_width=True, hide_index=True
 
         )
+
+# ==============================================================================
+# 11. INSTRUMENTAÇÃO (PAINEL DE DEPURAÇÃO E MÉTRICAS)
+# ==============================================================================
+if modo_debug:
+    painel_instrumentacao(registros_execucao, time.perf_counter() - inicio_execucao)
+
+exportar_metricas()
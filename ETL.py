@@ -1,171 +1,342 @@
 import pandas as pd
+import argparse
 import glob
 import os
 
+from tratamento import (
+    dtypes_moeda, converter_colunas_moeda, ingerir_arquivos,
+    padronizar_despesas, escrever_despesas_em_blocos, normalizar_categorias,
+    classificar, carregar_regras_classificacao, impressao_regras,
+    COLUNAS_CATEGORICAS_DESPESA, COLUNAS_CATEGORICAS_RECEITA, COLUNAS_DESPESA_PADRAO
+)
+from analise import colapsar_top_n, construir_snapshot_kpis
+from armazenamento import (
+    salvar_camada_curada, pyarrow_disponivel, publicar_versao_dados,
+    carregar_manifesto, salvar_manifesto, impressao_digital, arquivo_alterado
+)
+
+# Pastas de dados do projeto (padrão da execução via linha de comando)
+BASE_PATH = r'C:\Users\lucas\Desktop\tcc_dashboard_poa\data'
+PASTA_DESPESAS = r'C:\Users\lucas\Desktop\tcc_dashboard_poa\data\despesas'
+
 # ==============================================================================
 # 1. FUNÇÕES AUXILIARES DE TRATAMENTO
 # ==============================================================================
-def limpar_moeda(valor):
-    """
-    Converte strings no formato monetário brasileiro (ex: '1.000,00') para float Python.
-    Trata valores nulos e vazios, retornando 0.0 em caso de erro.
-    """
-    if pd.isna(valor) or valor == '':
-        return 0.0
-    valor_str = str(valor).strip()
-    
-    # Remove separador de milhar (.) e substitui decimal (,) por ponto
-    if ',' in valor_str:
-        valor_str = valor_str.replace('.', '').replace(',', '.')
-    try:
-        return float(valor_str)
-    except ValueError:
-        return 0.0
+# A conversão monetária fica em `tratamento.py` (compartilhada com o APP.py).
+# As colunas de valor são lidas como texto pelo engine C e convertidas em lote
+# por `limpar_moeda_vetorizado`, evitando o `converters=` célula a célula.
 
 # ==============================================================================
 # 2. PROCESSO DE UNIFICAÇÃO DOS ARQUIVOS DE DESPESA
 # ==============================================================================
-pasta_origem = r'C:\Users\lucas\Desktop\tcc_dashboard_poa\data\despesas'
-arquivo_saida = os.path.join(pasta_origem, 'despesas_unificado.csv')
-padrao = os.path.join(pasta_origem, '*.csv')
-arquivos = glob.glob(padrao)
-
-# Define as colunas monetárias que precisam de conversão específica
-conversores = {
-    'vlpag': limpar_moeda, 
-    'vlorcini': limpar_moeda,
-    'vlemp': limpar_moeda,
-    'vlliq': limpar_moeda
-}
+def unificar_despesas(args, pasta_origem=PASTA_DESPESAS):
+    """
+    Unifica os CSVs anuais de despesa em `despesas_unificado.csv` (incremental via manifesto).
+    Os dois modos gravam o mesmo layout (colunas padronizadas, COLUNAS_DESPESA_PADRAO), então
+    o atalho de entradas inalteradas vale para um unificado gravado por qualquer um deles.
+    Retorna o caminho do arquivo unificado.
+    """
+    arquivo_saida = os.path.join(pasta_origem, 'despesas_unificado.csv')
+    padrao = os.path.join(pasta_origem, '*.csv')
+    arquivos = sorted(a for a in glob.glob(padrao) if a != arquivo_saida)
 
-lista_dfs = []
-print(f"--- Iniciando Unificação ({len(arquivos)} arquivos) ---")
+    # Manifesto das entradas já processadas e cache (pickle) do resultado de cada arquivo
+    caminho_manifesto = os.path.join(pasta_origem, 'manifesto_etl.json')
+    pasta_cache = os.path.join(pasta_origem, '_cache_etl')
+    os.makedirs(pasta_cache, exist_ok=True)
 
-for arquivo in arquivos:
-    # Evita ler o próprio arquivo de saída se ele já existir na pasta
-    if arquivo == arquivo_saida:
-        continue
-    try:
-        # Tenta leitura padrão UTF-8
-        df = pd.read_csv(arquivo, sep=';', encoding='utf-8', converters=conversores)
-    except:
+    manifesto_anterior = {} if args.completo else carregar_manifesto(caminho_manifesto)
+    manifesto = {}
+
+    # Modo streaming: lê cada arquivo em blocos, já padroniza (seleção/renomeação da seção 3.4)
+    # e anexa direto ao unificado. Só a unificação fica limitada a um bloco em memória: a
+    # etapa 3 (carregar_para_analise) ainda lê o unificado inteiro.
+    if args.streaming:
+        nomes = {os.path.basename(a) for a in arquivos}
+        inalterados = (
+            os.path.exists(arquivo_saida)
+            and set(manifesto_anterior) == nomes
+            and not any(arquivo_alterado(manifesto_anterior[os.path.basename(a)], a) for a in arquivos)
+        )
+        if inalterados:
+            for arquivo in arquivos:
+                manifesto[os.path.basename(arquivo)] = dict(manifesto_anterior[os.path.basename(arquivo)], mtime=os.stat(arquivo).st_mtime)
+            salvar_manifesto(manifesto, caminho_manifesto)
+            print("✅ Nenhum arquivo alterado: unificado mantido.")
+            return arquivo_saida
+
+        print(f"--- Iniciando Unificação em streaming ({len(arquivos)} arquivos, blocos de {args.tamanho_bloco} linhas) ---")
         try:
-            # Fallback para Latin1 (comum em dados governamentais antigos)
-            df = pd.read_csv(arquivo, sep=';', encoding='latin1', converters=conversores)
-        except Exception as e:
-            print(f"Erro em {arquivo}: {e}")
+            metricas = escrever_despesas_em_blocos(arquivos, arquivo_saida, tamanho_bloco=args.tamanho_bloco)
+        except PermissionError:
+            print("⚠️ Feche o arquivo no Excel e tente novamente!")
+            exit()
+        for m in metricas:
+            nome = os.path.basename(m['arquivo'])
+            # O streaming não grava o cache pickle: o antigo, se houver, ficaria defasado
+            # em relação ao manifesto e seria reaproveitado pelo modo padrão
+            arquivo_cache = os.path.join(pasta_cache, nome + '.pkl')
+            if os.path.exists(arquivo_cache):
+                os.remove(arquivo_cache)
+            if m['erro']:
+                print(f"Erro em {m['arquivo']}: {m['erro']}")
+            else:
+                manifesto[nome] = impressao_digital(m['arquivo'])
+                print(f"   + {nome} ({m['linhas']} linhas em {m['blocos']} blocos, {m['segundos']:.2f}s)")
+        salvar_manifesto(manifesto, caminho_manifesto)
+        print(f"✅ Arquivo unificado salvo com sucesso!")
+        return arquivo_saida
+
+    houve_mudanca = args.completo or not os.path.exists(arquivo_saida)
+    modo = "completa" if args.completo else "incremental"
+    print(f"--- Iniciando Unificação {modo} ({len(arquivos)} arquivos) ---")
+
+    # 2.1 Triagem: arquivos inalterados reaproveitam o resultado já tratado (cache)
+    dfs_por_arquivo = {}
+    pendentes = []
+    for arquivo in arquivos:
+        nome = os.path.basename(arquivo)
+        registro = manifesto_anterior.get(nome)
+        arquivo_cache = os.path.join(pasta_cache, nome + '.pkl')
+
+        if os.path.exists(arquivo_cache) and not arquivo_alterado(registro, arquivo):
+            registro['mtime'] = os.stat(arquivo).st_mtime
+            manifesto[nome] = registro
+            dfs_por_arquivo[arquivo] = pd.read_pickle(arquivo_cache)
+            print(f"   = {nome} (sem alterações)")
+        else:
+            pendentes.append(arquivo)
+
+    # 2.2 Ingestão dos arquivos novos/alterados (em paralelo com --workers > 1)
+    for resultado in ingerir_arquivos(pendentes, workers=args.workers):
+        arquivo = resultado['arquivo']
+        nome = os.path.basename(arquivo)
+        if resultado['erro']:
+            print(f"Erro em {arquivo}: {resultado['erro']}")
             continue
-    lista_dfs.append(df)
+        # Mesmo layout do streaming: seleção/renomeação antes do cache e da concatenação
+        df = padronizar_despesas(resultado['df']).reindex(columns=COLUNAS_DESPESA_PADRAO)
+        df.to_pickle(os.path.join(pasta_cache, nome + '.pkl'))
+        manifesto[nome] = impressao_digital(arquivo)
+        dfs_por_arquivo[arquivo] = df
+        houve_mudanca = True
+        print(f"   + {nome} (reprocessado: {resultado['linhas']} linhas em {resultado['segundos']:.2f}s)")
 
-if lista_dfs:
-    df_final = pd.concat(lista_dfs, ignore_index=True)
-    try:
-        # Exporta o dataset consolidado mantendo o padrão brasileiro de decimal
-        df_final.to_csv(arquivo_saida, index=False, sep=';', encoding='utf-8', decimal=',')
-        print(f"✅ Arquivo unificado salvo com sucesso!")
-    except PermissionError:
-        print("⚠️ Feche o arquivo no Excel e tente novamente!")
-        exit()
-else:
-    print("Nenhum arquivo encontrado.")
+    # 2.3 Ordem determinística (mesma do glob ordenado), independente do término dos processos
+    lista_dfs = [dfs_por_arquivo[a] for a in arquivos if a in dfs_por_arquivo]
+
+    # Arquivos que saíram da pasta também exigem regravar o unificado
+    removidos = set(manifesto_anterior) - set(manifesto)
+    for nome in removidos:
+        arquivo_cache = os.path.join(pasta_cache, nome + '.pkl')
+        if os.path.exists(arquivo_cache):
+            os.remove(arquivo_cache)
+    houve_mudanca = houve_mudanca or bool(removidos)
+
+    if lista_dfs and houve_mudanca:
+        df_final = pd.concat(lista_dfs, ignore_index=True)
+        try:
+            # Exporta o dataset consolidado mantendo o padrão brasileiro de decimal
+            df_final.to_csv(arquivo_saida, index=False, sep=';', encoding='utf-8', decimal=',')
+            salvar_manifesto(manifesto, caminho_manifesto)
+            print(f"✅ Arquivo unificado salvo com sucesso!")
+        except PermissionError:
+            print("⚠️ Feche o arquivo no Excel e tente novamente!")
+            exit()
+    elif lista_dfs:
+        salvar_manifesto(manifesto, caminho_manifesto)
+        print("✅ Nenhum arquivo alterado: unificado mantido.")
+    else:
+        print("Nenhum arquivo encontrado.")
+
+    return arquivo_saida
 
 # ==============================================================================
 # 3. EXTRAÇÃO, TRANSFORMAÇÃO E LIMPEZA (ETL)
 # ==============================================================================
-print("\n--- Carregando para Análise ---")
-
-base_path = r'C:\Users\lucas\Desktop\tcc_dashboard_poa\data'
-caminho_receita = os.path.join(base_path, 'receitas', 'receita.csv')
-caminho_despesa = arquivo_saida 
-
-anos_foco = [2019, 2020, 2021, 2022, 2023]
-
-# --- 3.1 Tratamento de Receitas ---
-try:
-    df_receita = pd.read_csv(caminho_receita, sep=';', encoding='utf-8', 
-                             converters={'valor_arrecadado': limpar_moeda, 'valor_orcado': limpar_moeda})
-except:
-    df_receita = pd.read_csv(caminho_receita, sep=';', encoding='latin1', 
-                             converters={'valor_arrecadado': limpar_moeda, 'valor_orcado': limpar_moeda})
-
-# --- 3.2 Tratamento de Despesas (Arquivo Unificado) ---
-df_despesa = pd.read_csv(caminho_despesa, sep=';', encoding='utf-8', decimal=',')
-
-# --- 3.3 Padronização e Filtragem (Receitas) ---
-if 'df_receita' in locals():
-    cols_rec = ['ano', 'mes', 'nome_origem', 'nome_especie', 'nome_tipo', 'valor_arrecadado', 'valor_orcado']
-    cols_existentes = [c for c in cols_rec if c in df_receita.columns]
-    
-    df_receita = df_receita[cols_existentes].copy()
-    df_receita.rename(columns={'ano': 'ano_exercicio', 'valor_arrecadado': 'valor_realizado'}, inplace=True)
-    
-    # Filtro temporal e marcação de tipo
-    df_receita = df_receita[df_receita['ano_exercicio'].isin(anos_foco)]
-    df_receita['tipo_conta'] = 'Receita'
-
-# --- 3.4 Padronização e Filtragem (Despesas) ---
-    # Seleção de colunas de interesse (incluindo hierarquia orçamentária)
-    cols_desp = [
-        'exercicio', 'mes', 'nome_orgao', 'desc_funcao', 'desc_elemento', 
-        'desc_categoria', 'desc_natureza',
-        'vlorcini', 'vlpag', 'vlemp', 'vlliq'
-    ]
-    
-    cols_existentes = [c for c in cols_desp if c in df_despesa.columns]
-    df_despesa = df_despesa[cols_existentes].copy()
-    
-    # Renomeação para termos mais claros e padronizados com o app
-    df_despesa.rename(columns={
-        'exercicio': 'ano_exercicio', 
-        'vlpag': 'valor_realizado', 
-        'vlorcini': 'valor_orcado',
-        'vlemp': 'valor_empenhado',
-        'vlliq': 'valor_liquidado'
-    }, inplace=True)
-    
-    # Filtro temporal
-    df_despesa = df_despesa[df_despesa['ano_exercicio'].isin(anos_foco)]
-    
-    # Normalização de strings (Remoção de espaços e Upper Case)
-    if 'desc_funcao' in df_despesa.columns:
-        df_despesa['desc_funcao'] = df_despesa['desc_funcao'].astype(str).str.strip().str.upper()
-    if 'nome_orgao' in df_despesa.columns:
-        df_despesa['nome_orgao'] = df_despesa['nome_orgao'].astype(str).str.strip().str.upper()
-        
-    df_despesa['tipo_conta'] = 'Despesa'
-
-print("\n--- Amostra Final ---")
-print(df_despesa[['desc_funcao', 'valor_orcado', 'valor_empenhado', 'valor_liquidado', 'valor_realizado']].head())
+
+# Modelo estrela da camada curada: dimensão -> atributos (códigos do portal, rótulos e
+# marcadores derivados deles). A fato fica só com as chaves e os valores, então um ano
+# novo cresce a fato e acrescenta poucas linhas às dimensões.
+ESTRELA_DESPESA = {
+    'tempo': ['ano_exercicio', 'mes'],
+    'orgao': ['cod_orgao', 'nome_orgao'],
+    'funcao': ['cod_funcao', 'desc_funcao'],
+    'economica': [
+        'cod_categoria', 'desc_categoria', 'cod_natureza', 'desc_natureza',
+        'cod_modalidade', 'desc_modalidade', 'cod_elemento', 'desc_elemento',
+        'eh_corrente', 'eh_capital'
+    ],
+}
+ESTRELA_RECEITA = {
+    'tempo': ['ano_exercicio', 'mes'],
+    'receita': ['nome_origem', 'nome_especie', 'nome_tipo', 'eh_receita_propria', 'eh_tributaria', 'eh_transferencia'],
+}
+def carregar_para_analise(arquivo_saida, base_path=BASE_PATH, incremental=False):
+    """
+    Lê receitas e o unificado de despesas, padroniza, filtra os anos de foco e grava a camada curada.
+    Com `incremental`, só as partições (ano, mês) com conteúdo alterado são regravadas.
+    """
+    print("\n--- Carregando para Análise ---")
+
+    caminho_receita = os.path.join(base_path, 'receitas', 'receita.csv')
+    caminho_despesa = arquivo_saida 
+    # Regras dos marcadores (receita própria, transferência, corrente/capital...):
+    # regras_classificacao.csv na pasta base, se existir; senão as regras padrão
+    regras = carregar_regras_classificacao(os.path.join(base_path, 'regras_classificacao.csv'))
+
+    anos_foco = [2019, 2020, 2021, 2022, 2023]
+
+    # --- 3.1 Tratamento de Receitas ---
+    colunas_moeda_rec = ['valor_arrecadado', 'valor_orcado']
+    try:
+        df_receita = pd.read_csv(caminho_receita, sep=';', encoding='utf-8', dtype=dtypes_moeda(colunas_moeda_rec))
+    except:
+        df_receita = pd.read_csv(caminho_receita, sep=';', encoding='latin1', dtype=dtypes_moeda(colunas_moeda_rec))
+    converter_colunas_moeda(df_receita, colunas_moeda_rec)
+
+    # --- 3.2 Tratamento de Despesas (Arquivo Unificado) ---
+    df_despesa = pd.read_csv(caminho_despesa, sep=';', encoding='utf-8', decimal=',')
+
+    # --- 3.3 Padronização e Filtragem (Receitas) ---
+    if 'df_receita' in locals():
+        cols_rec = ['ano', 'mes', 'nome_origem', 'nome_especie', 'nome_tipo', 'valor_arrecadado', 'valor_orcado']
+        cols_existentes = [c for c in cols_rec if c in df_receita.columns]
+
+        df_receita = df_receita[cols_existentes].copy()
+        df_receita.rename(columns={'ano': 'ano_exercicio', 'valor_arrecadado': 'valor_realizado'}, inplace=True)
+
+        # Filtro temporal e marcação de tipo
+        df_receita = df_receita[df_receita['ano_exercicio'].isin(anos_foco)]
+        normalizar_categorias(df_receita, COLUNAS_CATEGORICAS_RECEITA)
+        classificar(df_receita, regras)
+        df_receita['tipo_conta'] = 'Receita'
+
+    # --- 3.4 Padronização e Filtragem (Despesas) ---
+        # Seleção de colunas de interesse (incluindo hierarquia orçamentária) e
+        # renomeação para termos mais claros e padronizados com o app
+        df_despesa = padronizar_despesas(df_despesa)
+
+        # Filtro temporal
+        df_despesa = df_despesa[df_despesa['ano_exercicio'].isin(anos_foco)]
+
+        # Normalização de strings (Remoção de espaços e Upper Case) feita sobre o
+        # dicionário de cada coluna de hierarquia, que passa a ser `category`
+        normalizar_categorias(df_despesa, COLUNAS_CATEGORICAS_DESPESA)
+        classificar(df_despesa, regras)
+
+        df_despesa['tipo_conta'] = 'Despesa'
+
+    # --- 3.5 Camada Curada (Modelo Estrela em Parquet Particionado por Ano e Mês) ---
+    # Fato estreita (chaves inteiras + valores) e dimensões pequenas, consumidas
+    # diretamente pelo APP.py, que assim evita reprocessar o CSV unificado e a
+    # normalização de strings a cada cold start. No modo incremental, a reextração
+    # diária do portal regrava só os meses cujo conteúdo mudou (checksum por partição);
+    # o manifesto _particoes.json de cada tabela diz ao app quais agregados refazer.
+    pasta_curada = os.path.join(base_path, 'curado')
+    if pyarrow_disponivel():
+        for nome, df, modelo in [('despesas', df_despesa, ESTRELA_DESPESA), ('receitas', df_receita, ESTRELA_RECEITA)]:
+            alteradas = salvar_camada_curada(
+                df.drop(columns=['tipo_conta']), os.path.join(pasta_curada, nome), modelo=modelo, incremental=incremental
+            )
+            print(f"   {nome}: {len(alteradas)} partição(ões) gravada(s) {', '.join(alteradas[:12])}{' ...' if len(alteradas) > 12 else ''}")
+        print(f"✅ Camada curada (Parquet) salva em {pasta_curada}")
+    else:
+        print("⚠️ pyarrow não instalado: camada curada não gerada (o app usará os CSVs).")
+
+    print("\n--- Amostra Final ---")
+    print(df_despesa[['desc_funcao', 'valor_orcado', 'valor_empenhado', 'valor_liquidado', 'valor_realizado']].head())
+
+    return df_receita, df_despesa, base_path
 
 # ==============================================================================
 # 4. PREPARAÇÃO DE DADOS PARA VISUALIZAÇÃO (SANKEY)
 # ==============================================================================
+def preparar_sankey(df_receita, df_despesa, base_path):
+    """
+    Agrupa Top 5 de receitas/despesas e exporta o fluxo consolidado para o Sankey do app.
+    """
 
-# Lógica de Agrupamento: Seleciona Top 5 e agrupa o restante em "OUTROS"
-# Isso evita que o gráfico de Sankey fique ilegível com excesso de nós.
+    # Lógica de Agrupamento: Seleciona Top 5 e agrupa o restante em "OUTROS"
+    # Isso evita que o gráfico de Sankey fique ilegível com excesso de nós.
 
-# 4.1 Agrupamento de Despesas (Por Função)
-total_por_funcao = df_despesa.groupby('desc_funcao')['valor_realizado'].sum().sort_values(ascending=False)
-top_5_funcoes = total_por_funcao.head(5).index.tolist()
-df_despesa['funcao_sankey'] = df_despesa['desc_funcao'].apply(lambda x: x if x in top_5_funcoes else 'OUTRAS DESPESAS')
+    # 4.1 Agrupamento de Despesas (Por Função)
+    df_despesa['funcao_sankey'] = colapsar_top_n(df_despesa['desc_funcao'], df_despesa['valor_realizado'], 5, 'OUTRAS DESPESAS')
 
-# 4.2 Agrupamento de Receitas (Por Tipo)
-top_rec = df_receita.groupby('nome_tipo')['valor_realizado'].sum().sort_values(ascending=False).head(5).index.tolist()
-df_receita['receita_sankey'] = df_receita['nome_tipo'].apply(lambda x: x if x in top_rec else 'OUTRAS RECEITAS')
+    # 4.2 Agrupamento de Receitas (Por Tipo)
+    df_receita['receita_sankey'] = colapsar_top_n(df_receita['nome_tipo'], df_receita['valor_realizado'], 5, 'OUTRAS RECEITAS')
 
-# 4.3 Construção do Fluxo (Origem -> Destino)
-# Fluxo de Entrada: Fonte de Receita -> Tesouro Municipal
-df_entrada = df_receita.groupby(['ano_exercicio', 'receita_sankey'], as_index=False)['valor_realizado'].sum()
-df_entrada['source'] = df_entrada['receita_sankey']
-df_entrada['target'] = 'Tesouro Municipal'
+    # 4.3 Construção do Fluxo (Origem -> Destino)
+    # Fluxo de Entrada: Fonte de Receita -> Tesouro Municipal
+    df_entrada = df_receita.groupby(['ano_exercicio', 'receita_sankey'], as_index=False, observed=True)['valor_realizado'].sum()
+    df_entrada['source'] = df_entrada['receita_sankey']
+    df_entrada['target'] = 'Tesouro Municipal'
 
-# Fluxo de Saída: Tesouro Municipal -> Função de Despesa
-df_saida = df_despesa.groupby(['ano_exercicio', 'funcao_sankey'], as_index=False)['valor_realizado'].sum()
-df_saida['source'] = 'Tesouro Municipal'
-df_saida['target'] = df_saida['funcao_sankey']
+    # Fluxo de Saída: Tesouro Municipal -> Função de Despesa
+    df_saida = df_despesa.groupby(['ano_exercicio', 'funcao_sankey'], as_index=False, observed=True)['valor_realizado'].sum()
+    df_saida['source'] = 'Tesouro Municipal'
+    df_saida['target'] = df_saida['funcao_sankey']
 
-# 4.4 Consolidação e Exportação
-df_fluxo = pd.concat([df_entrada, df_saida], ignore_index=True)
-df_fluxo.to_csv(os.path.join(base_path, 'dados_sankey_tcc.csv'), index=False, sep=';', decimal=',')
+    # 4.4 Consolidação e Exportação
+    df_fluxo = pd.concat([df_entrada, df_saida], ignore_index=True)
+    df_fluxo.to_csv(os.path.join(base_path, 'dados_sankey_tcc.csv'), index=False, sep=';', decimal=',')
+
+    print("ETL Concluído com sucesso (Global)!")
+
+# ==============================================================================
+# 5. SNAPSHOT DE KPIs (CABEÇALHO DO PAINEL)
+# ==============================================================================
+def materializar_kpis(df_receita, df_despesa, base_path):
+    """
+    Grava a tabela de KPIs por ano e por ano x mês lida pelo app para exibir os
+    indicadores do cabeçalho sem carregar os dados detalhados. A coluna `regras` guarda
+    a impressão das regras de classificação usadas (a receita própria depende delas).
+    """
+    snapshot = construir_snapshot_kpis(df_receita, df_despesa)
+    regras = carregar_regras_classificacao(os.path.join(base_path, 'regras_classificacao.csv'))
+    snapshot['regras'] = impressao_regras(regras)
+    snapshot.to_csv(os.path.join(base_path, 'kpis_snapshot.csv'), index=False, sep=';', decimal=',')
+    print(f"✅ Snapshot de KPIs salvo ({len(snapshot)} linhas)")
+
+# ==============================================================================
+# 6. VERSÃO DOS DADOS (SINAL DE ATUALIZAÇÃO PARA O APP)
+# ==============================================================================
+def publicar_versao(arquivo_saida, base_path):
+    """
+    Última etapa: publica o manifesto de versão das saídas lidas pelo app. O painel em
+    execução percebe a versão nova, aquece os caches com ela e troca sem restart.
+    """
+    arquivos = [
+        arquivo_saida,
+        os.path.join(base_path, 'receitas', 'receita.csv'),
+        os.path.join(base_path, 'dados_sankey_tcc.csv'),
+        os.path.join(base_path, 'kpis_snapshot.csv'),
+        os.path.join(base_path, 'regras_classificacao.csv'),
+    ]
+    pastas_curadas = {t: os.path.join(base_path, 'curado', t) for t in ('receitas', 'despesas')}
+    versao = publicar_versao_dados(base_path, arquivos, pastas_curadas)
+    print(f"✅ Versão dos dados publicada: {versao}")
+
+# ==============================================================================
+# 7. EXECUÇÃO (PARÂMETROS DE LINHA DE COMANDO)
+# ==============================================================================
+# Por padrão o ETL é incremental: só reprocessa os arquivos anuais novos ou alterados
+# desde a última execução (ver manifesto) e só regrava na camada curada os meses
+# alterados. `--completo` força a reconstrução total.
+# `--workers N` lê os arquivos anuais em paralelo (N processos; 0 = todos os núcleos).
+# `--streaming` unifica em blocos de `--tamanho-bloco` linhas: a unificação roda com memória
+# constante, mas a carga para análise (seção 3) ainda lê o unificado inteiro.
+# O guard `__main__` é obrigatório para o pool de processos no Windows (spawn).
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ETL das despesas e receitas de Porto Alegre")
+    parser.add_argument('--completo', action='store_true', help="Ignora o manifesto e reprocessa todos os arquivos")
+    parser.add_argument('--streaming', action='store_true', help="Unifica em blocos, sem carregar os arquivos anuais inteiros em memória (a etapa de análise ainda lê o unificado inteiro)")
+    parser.add_argument('--tamanho-bloco', type=int, default=200_000, help="Linhas por bloco no modo --streaming")
+    parser.add_argument('--workers', type=int, default=1, help="Processos para a leitura dos arquivos anuais (0 = todos os núcleos)")
+    args = parser.parse_args()
 
-print("ETL Concluído com sucesso (Global)!")
\ No newline at end of file
+    arquivo_saida = unificar_despesas(args)
+    df_receita, df_despesa, base_path = carregar_para_analise(arquivo_saida, incremental=not args.completo)
+    preparar_sankey(df_receita, df_despesa, base_path)
+    materializar_kpis(df_receita, df_despesa, base_path)
+    publicar_versao(arquivo_saida, base_path)
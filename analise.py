@@ -0,0 +1,678 @@
+import numpy as np
+import pandas as pd
+
+from instrumentacao import medido
+
+# ==============================================================================
+# 1. CUBO DE AGREGADOS (DESPESAS E RECEITAS)
+# ==============================================================================
+# O cubo é montado uma única vez por carga de dados, no grão mais fino usado pelos
+# gráficos. Cada gráfico faz seu roll-up a partir dele, sem reagrupar as linhas brutas.
+
+# Os marcadores booleanos de `tratamento.classificar` dependem só da categoria/origem,
+# então entram como dimensões sem aumentar o número de linhas do cubo
+DIMENSOES_DESPESA = [
+    'ano_exercicio', 'mes', 'nome_orgao', 'desc_funcao',
+    'desc_categoria', 'desc_natureza', 'desc_elemento',
+    'eh_corrente', 'eh_capital'
+]
+MEDIDAS_DESPESA = ['valor_orcado', 'valor_empenhado', 'valor_liquidado', 'valor_realizado']
+
+DIMENSOES_RECEITA = [
+    'ano_exercicio', 'mes', 'nome_origem', 'nome_especie', 'nome_tipo',
+    'eh_receita_propria', 'eh_tributaria', 'eh_transferencia'
+]
+MEDIDAS_RECEITA = ['valor_orcado', 'valor_realizado']
+
+@medido
+def construir_cubo(df, dimensoes, medidas):
+    """
+    Agrega o DataFrame bruto no grão `dimensoes`, somando as `medidas`.
+    Chaves nulas são preservadas (dropna=False) para que os totais batam com os dados brutos.
+    """
+    dims = [d for d in dimensoes if d in df.columns]
+    meds = [m for m in medidas if m in df.columns]
+    return df.groupby(dims, dropna=False, observed=True, sort=False)[meds].sum().reset_index()
+
+def construir_cubo_despesa(df_despesa):
+    return construir_cubo(df_despesa, DIMENSOES_DESPESA, MEDIDAS_DESPESA)
+
+def construir_cubo_receita(df_receita):
+    return construir_cubo(df_receita, DIMENSOES_RECEITA, MEDIDAS_RECEITA)
+
+def filtrar_cubo(cubo, anos=None, filtros=None):
+    """
+    Recorta o cubo por anos e por filtros {coluna: valor ou lista de valores}.
+    """
+    if anos is not None:
+        cubo = cubo[cubo['ano_exercicio'].isin(anos)]
+    for coluna, valor in (filtros or {}).items():
+        if isinstance(valor, (list, tuple, set, pd.Index)):
+            cubo = cubo[cubo[coluna].isin(valor)]
+        else:
+            cubo = cubo[cubo[coluna] == valor]
+    return cubo
+
+@medido
+def agregar(cubo, dimensoes=None, medidas=None, anos=None, filtros=None, dropna=True):
+    """
+    Roll-up do cubo: soma as `medidas` por `dimensoes` (após os filtros).
+    Sem dimensões, retorna uma Series com o total de cada medida.
+    `dropna=True` segue o padrão do groupby do pandas (descarta chaves nulas).
+    """
+    cubo = filtrar_cubo(cubo, anos=anos, filtros=filtros)
+    if medidas is None:
+        medidas = [c for c in MEDIDAS_DESPESA if c in cubo.columns]
+    if not dimensoes:
+        return cubo[medidas].sum()
+    return cubo.groupby(list(dimensoes), dropna=dropna, observed=True)[medidas].sum().reset_index()
+
+# ==============================================================================
+# 2. VISÕES FILTRADAS POR ANO
+# ==============================================================================
+# Recortes prontos para os gráficos: `mes_num` já calculado e hierarquias sem nulos.
+# São compartilhados entre reruns (cache), portanto devem ser tratados como somente
+# leitura: quem precisar alterar um recorte deve trabalhar sobre uma `.copy()`.
+
+COLUNAS_HIERARQUIA_DESPESA = ['desc_funcao', 'nome_orgao', 'desc_categoria', 'desc_natureza', 'desc_elemento']
+COLUNAS_HIERARQUIA_RECEITA = ['nome_origem', 'nome_especie', 'nome_tipo']
+
+@medido
+def preparar_visao(df, anos, colunas_hierarquia, rotulo_vazio):
+    """
+    Filtra os anos, adiciona `mes_num` e preenche os nulos das colunas de hierarquia.
+    Sempre retorna um DataFrame novo (nunca uma view do original).
+    """
+    visao = df[df['ano_exercicio'].isin(anos)].copy()
+    visao['mes_num'] = pd.to_numeric(visao['mes'], errors='coerce')
+    for c in colunas_hierarquia:
+        if c in visao.columns:
+            coluna = visao[c]
+            if isinstance(coluna.dtype, pd.CategoricalDtype) and rotulo_vazio not in coluna.cat.categories:
+                coluna = coluna.cat.add_categories([rotulo_vazio])
+            visao[c] = coluna.fillna(rotulo_vazio)
+    return visao
+
+@medido
+def preparar_visoes_ano(df_receita, df_despesa, cubo_receita, cubo_despesa, anos):
+    """
+    Monta os quatro recortes usados pelo app para os `anos` selecionados:
+    receitas e despesas brutas (tabelas) e os respectivos cubos (gráficos).
+    """
+    anos = list(anos)
+    return (
+        preparar_visao(df_receita, anos, COLUNAS_HIERARQUIA_RECEITA, "NÃO CLASSIFICADO"),
+        preparar_visao(df_despesa, anos, COLUNAS_HIERARQUIA_DESPESA, "NÃO INFORMADO"),
+        preparar_visao(cubo_receita, anos, COLUNAS_HIERARQUIA_RECEITA, "NÃO CLASSIFICADO"),
+        preparar_visao(cubo_despesa, anos, COLUNAS_HIERARQUIA_DESPESA, "NÃO INFORMADO"),
+    )
+
+# ==============================================================================
+# 3. DIAGRAMAS DE SANKEY HIERÁRQUICOS
+# ==============================================================================
+# Nós e links são montados por nível, com operações de coluna (sem iterrows e sem
+# varrer a tabela de links nó a nó para calcular os totais dos rótulos).
+
+def _por_linha(valor, n):
+    """
+    Expande um escalar para um array de `n` posições (ou converte uma sequência já alinhada).
+    """
+    if valor is None or isinstance(valor, str) or np.isscalar(valor):
+        return np.full(n, valor, dtype=object)
+    return np.asarray(valor, dtype=object)
+
+def montar_sankey(df, niveis, valor='valor_realizado', raiz=None, cores_nos=None,
+                  cores_links=None, chave_por_caminho=True):
+    """
+    Monta nós e links de um Sankey hierárquico a partir de um DataFrame já agregado
+    (uma linha por combinação de `niveis`).
+
+    - `raiz`: rótulo de um nó inicial ligado a todo o primeiro nível (None = sem raiz).
+    - `cores_nos` / `cores_links`: uma entrada por nível; cada uma pode ser um escalar
+      ou uma sequência alinhada às linhas de `df`. `cores_links[i]` colore os links que
+      chegam ao nível i (o índice 0 só é usado com raiz). A raiz é sempre branca.
+    - `chave_por_caminho`: True identifica o nó pelo caminho completo (o mesmo rótulo em
+      ramos diferentes gera nós distintos); False identifica só pelo rótulo dentro do nível.
+
+    Os nós seguem a ordem de primeira aparição (linha a linha, nível a nível) e a cor de
+    cada nó é a da linha em que ele aparece primeiro.
+    Retorna (nos, links): `nos` com rotulo, cor, nivel e valor (entrada do nó, ou saída
+    quando não há entrada); `links` com source, target, color e value, somados por par.
+    """
+    df = df.reset_index(drop=True)
+    n = len(df)
+    cores_nos = cores_nos or ["rgba(0, 243, 255, 0.5)"] * len(niveis)
+    cores_links = cores_links or ['rgba(255,255,255,0.1)'] * len(niveis)
+    deslocamento = 0 if raiz is None else 1
+
+    # 1. Identificação dos nós de cada nível (código inteiro por linha, sobre os códigos das
+    #    categorias, e linha de primeira aparição); o rótulo só é lido para essas linhas
+    codigos_nivel = []
+    blocos_nos = []
+    for i, col in enumerate(niveis):
+        cols_chave = niveis[:i + 1] if chave_por_caminho else [col]
+        codigos = df.groupby(cols_chave, sort=False, observed=True, dropna=False).ngroup().to_numpy()
+        _, primeira_linha = np.unique(codigos, return_index=True)
+        codigos_nivel.append(codigos)
+        blocos_nos.append(pd.DataFrame({
+            'nivel': i,
+            'codigo': np.arange(len(primeira_linha)),
+            'linha': primeira_linha,
+            'rotulo': df[col].iloc[primeira_linha].astype(object).to_numpy(),
+            'cor': _por_linha(cores_nos[i], n)[primeira_linha],
+        }))
+
+    nos = pd.concat(blocos_nos, ignore_index=True).sort_values(['linha', 'nivel'], kind='stable')
+    nos['id'] = np.arange(len(nos)) + deslocamento
+
+    # Tabela código -> id global, por nível
+    ids_nivel = []
+    for i in range(len(niveis)):
+        bloco = nos[nos['nivel'] == i].sort_values('codigo')
+        ids_nivel.append(bloco['id'].to_numpy()[codigos_nivel[i]])
+
+    # 2. Links entre níveis consecutivos (e da raiz para o primeiro nível)
+    valores = df[valor].to_numpy()
+    blocos_links = []
+    for i in range(len(niveis)):
+        if i == 0 and raiz is None:
+            continue
+        origem = np.zeros(n, dtype=int) if i == 0 else ids_nivel[i - 1]
+        blocos_links.append(pd.DataFrame({
+            'source': origem, 'target': ids_nivel[i],
+            'color': _por_linha(cores_links[i], n), 'value': valores,
+        }))
+    if blocos_links:
+        links = pd.concat(blocos_links, ignore_index=True)
+        links = links.groupby(['source', 'target', 'color'])['value'].sum().reset_index()
+    else:
+        links = pd.DataFrame(columns=['source', 'target', 'color', 'value'])
+
+    # 3. Tabela final de nós, com o total usado nos rótulos
+    nos = nos[['id', 'rotulo', 'cor', 'nivel']].set_index('id')
+    if raiz is not None:
+        nos = pd.concat([pd.DataFrame({'rotulo': [raiz], 'cor': ['#FFFFFF'], 'nivel': [-1]}, index=[0]), nos])
+    entrada = links.groupby('target')['value'].sum().reindex(nos.index, fill_value=0)
+    saida = links.groupby('source')['value'].sum().reindex(nos.index, fill_value=0)
+    nos['valor'] = entrada.where(entrada != 0, saida)
+    return nos.reset_index(drop=True), links
+
+# ==============================================================================
+# 4. TOP-N COM AGRUPAMENTO "OUTROS", ÁRVORES PRÉ-AGREGADAS E RÓTULOS DE VALOR
+# ==============================================================================
+
+# Rótulo do grupo de itens agrupados. Não deve coincidir com uma categoria real: se
+# coincidir, `rotulo_livre` acrescenta um sufixo (senão os dois se fundiriam em silêncio)
+ROTULO_OUTROS = 'OUTROS (agrupados)'
+
+def rotulo_livre(rotulo, existentes):
+    """
+    `rotulo` se ele não está entre os `existentes`; senão `rotulo (2)`, `rotulo (3)`...
+    """
+    existentes = set(existentes)
+    livre, n = rotulo, 1
+    while livre in existentes:
+        n += 1
+        livre = f"{rotulo} ({n})"
+    return livre
+
+def colapsar_top_n(rotulos, valores, n, rotulo_outros=ROTULO_OUTROS):
+    """
+    Mantém os `n` rótulos de maior soma de `valores` e junta o restante (inclusive nulos)
+    em `rotulo_outros` (com sufixo se coincidir com um rótulo real). Retorna uma Series
+    categórica alinhada a `rotulos`, com as categorias na ordem do ranking e o grupo por último.
+    A troca é feita sobre os códigos da categoria, sem teste de pertinência linha a linha.
+    """
+    rotulos = pd.Series(rotulos)
+    cat = pd.Categorical(rotulos)
+    totais = pd.Series(np.asarray(valores, dtype='float64'), index=rotulos.index).groupby(cat, observed=True).sum()
+    top = totais.nlargest(n).index
+
+    categorias = list(top) + [rotulo_livre(rotulo_outros, cat.categories)]
+    codigo_outros = len(categorias) - 1
+
+    # Código antigo (posição na categoria original) -> código novo (posição no ranking ou "outros")
+    posicao_top = pd.Index(top).get_indexer(cat.categories)
+    novos = np.where(posicao_top >= 0, posicao_top, codigo_outros)
+    codigos = np.where(cat.codes >= 0, novos[cat.codes], codigo_outros)
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=categorias), index=rotulos.index, name=rotulos.name)
+
+# Teto de folhas exibidas por treemap/sunburst: o tamanho do payload do gráfico fica
+# limitado (≈ folhas x profundidade nós), independentemente do volume de dados
+MAX_FOLHAS_ARVORE = 300
+
+@medido
+def agregar_arvore(df, caminho, profundidade=None, valor='valor_realizado', valor_minimo=0,
+                   max_folhas=MAX_FOLHAS_ARVORE, rotulo_outros=ROTULO_OUTROS):
+    """
+    Pré-agrega uma hierarquia para px.treemap/px.sunburst (uma linha por folha):
+
+    - soma `valor` (só linhas positivas) até `profundidade` níveis de `caminho`;
+    - folhas abaixo de `valor_minimo` ou fora das `max_folhas` maiores viram um nó
+      `rotulo_outros` sob o próprio pai;
+    - nós cujos filhos foram todos agrupados são recolhidos, nível a nível, no
+      `rotulo_outros` do avô (repetido nos níveis abaixo: o plotly não aceita nulos
+      no caminho de forma confiável);
+    - `rotulo_outros` recebe sufixo se coincidir com uma categoria real do caminho.
+
+    Retorna um DataFrame com as colunas de `caminho` (object), `valor` e `agrupado`
+    (True nas folhas que são grupos de itens menores).
+    """
+    caminho = list(caminho[:profundidade] if profundidade else caminho)
+    base = df[df[valor] > 0]
+    arvore = base.groupby(caminho, observed=True)[valor].sum().reset_index()
+    arvore = arvore[arvore[valor] > 0]
+    for c in caminho:
+        arvore[c] = arvore[c].astype(object)
+    rotulo_outros = rotulo_livre(rotulo_outros, pd.unique(arvore[caminho].to_numpy().ravel()))
+
+    pequenas = (arvore[valor] < valor_minimo) | (arvore[valor].rank(method='first', ascending=False) > max_folhas)
+    arvore.loc[pequenas, caminho[-1]] = rotulo_outros
+    arvore = arvore.groupby(caminho, sort=False)[valor].sum().reset_index()
+
+    for nivel in range(len(caminho) - 1, 0, -1):
+        filho = caminho[nivel]
+        agrupado = arvore[filho].eq(rotulo_outros)
+        sem_filhos_visiveis = agrupado.groupby([arvore[c] for c in caminho[:nivel]]).transform('all')
+        if not sem_filhos_visiveis.any():
+            continue
+        arvore.loc[sem_filhos_visiveis, caminho[nivel - 1:]] = rotulo_outros
+        arvore = arvore.groupby(caminho, sort=False)[valor].sum().reset_index()
+
+    arvore['agrupado'] = arvore[caminho].eq(rotulo_outros).any(axis=1)
+    return arvore.sort_values(valor, ascending=False, ignore_index=True)
+
+def _decimais(escalado, casas):
+    """
+    Formata inteiros já escalados com `casas` decimais (ex.: 1234, 2 -> '12.34').
+    """
+    base = 10 ** casas
+    return (escalado // base).astype(str) + '.' + (escalado % base).astype(str).str.zfill(casas)
+
+def formatar_rotulos_valor(valores, bilhoes=False):
+    """
+    Rótulos curtos de valor para as barras: 'R$ 1.2M' a partir de um milhão,
+    'R$ 12,345' abaixo disso e, com `bilhoes=True`, 'R$ 1.23B' a partir de um bilhão.
+    Vetorizado (aritmética inteira + operações de string), sem `apply` por linha.
+    """
+    v = pd.Series(valores, dtype='float64')
+    unidades = v.round(0).astype('int64').astype(str).str.replace(r'(\d)(?=(\d{3})+$)', r'\1,', regex=True)
+    milhoes = _decimais((v / 1e5).round(0).astype('int64'), 1) + 'M'
+    rotulos = np.where(v >= 1e6, milhoes, unidades)
+    if bilhoes:
+        rotulos = np.where(v >= 1e9, _decimais((v / 1e7).round(0).astype('int64'), 2) + 'B', rotulos)
+    return pd.Series('R$ ' + pd.Series(rotulos, index=v.index), index=v.index)
+
+# ==============================================================================
+# 5. INDICADORES (KPIs) E FUNIL DE EXECUÇÃO
+# ==============================================================================
+# A partir daqui, as funções reproduzem os cálculos de cada bloco do painel.
+# São puras (não usam Streamlit, não alteram as entradas e dependem só dos cubos e
+# de parâmetros escalares), podendo ser memorizadas uma a uma ou rodadas em lote.
+
+ETAPAS_FUNIL = [
+    ('Orçado', 'valor_orcado'), ('Empenhado', 'valor_empenhado'),
+    ('Liquidado', 'valor_liquidado'), ('Pago', 'valor_realizado')
+]
+
+@medido
+def kpis_balanco(cubo_receita, cubo_despesa):
+    """
+    Totais do balanço (receita, despesa, resultado e margem) e a autonomia fiscal:
+    % da receita vinda de origens próprias (marcador `eh_receita_propria`).
+    """
+    total_rec = agregar(cubo_receita, medidas=['valor_realizado'])['valor_realizado']
+    total_desp = agregar(cubo_despesa, medidas=['valor_realizado'])['valor_realizado']
+    resultado = total_rec - total_desp
+
+    rec_propria = 0
+    if 'eh_receita_propria' in cubo_receita.columns:
+        rec_propria = agregar(cubo_receita, medidas=['valor_realizado'], filtros={'eh_receita_propria': True})['valor_realizado']
+
+    return {
+        'total_receita': total_rec,
+        'total_despesa': total_desp,
+        'resultado': resultado,
+        'margem_pct': (resultado / total_rec * 100) if total_rec else None,
+        'receita_propria': rec_propria,
+        'autonomia_pct': (rec_propria / total_rec * 100) if total_rec > 0 else 0,
+    }
+
+@medido
+def kpis_receita(cubo_receita):
+    """
+    Total arrecadado, meses com registro e média mensal.
+    """
+    total = agregar(cubo_receita, medidas=['valor_realizado'])['valor_realizado']
+    qtd_meses = cubo_receita['mes'].nunique()
+    return {
+        'total_receita': total,
+        'qtd_meses': qtd_meses,
+        'media_mensal': total / qtd_meses if qtd_meses > 0 else 0,
+    }
+
+@medido
+def funil_execucao(cubo, filtros=None):
+    """
+    Estágios da despesa (orçado -> empenhado -> liquidado -> pago) após os filtros.
+    Retorna um DataFrame com etapa, coluna, valor e `pct_anterior`
+    (% sobre o estágio anterior; NaN no primeiro ou quando o anterior é zero).
+    """
+    colunas = [c for _, c in ETAPAS_FUNIL]
+    totais = agregar(cubo, medidas=colunas, filtros=filtros)
+    valores = [totais[c] for c in colunas]
+    pct = [np.nan] + [(v / a * 100) if a else np.nan for a, v in zip(valores, valores[1:])]
+    return pd.DataFrame({
+        'etapa': [e for e, _ in ETAPAS_FUNIL], 'coluna': colunas,
+        'valor': valores, 'pct_anterior': pct,
+    })
+
+@medido
+def kpis_item(cubo, coluna, item, medida='valor_realizado'):
+    """
+    Contexto de um item (função ou órgão) dentro do cubo: totais do item,
+    participação no total, posição no ranking e elementos de despesa com pagamento.
+    """
+    cubo_item = cubo[cubo[coluna] == item]
+    totais = agregar(cubo_item)
+    total_geral = agregar(cubo, medidas=[medida])[medida]
+
+    ordem = ranking(cubo, coluna, medida=medida)
+    posicoes = ordem.index[ordem[coluna] == item]
+    return {
+        'totais': totais,
+        'perc_do_total': (totais[medida] / total_geral) * 100 if total_geral > 0 else 0,
+        'posicao': int(posicoes[0]) + 1 if len(posicoes) else None,
+        'qtd_itens': len(ordem),
+        'elementos_ativos': cubo_item[cubo_item[medida] > 0]['desc_elemento'].nunique(),
+    }
+
+@medido
+def correlacao_receita_despesa(cubo_receita, cubo_despesa, marcador_origem, funcoes):
+    """
+    Base do comparador: receita mensal (toda, ou só das linhas com o marcador booleano
+    `marcador_origem`, ex. 'eh_tributaria') em `Valor_X`, cruzada mês a mês com a
+    despesa das `funcoes`.
+    """
+    if marcador_origem:
+        cubo_receita = cubo_receita[cubo_receita[marcador_origem]]
+    rec_mes = agregar(cubo_receita, ['mes'], medidas=['valor_realizado']).rename(columns={'valor_realizado': 'Valor_X'})
+    desp_comp = agregar(cubo_despesa, ['mes', 'desc_funcao'], medidas=['valor_realizado'], filtros={'desc_funcao': funcoes})
+    return pd.merge(desp_comp, rec_mes, on='mes')
+
+# Snapshot de KPIs materializado pelo ETL: linhas por ano (nivel='ANO', mes=0) e por
+# ano x mês (nivel='MES'). As colunas aditivas podem ser somadas entre anos; as razões
+# são sempre recalculadas a partir delas.
+COLUNAS_ADITIVAS_SNAPSHOT = [
+    'receita_realizada', 'receita_orcada', 'receita_propria',
+    'despesa_orcada', 'despesa_empenhada', 'despesa_liquidada', 'despesa_paga'
+]
+
+def _razoes_snapshot(df):
+    """
+    Acrescenta resultado (superávit), autonomia e razões de execução às colunas aditivas.
+    """
+    df['resultado'] = df['receita_realizada'] - df['despesa_paga']
+    for coluna, num, den in (
+        ('autonomia_pct', 'receita_propria', 'receita_realizada'),
+        ('pct_empenho', 'despesa_empenhada', 'despesa_orcada'),
+        ('pct_liquidacao', 'despesa_liquidada', 'despesa_empenhada'),
+        ('pct_pagamento', 'despesa_paga', 'despesa_liquidada'),
+    ):
+        df[coluna] = (df[num] / df[den] * 100).where(df[den] > 0, 0.0)
+    return df
+
+@medido
+def construir_snapshot_kpis(df_receita, df_despesa):
+    """
+    Tabela pequena de KPIs por ano e por ano x mês, calculada uma vez no ETL:
+    receitas (realizada, orçada, própria), estágios da despesa, resultado,
+    autonomia fiscal e razões de execução (empenho/orçado, liquidado/empenho, pago/liquidado).
+    """
+    rec = df_receita[['ano_exercicio', 'mes', 'valor_realizado', 'valor_orcado']].copy()
+    rec['receita_propria'] = rec['valor_realizado'].where(df_receita['eh_receita_propria'], 0.0)
+    rec = rec.rename(columns={'valor_realizado': 'receita_realizada', 'valor_orcado': 'receita_orcada'})
+    desp = df_despesa[['ano_exercicio', 'mes'] + MEDIDAS_DESPESA].rename(columns={
+        'valor_orcado': 'despesa_orcada', 'valor_empenhado': 'despesa_empenhada',
+        'valor_liquidado': 'despesa_liquidada', 'valor_realizado': 'despesa_paga',
+    })
+
+    chaves = ['ano_exercicio', 'mes']
+    mensal = pd.merge(
+        rec.groupby(chaves).sum(), desp.groupby(chaves).sum(),
+        left_index=True, right_index=True, how='outer'
+    ).fillna(0.0).reset_index()
+    anual = mensal.groupby('ano_exercicio')[COLUNAS_ADITIVAS_SNAPSHOT].sum().reset_index()
+    anual['mes'] = 0
+
+    mensal['nivel'], anual['nivel'] = 'MES', 'ANO'
+    snapshot = pd.concat([anual, mensal], ignore_index=True)
+    snapshot = snapshot[['nivel', 'ano_exercicio', 'mes'] + COLUNAS_ADITIVAS_SNAPSHOT]
+    return _razoes_snapshot(snapshot)
+
+@medido
+def kpis_do_snapshot(snapshot, anos):
+    """
+    KPIs do balanço (mesmo contrato de `kpis_balanco`) somando as linhas anuais do
+    snapshot. Retorna None se o snapshot não existir ou não cobrir todos os `anos`.
+    """
+    if snapshot is None:
+        return None
+    linhas = snapshot[(snapshot['nivel'] == 'ANO') & snapshot['ano_exercicio'].isin(anos)]
+    if set(linhas['ano_exercicio']) != set(anos):
+        return None
+    soma = linhas[COLUNAS_ADITIVAS_SNAPSHOT].sum()
+    total_rec, total_desp = soma['receita_realizada'], soma['despesa_paga']
+    resultado = total_rec - total_desp
+    return {
+        'total_receita': total_rec,
+        'total_despesa': total_desp,
+        'resultado': resultado,
+        'margem_pct': (resultado / total_rec * 100) if total_rec else None,
+        'receita_propria': soma['receita_propria'],
+        'autonomia_pct': (soma['receita_propria'] / total_rec * 100) if total_rec > 0 else 0,
+    }
+
+# ==============================================================================
+# 6. RANKINGS E MAPAS DE CALOR
+# ==============================================================================
+
+@medido
+def ranking(cubo, coluna, n=None, medida='valor_realizado', filtros=None):
+    """
+    Soma de `medida` por `coluna`, em ordem decrescente (os `n` primeiros, se informado).
+    """
+    df = agregar(cubo, [coluna], medidas=[medida], filtros=filtros).sort_values(medida, ascending=False)
+    return (df if n is None else df.head(n)).reset_index(drop=True)
+
+@medido
+def serie_mensal(cubo, medida='valor_realizado', filtros=None):
+    """
+    Soma mensal de `medida`, ordenada pelo número do mês.
+    """
+    return agregar(cubo, ['mes_num', 'mes'], medidas=[medida], filtros=filtros).sort_values('mes_num')
+
+@medido
+def balanco_mensal(cubo_receita, cubo_despesa):
+    """
+    Receita e despesa pagas mês a mês, lado a lado (`_rec` / `_desp`), ordenadas pelo mês.
+    """
+    r_mes = agregar(cubo_receita, ['mes'], medidas=['valor_realizado'])
+    d_mes = agregar(cubo_despesa, ['mes'], medidas=['valor_realizado'])
+    df = pd.merge(r_mes, d_mes, on='mes', suffixes=('_rec', '_desp'))
+    df['mes_num'] = pd.to_numeric(df['mes'], errors='coerce')
+    return df.sort_values('mes_num')
+
+@medido
+def mapa_calor_mensal(cubo, coluna, medida='valor_realizado', decrescente=False):
+    """
+    Tabela longa (mes_num, mes, coluna, medida) para os heatmaps mês x categoria.
+    Ordenada por mês; com `decrescente=True`, pela categoria em ordem decrescente.
+    """
+    df = agregar(cubo, ['mes_num', 'mes', coluna], medidas=[medida])
+    if decrescente:
+        df = df.sort_values(by=coluna, ascending=False)
+    return df
+
+# ==============================================================================
+# 7. FLUXOS (SANKEY) DO PAINEL
+# ==============================================================================
+
+@medido
+def fluxo_integrado(cubo_receita, cubo_despesa, top_receitas, top_despesas):
+    """
+    Sankey Receitas -> Tesouro -> Despesas: as `top_receitas` origens e as `top_despesas`
+    funções, com o restante agrupado em "OUTRAS". Retorna (fluxos, nos, cores_nos).
+    """
+    grp_rec = agregar(cubo_receita, ['nome_origem'], medidas=['valor_realizado'], dropna=False)
+    grp_rec['origem_sankey'] = colapsar_top_n(grp_rec['nome_origem'], grp_rec['valor_realizado'], top_receitas, 'OUTRAS FONTES')
+    df_flow_in = grp_rec.groupby('origem_sankey', observed=True)['valor_realizado'].sum().reset_index()
+    df_flow_in['source'] = df_flow_in['origem_sankey'].astype(object)
+    df_flow_in['target'] = "TESOURO MUNICIPAL"
+    df_flow_in['color_link'] = "rgba(0, 255, 153, 0.3)"
+
+    grp_desp = agregar(cubo_despesa, ['desc_funcao'], medidas=['valor_realizado'], dropna=False)
+    grp_desp['funcao_sankey'] = colapsar_top_n(grp_desp['desc_funcao'], grp_desp['valor_realizado'], top_despesas, 'OUTRAS FUNÇÕES')
+    df_flow_out = grp_desp.groupby('funcao_sankey', observed=True)['valor_realizado'].sum().reset_index()
+    df_flow_out['source'] = "TESOURO MUNICIPAL"
+    df_flow_out['target'] = df_flow_out['funcao_sankey'].astype(object)
+    df_flow_out['color_link'] = "rgba(255, 0, 85, 0.3)"
+
+    colunas = ['source', 'target', 'valor_realizado', 'color_link']
+    fluxos = pd.concat([df_flow_in[colunas], df_flow_out[colunas]], ignore_index=True)
+    nos = list(pd.concat([fluxos['source'], fluxos['target']]).unique())
+    origens = set(df_flow_in['source'])
+    cores = ["#FFFFFF" if n == "TESOURO MUNICIPAL" else ("#00FF99" if n in origens else "#FF0055") for n in nos]
+    return fluxos, nos, cores
+
+@medido
+def sankey_cadeia_despesa(cubo, qtd_elementos):
+    """
+    Sankey Raiz -> Categoria -> Natureza -> Elemento com os `qtd_elementos` maiores elementos.
+    Ramos de despesas correntes em ciano e de capital em verde.
+    Retorna (nos, links, quantidade de elementos exibidos).
+    """
+    cols_fluxo = ['desc_categoria', 'desc_natureza', 'desc_elemento']
+    df_sankey_gen = agregar(cubo, cols_fluxo + ['eh_corrente'], medidas=['valor_realizado'], dropna=False)
+    top_elementos = df_sankey_gen.groupby('desc_elemento', observed=True)['valor_realizado'].sum().nlargest(qtd_elementos).index
+    df_filtered = df_sankey_gen[df_sankey_gen['desc_elemento'].isin(top_elementos)]
+    df_agg = df_filtered.groupby(cols_fluxo + ['eh_corrente'], observed=True)['valor_realizado'].sum().reset_index()
+
+    eh_corrente = df_agg['eh_corrente'].to_numpy()
+    cor_base = np.where(eh_corrente, "#00F3FF", "#00FF99")
+    nos, links = montar_sankey(
+        df_agg, cols_fluxo, raiz="DESPESAS TOTAIS",
+        cores_nos=[cor_base, cor_base, cor_base],
+        cores_links=['rgba(255,255,255,0.1)', np.where(eh_corrente, 'rgba(0, 243, 255, 0.2)', 'rgba(0, 255, 153, 0.2)'), 'rgba(50,50,50, 0.3)']
+    )
+    return nos, links, len(top_elementos)
+
+@medido
+def sankey_natureza_elemento(cubo, qtd_elementos):
+    """
+    Sankey Natureza -> Elemento com os `qtd_elementos` maiores elementos.
+    Retorna (nos, links, quantidade de elementos exibidos).
+    """
+    cols_sankey = ['desc_natureza', 'desc_elemento']
+    df_sk = agregar(cubo, cols_sankey, medidas=['valor_realizado'])
+    top_el = df_sk.groupby('desc_elemento', observed=True)['valor_realizado'].sum().nlargest(qtd_elementos).index
+    df_sk = df_sk[df_sk['desc_elemento'].isin(top_el)]
+    nos, links = montar_sankey(
+        df_sk, cols_sankey, chave_por_caminho=False,
+        cores_nos=["#00F3FF", "#00F3FF"], cores_links=[None, 'rgba(0, 243, 255, 0.2)']
+    )
+    return nos, links, len(top_el)
+
+@medido
+def sankey_receita(cubo_receita, qtd_tipos):
+    """
+    Sankey Raiz -> Origem -> Espécie -> Tipo com os `qtd_tipos` maiores tipos de receita.
+    Retorna (nos, links, quantidade de tipos exibidos).
+    """
+    top_tipos = ranking(cubo_receita, 'nome_tipo').head(qtd_tipos)['nome_tipo']
+    df_agg_sk = agregar(cubo_receita, COLUNAS_HIERARQUIA_RECEITA, medidas=['valor_realizado'], filtros={'nome_tipo': top_tipos.tolist()})
+    nos, links = montar_sankey(
+        df_agg_sk, COLUNAS_HIERARQUIA_RECEITA, raiz="RECEITA TOTAL", chave_por_caminho=False,
+        cores_nos=["#00FF99", "#00CC88", "#009977"],
+        cores_links=['rgba(255,255,255,0.1)', 'rgba(0, 255, 153, 0.2)', 'rgba(0, 204, 136, 0.2)']
+    )
+    return nos, links, len(top_tipos)
+
+# ==============================================================================
+# 8. TABELAS DETALHADAS PAGINADAS (ÍNDICE DE BUSCA E DE ORDENAÇÃO)
+# ==============================================================================
+# O índice é montado uma vez por recorte: as linhas ficam pré-ordenadas pelo valor e a
+# busca textual roda sobre o dicionário da coluna (textos distintos) via trigramas.
+# Cada consulta devolve só a página pedida, sem filtrar/ordenar o recorte inteiro.
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class IndiceTabela:
+    """
+    Índice de uma tabela detalhada para busca por trecho de texto em `coluna_texto`
+    (sem diferenciar maiúsculas), filtro de valor mínimo e paginação em ordem
+    decrescente de `coluna_valor`.
+    """
+
+    def __init__(self, df, coluna_texto, coluna_valor='valor_realizado', colunas=None):
+        df = df[list(colunas)] if colunas is not None else df
+        valores = df[coluna_valor].to_numpy(dtype='float64')
+        ordem = np.argsort(-valores, kind='stable')
+        self.linhas = df.iloc[ordem].reset_index(drop=True)
+        # Valores em ordem decrescente: o filtro de mínimo é um prefixo (busca binária)
+        self.valores_desc = valores[ordem]
+
+        textos = pd.Categorical(self.linhas[coluna_texto])
+        self.textos = [str(t).casefold() for t in textos.categories]
+        codigos = textos.codes
+        # Posições (já na ordem de valor) de cada texto distinto; nulos nunca casam
+        posicoes = np.argsort(codigos, kind='stable')
+        limites = np.searchsorted(codigos[posicoes], np.arange(len(self.textos) + 1))
+        self.posicoes_por_texto = [posicoes[a:b] for a, b in zip(limites[:-1], limites[1:])]
+
+        self.trigramas = {}
+        for i, texto in enumerate(self.textos):
+            for tri in _trigramas(texto):
+                self.trigramas.setdefault(tri, set()).add(i)
+
+    def __len__(self):
+        return len(self.linhas)
+
+    def textos_com(self, termo):
+        """
+        Índices dos textos distintos que contêm `termo` (literal, sem diferenciar maiúsculas).
+        Termos com 3+ caracteres são pré-filtrados pela interseção dos trigramas.
+        """
+        termo = termo.casefold()
+        candidatos = range(len(self.textos))
+        tris = _trigramas(termo)
+        if tris:
+            listas = sorted((self.trigramas.get(t, set()) for t in tris), key=len)
+            candidatos = set.intersection(*listas) if listas[0] else ()
+        return [i for i in candidatos if termo in self.textos[i]]
+
+    def consultar(self, termo=None, valor_minimo=None):
+        """
+        Posições (na ordem decrescente de valor) das linhas que passam pelos filtros.
+        """
+        corte = len(self.linhas)
+        if valor_minimo is not None:
+            corte = int(np.searchsorted(-self.valores_desc, -valor_minimo, side='right'))
+        if not termo:
+            return np.arange(corte)
+        partes = [self.posicoes_por_texto[i] for i in self.textos_com(termo)]
+        if not partes:
+            return np.arange(0)
+        posicoes = np.sort(np.concatenate(partes))
+        return posicoes[:np.searchsorted(posicoes, corte)]
+
+    def pagina(self, termo=None, valor_minimo=None, numero=1, tamanho=100):
+        """
+        Retorna (linhas da página `numero` (1-based), total de linhas filtradas,
+        maior valor entre as filtradas ou None).
+        """
+        posicoes = self.consultar(termo, valor_minimo)
+        inicio = (max(int(numero), 1) - 1) * tamanho
+        maior = float(self.valores_desc[posicoes[0]]) if len(posicoes) else None
+        return self.linhas.iloc[posicoes[inicio:inicio + tamanho]], len(posicoes), maior
@@ -0,0 +1,807 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrumentacao import medido
+
+try:
+    import pyarrow as pa
+    import pyarrow.acero as acero
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow é opcional: sem ele, o app segue pelo caminho CSV
+    pa = None
+
+# ==============================================================================
+# 1. CAMADA CURADA (PARQUET PARTICIONADO POR ANO E MÊS)
+# ==============================================================================
+
+COLUNA_PARTICAO = 'ano_exercicio'
+COLUNA_MES = 'mes'
+COLUNAS_PARTICAO = [COLUNA_PARTICAO, COLUNA_MES]
+COLUNAS_VALOR = ['valor_orcado', 'valor_empenhado', 'valor_liquidado', 'valor_realizado']
+
+# Modelo estrela: a tabela fato guarda só a chave int32 de cada dimensão (chave_<dim>),
+# as medidas e o ano/mês (partição); os atributos (códigos do portal e rótulos) ficam uma
+# vez só em cada tabela de dimensão, em pasta/_dimensoes/<dim>.parquet (o prefixo '_'
+# a mantém fora da descoberta de arquivos do dataset). Filtros, poda e agrupamentos rodam
+# sobre as chaves; os atributos pedidos são anexados na leitura por índice (join
+# preguiçoso), com os textos como `category`, sem hash de rótulos por linha.
+PASTA_DIMENSOES = '_dimensoes'
+PREFIXO_CHAVE = 'chave_'
+
+def pyarrow_disponivel():
+    return pa is not None
+
+def montar_estrela(df, modelo=None, anteriores=None):
+    """
+    Separa o DataFrame tratado em fato e dimensões. `modelo` = {dimensao: [atributos]};
+    cada dimensão recebe as combinações distintas dos seus atributos presentes (nulos
+    inclusive), numeradas em ordem, e a fato troca esses atributos por chave_<dimensao>.
+    Ano e mês de partição podem ser atributos (ex.: dimensão tempo) e continuam na fato.
+    Sem modelo, cada coluna `category` vira uma dimensão de um atributo.
+    Com as dimensões `anteriores` (refresh incremental), as combinações já conhecidas
+    mantêm a chave e as novas são numeradas depois delas: as partições não regravadas
+    continuam válidas. Retorna (fato, {dimensao: DataFrame com 'chave' + atributos}).
+    """
+    if modelo is None:
+        modelo = {col: [col] for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}
+
+    fato = df
+    dimensoes = {}
+    for dimensao, atributos in modelo.items():
+        atributos = [a for a in atributos if a in df.columns]
+        if not atributos:
+            continue
+        grupos = df.groupby(atributos, dropna=False, observed=True, sort=True)
+        tabela = grupos.size().reset_index()[atributos]
+        anterior = (anteriores or {}).get(dimensao)
+        if anterior is None:
+            chaves = np.arange(len(tabela), dtype='int32')
+            tabela.insert(0, 'chave', chaves)
+        else:
+            ligacao = tabela.merge(anterior[['chave'] + atributos], on=atributos, how='left')
+            novas = ligacao['chave'].isna().to_numpy()
+            chaves = ligacao['chave'].to_numpy(dtype='float64', na_value=np.nan)
+            proxima = int(anterior['chave'].max()) + 1 if len(anterior) else 0
+            chaves[novas] = np.arange(proxima, proxima + novas.sum())
+            chaves = chaves.astype('int32')
+            tabela.insert(0, 'chave', chaves)
+            tabela = pd.concat([anterior[['chave'] + atributos], tabela[novas]], ignore_index=True)
+        dimensoes[dimensao] = tabela
+        fato = fato.drop(columns=[a for a in atributos if a not in COLUNAS_PARTICAO])
+        fato[PREFIXO_CHAVE + dimensao] = chaves[grupos.ngroup().to_numpy()]
+    return fato, dimensoes
+
+def montar_tabela_curada(df):
+    """
+    Converte o DataFrame tratado em uma tabela Arrow tipada:
+    textos com dicionário (dictionary-encoded), valores em float64 e mês inteiro.
+    """
+    campos = []
+    arrays = []
+    for col in df.columns:
+        serie = df[col]
+        if col in COLUNAS_VALOR:
+            arr = pa.array(serie.astype('float64'), type=pa.float64())
+        elif col in COLUNAS_PARTICAO:
+            arr = pa.array(pd.to_numeric(serie, errors='coerce').fillna(0).astype('int64'), type=pa.int64())
+        elif pd.api.types.is_numeric_dtype(serie):
+            arr = pa.array(serie)
+        else:
+            arr = pa.array(serie.astype('string'), type=pa.string()).dictionary_encode()
+        campos.append(pa.field(col, arr.type))
+        arrays.append(arr)
+    return pa.Table.from_arrays(arrays, schema=pa.schema(campos))
+
+def codigo_particao(df):
+    """Partição (ano, mês) de cada linha como o inteiro AAAAMM (mês ausente = 0)."""
+    mes = pd.to_numeric(df[COLUNA_MES], errors='coerce').fillna(0).astype('int64')
+    return df[COLUNA_PARTICAO].astype('int64') * 100 + mes
+
+def nome_particao(codigo):
+    return f"{codigo // 100}-{codigo % 100:02d}"
+
+def codigo_do_nome(nome):
+    ano, mes = nome.split('-')
+    return int(ano) * 100 + int(mes)
+
+def checksums_particoes(df):
+    """
+    Impressão do conteúdo de cada partição (ano, mês) do DataFrame tratado:
+    {'AAAA-MM': {'sha256', 'linhas'}}. O hash é dos valores linha a linha (colunas
+    `category` pelo rótulo, não pelo código), então só muda se os dados mudarem.
+    """
+    linhas = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    assinatura = ';'.join(f"{col}:{df[col].dtype}" for col in df.columns).encode()
+    codigos = codigo_particao(df)
+    particoes = {}
+    for codigo, posicoes in sorted(codigos.groupby(codigos).indices.items()):
+        h = hashlib.sha256(assinatura)
+        h.update(linhas[posicoes].tobytes())
+        particoes[nome_particao(codigo)] = {'sha256': h.hexdigest(), 'linhas': len(posicoes)}
+    return particoes
+
+def particoes_alteradas(anteriores, atuais):
+    """Nomes das partições novas, removidas ou com conteúdo diferente entre dois manifestos."""
+    return sorted(
+        nome for nome in set(anteriores) | set(atuais)
+        if (anteriores.get(nome) or {}).get('sha256') != (atuais.get(nome) or {}).get('sha256')
+    )
+
+# Manifesto das partições gravadas (checksums e última alteração), na raiz do dataset.
+# O prefixo '_' o mantém fora da descoberta de arquivos, como as dimensões.
+ARQUIVO_PARTICOES = '_particoes.json'
+
+def ler_particoes(pasta):
+    """Partições da camada curada em `pasta` ({'AAAA-MM': {'sha256', 'linhas'}}), ou {}."""
+    return carregar_manifesto(os.path.join(pasta, ARQUIVO_PARTICOES)).get('particoes', {})
+
+def versao_particoes(particoes, anos=None):
+    """
+    Versão curta dos dados dos `anos` (todos se None): muda só quando alguma partição
+    desses anos muda, então pode compor a chave dos caches por seleção de anos.
+    """
+    h = hashlib.sha256()
+    for nome in sorted(particoes):
+        if anos is None or codigo_do_nome(nome) // 100 in anos:
+            h.update(f"{nome}={particoes[nome]['sha256']};".encode())
+    return h.hexdigest()[:16]
+
+def substituir_particoes(df, novas, alteradas):
+    """
+    Refresh incremental de um frame em memória (linhas ou cubo com ano e mês): troca as
+    linhas das partições `alteradas` ('AAAA-MM') pelas `novas` (vazias = partição removida).
+    Os dicionários das colunas `category` são unidos, sem recodificar as linhas mantidas.
+    """
+    codigos = [codigo_do_nome(nome) for nome in alteradas]
+    mantidas = df[~codigo_particao(df).isin(codigos)]
+    novas = novas[list(df.columns)]
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            nova = novas[col].astype('category')
+            categorias = df[col].cat.categories.union(nova.cat.categories, sort=False)
+            mantidas = mantidas.assign(**{col: mantidas[col].cat.set_categories(categorias)})
+            novas = novas.assign(**{col: nova.cat.set_categories(categorias)})
+    return pd.concat([mantidas, novas], ignore_index=True)
+
+def registro_cargas():
+    """
+    Registro das últimas cargas incrementais: {'trava', 'registros': {nome: (partições,
+    base, refs)}}. `refs` são referências fracas aos frames do resultado: o registro não
+    mantém cópia própria, e um resultado já liberado (despejado dos caches) não é reaproveitado.
+    """
+    return {'trava': threading.Lock(), 'registros': {}}
+
+def registrar_carga(cargas, nome, particoes, base, resultado):
+    """Registra `resultado` (tupla de frames, os mesmos guardados em cache) como a última carga `nome`."""
+    with cargas['trava']:
+        cargas['registros'][nome] = (particoes, base, tuple(weakref.ref(df) for df in resultado))
+
+def carga_incremental(cargas, nome, particoes, completa, parcial, base=None):
+    """
+    Resultado da carga `nome` para as `particoes` da camada curada. Se ela já foi
+    registrada com a mesma `base` (ex.: regras) e o resultado ainda está vivo
+    (ver `registrar_carga`), refaz só as partições (ano, mês) alteradas desde então,
+    `parcial(anterior, {tabela: alteradas})`; senão, `completa()`.
+    Assim o refresh diário do mês corrente custa um mês de dados, não o histórico.
+    """
+    with cargas['trava']:
+        registro = cargas['registros'].get(nome)
+    if registro is not None and registro[1] == base and all(registro[0].values()) and all(particoes.values()):
+        anterior = tuple(ref() for ref in registro[2])
+        if all(df is not None for df in anterior):
+            alteradas = {t: particoes_alteradas(registro[0][t], particoes[t]) for t in particoes}
+            return parcial(anterior, alteradas)
+    return completa()
+
+def _gravar_dimensoes(dimensoes, pasta_destino):
+    pasta_dimensoes = os.path.join(pasta_destino, PASTA_DIMENSOES)
+    os.makedirs(pasta_dimensoes, exist_ok=True)
+    for dimensao, tabela in dimensoes.items():
+        destino = os.path.join(pasta_dimensoes, f"{dimensao}.parquet")
+        pq.write_table(montar_tabela_curada(tabela), destino + '.tmp')
+        os.replace(destino + '.tmp', destino)
+
+def salvar_camada_curada(df, pasta_destino, modelo=None, compressao='zstd', incremental=False):
+    """
+    Grava o DataFrame no modelo estrela (ver `montar_estrela`): a fato como dataset
+    Parquet particionado por ano e mês (pasta_destino/ano_exercicio=AAAA/mes=M/...) e
+    as dimensões em pasta_destino/_dimensoes/. Por padrão a pasta anterior é substituída.
+
+    Com `incremental`, compara os checksums de cada partição com o manifesto da gravação
+    anterior e regrava só as partições novas ou alteradas (e apaga as que sumiram);
+    as dimensões só ganham linhas. Sem manifesto compatível, grava tudo.
+    Retorna os nomes ('AAAA-MM') das partições gravadas ou removidas.
+    """
+    if not pyarrow_disponivel():
+        raise ImportError("pyarrow não instalado: camada curada indisponível.")
+
+    particoes = checksums_particoes(df)
+    caminho_manifesto = os.path.join(pasta_destino, ARQUIVO_PARTICOES)
+    manifesto = carregar_manifesto(caminho_manifesto) if incremental else {}
+    reaproveita = manifesto.get('versao_esquema') == VERSAO_ESQUEMA and camada_curada_existe(pasta_destino)
+
+    if reaproveita:
+        alteradas = particoes_alteradas(manifesto.get('particoes', {}), particoes)
+        if not alteradas:
+            return []
+        codigos = [codigo_do_nome(nome) for nome in alteradas]
+        fato, dimensoes = montar_estrela(df[codigo_particao(df).isin(codigos)], modelo, carregar_dimensoes(pasta_destino))
+        # Dimensões antes da fato: só ganham linhas, então servem às partições antigas e às novas
+        _gravar_dimensoes(dimensoes, pasta_destino)
+        for codigo in codigos:
+            pasta_particao = os.path.join(pasta_destino, f"{COLUNA_PARTICAO}={codigo // 100}", f"{COLUNA_MES}={codigo % 100}")
+            if os.path.isdir(pasta_particao):
+                shutil.rmtree(pasta_particao)
+    else:
+        alteradas = sorted(particoes)
+        fato, dimensoes = montar_estrela(df, modelo)
+        if os.path.isdir(pasta_destino):
+            shutil.rmtree(pasta_destino)
+        _gravar_dimensoes(dimensoes, pasta_destino)
+
+    if len(fato):
+        pq.write_to_dataset(
+            montar_tabela_curada(fato), root_path=pasta_destino, partition_cols=COLUNAS_PARTICAO,
+            compression=compressao, use_dictionary=True
+        )
+    # O manifesto vai por último: se a gravação for interrompida, a próxima execução
+    # ainda vê as partições pendentes como alteradas
+    salvar_manifesto({
+        'versao_esquema': VERSAO_ESQUEMA,
+        'gravado_em': time.time(),
+        'particoes': particoes,
+        'alteradas': alteradas,
+    }, caminho_manifesto)
+    return alteradas
+
+def camada_curada_existe(pasta):
+    return pyarrow_disponivel() and os.path.isdir(pasta) and any(
+        nome.startswith(f"{COLUNA_PARTICAO}=") for nome in os.listdir(pasta)
+    )
+
+def abrir_camada_curada(pasta):
+    """
+    Abre o dataset curado sem ler dados (só esquema e lista de arquivos).
+    Retorna None se o dataset não existir.
+    """
+    if not camada_curada_existe(pasta):
+        return None
+    particionamento = ds.partitioning(pa.schema([(c, pa.int64()) for c in COLUNAS_PARTICAO]), flavor='hive')
+    return ds.dataset(pasta, format='parquet', partitioning=particionamento)
+
+def carregar_dimensoes(pasta):
+    """
+    Tabelas de dimensão do dataset: {dimensao: DataFrame indexado pela chave}, com os
+    textos como `category` e os códigos inteiros com nulos como Int32.
+    Vazio para datasets gravados antes do modelo estrela (textos na própria fato).
+    """
+    pasta_dimensoes = os.path.join(pasta, PASTA_DIMENSOES)
+    if not os.path.isdir(pasta_dimensoes):
+        return {}
+    dimensoes = {}
+    for nome in sorted(os.listdir(pasta_dimensoes)):
+        if nome.endswith('.parquet'):
+            tabela = pq.read_table(os.path.join(pasta_dimensoes, nome))
+            df = tabela.unify_dictionaries().to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get)
+            dimensoes[nome[:-len('.parquet')]] = df.sort_values('chave').reset_index(drop=True)
+    return dimensoes
+
+def _origem_atributos(nomes_fato, dimensoes):
+    """Dimensão de cada atributo que não está na própria fato: {atributo: dimensao}."""
+    return {
+        atributo: dimensao
+        for dimensao, tabela in dimensoes.items()
+        for atributo in tabela.columns
+        if atributo != 'chave' and atributo not in nomes_fato
+    }
+
+def traduzir_filtros(filtros, dimensoes, nomes_fato):
+    """
+    Troca os filtros sobre atributos de dimensão por filtros sobre chave_<dim> na fato
+    (as chaves das linhas da dimensão que casam; vários filtros na mesma dimensão se
+    intersectam). Rótulos ausentes não casam com nenhuma linha; None seleciona os nulos.
+    """
+    origem = _origem_atributos(nomes_fato, dimensoes)
+    traduzidos = {}
+    chaves_por_dimensao = {}
+    for coluna, valor in (filtros or {}).items():
+        if coluna not in origem:
+            traduzidos[coluna] = valor
+            continue
+        tabela = dimensoes[origem[coluna]]
+        valores = list(valor) if isinstance(valor, (list, tuple, set)) else [valor]
+        presentes = [v for v in valores if v is not None]
+        mascara = tabela[coluna].isin(presentes)
+        if len(presentes) < len(valores):
+            mascara = mascara | tabela[coluna].isna()
+        chaves = set(tabela['chave'][mascara].tolist())
+        anteriores = chaves_por_dimensao.get(origem[coluna])
+        chaves_por_dimensao[origem[coluna]] = chaves if anteriores is None else anteriores & chaves
+    for dimensao, chaves in chaves_por_dimensao.items():
+        traduzidos[PREFIXO_CHAVE + dimensao] = sorted(chaves)
+    return traduzidos
+
+def anexar_atributos(df, atributos, dimensoes, origem):
+    """
+    Join preguiçoso: acrescenta a `df` (que tem as colunas chave_<dim>) só os `atributos`
+    pedidos, por indexação das dimensões pela chave (os textos continuam `category`).
+    """
+    for atributo in atributos:
+        dimensao = origem[atributo]
+        chaves = df[PREFIXO_CHAVE + dimensao].to_numpy()
+        df[atributo] = dimensoes[dimensao][atributo].array.take(chaves)
+    return df
+
+def expressao_filtro(anos=None, filtros=None):
+    """
+    Monta a expressão Arrow dos `anos` e dos filtros {coluna: valor ou lista de valores}
+    (mesma convenção de `analise.filtrar_cubo`). Um None na lista seleciona os nulos.
+    Retorna None se não houver filtro.
+    """
+    condicoes = []
+    if anos:
+        condicoes.append(ds.field(COLUNA_PARTICAO).isin(list(anos)))
+    for coluna, valor in (filtros or {}).items():
+        valores = list(valor) if isinstance(valor, (list, tuple, set)) else [valor]
+        presentes = [v for v in valores if v is not None]
+        condicao = ds.field(coluna).isin(presentes)
+        if len(presentes) < len(valores):
+            condicao = condicao | ds.field(coluna).is_null()
+        condicoes.append(condicao)
+    if not condicoes:
+        return None
+    expressao = condicoes[0]
+    for condicao in condicoes[1:]:
+        expressao = expressao & condicao
+    return expressao
+
+
+@medido
+def ler_camada_curada(pasta, anos=None, colunas=None, filtros=None):
+    """
+    Lê o dataset curado aplicando poda de partições (somente os `anos` pedidos),
+    projeção de colunas e os `filtros` (ver `expressao_filtro`), avaliados durante a
+    leitura: só as linhas selecionadas são materializadas. Colunas e filtros podem ser
+    atributos das dimensões (ver `anexar_atributos`). Retorna None se o dataset não existir.
+    """
+    dataset = abrir_camada_curada(pasta)
+    if dataset is None:
+        return None
+
+    nomes = dataset.schema.names
+    dimensoes = carregar_dimensoes(pasta)
+    origem = _origem_atributos(nomes, dimensoes)
+    if colunas is None:
+        colunas = [c for c in nomes if not c.startswith(PREFIXO_CHAVE)] + list(origem)
+    colunas = [c for c in colunas if c in nomes or c in origem]
+    do_estrela = [c for c in colunas if c not in nomes]
+    colunas_fato = [c for c in colunas if c in nomes] + sorted({PREFIXO_CHAVE + origem[c] for c in do_estrela})
+
+    filtro = expressao_filtro(anos, traduzir_filtros(filtros, dimensoes, nomes))
+    tabela = dataset.to_table(columns=colunas_fato, filter=filtro)
+
+    # Colunas com dicionário viram `category` no pandas, com um dicionário único para
+    # todas as partições (anos) lidas
+    df = tabela.unify_dictionaries().to_pandas()
+    return anexar_atributos(df, do_estrela, dimensoes, origem)[colunas]
+
+# ==============================================================================
+# 2. MANIFESTO DE ENTRADAS (ETL INCREMENTAL)
+# ==============================================================================
+
+# Incrementar sempre que a leitura/tratamento dos arquivos de origem mudar:
+# um manifesto com versão diferente força o reprocessamento de todos os anos.
+# 5: o unificado do modo padrão passou a ter as colunas padronizadas, como o do streaming.
+VERSAO_ESQUEMA = 5
+
+def hash_arquivo(caminho, tamanho_bloco=1 << 20):
+    """
+    Calcula o SHA-256 do conteúdo do arquivo lendo em blocos (memória constante).
+    """
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+def impressao_digital(caminho):
+    """
+    Registro de manifesto de um arquivo de origem: caminho, tamanho, mtime,
+    hash do conteúdo e versão do esquema de tratamento.
+    """
+    info = os.stat(caminho)
+    return {
+        'caminho': os.path.abspath(caminho),
+        'tamanho': info.st_size,
+        'mtime': info.st_mtime,
+        'sha256': hash_arquivo(caminho),
+        'versao_esquema': VERSAO_ESQUEMA,
+    }
+
+def carregar_manifesto(caminho):
+    """
+    Lê o manifesto JSON ({nome_arquivo: registro}). Retorna {} se não existir ou estiver corrompido.
+    """
+    if not os.path.exists(caminho):
+        return {}
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def salvar_manifesto(manifesto, caminho):
+    """
+    Grava o manifesto de forma atômica (arquivo temporário + os.replace).
+    """
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temporario, caminho)
+
+def arquivo_alterado(registro, caminho):
+    """
+    Indica se o arquivo precisa ser reprocessado em relação ao registro do manifesto.
+    Tamanho e mtime iguais dispensam o hash; se diferirem, o hash decide
+    (um `touch` sem mudança de conteúdo não dispara reprocessamento).
+    """
+    if not registro or registro.get('versao_esquema') != VERSAO_ESQUEMA:
+        return True
+    info = os.stat(caminho)
+    if info.st_size == registro.get('tamanho') and info.st_mtime == registro.get('mtime'):
+        return False
+    return hash_arquivo(caminho) != registro.get('sha256')
+
+# Manifesto de versão dos dados publicado pelo ETL (base/versao_dados.json): impressão
+# digital de cada arquivo entregue ao app e as partições da camada curada. O app usa a
+# `versao` como chave de todos os caches; como o manifesto é gravado por último e de
+# forma atômica, uma versão nova só aparece depois de todas as saídas do ETL gravadas.
+ARQUIVO_VERSAO_DADOS = 'versao_dados.json'
+
+def publicar_versao_dados(base_path, arquivos, pastas_curadas):
+    """
+    Grava o manifesto de versão dos dados em `base_path` e retorna a versão.
+    `arquivos`: saídas do ETL lidas pelo app (os ausentes são ignorados);
+    `pastas_curadas`: {tabela: pasta da camada curada}. A versão é o hash do conteúdo
+    (sha256 dos arquivos e checksums das partições), não dos mtimes: um ETL que não
+    mudou nada republica a mesma versão e os caches do app continuam válidos.
+    """
+    registros = {}
+    for arquivo in arquivos:
+        if os.path.exists(arquivo):
+            nome = os.path.relpath(arquivo, base_path).replace(os.sep, '/')
+            registros[nome] = {'tamanho': os.path.getsize(arquivo), 'sha256': hash_arquivo(arquivo)}
+    particoes = {tabela: ler_particoes(pasta) for tabela, pasta in pastas_curadas.items()}
+    conteudo = json.dumps([VERSAO_ESQUEMA, registros, particoes], sort_keys=True)
+    versao = hashlib.sha256(conteudo.encode('utf-8')).hexdigest()[:16]
+    salvar_manifesto({
+        'versao': versao,
+        'gerado_em': time.time(),
+        'versao_esquema': VERSAO_ESQUEMA,
+        'arquivos': registros,
+        'particoes': particoes,
+    }, os.path.join(base_path, ARQUIVO_VERSAO_DADOS))
+    return versao
+
+# ==============================================================================
+# 3. CACHE PERSISTENTE DA CARGA DO APP (ARROW IPC MAPEADO EM MEMÓRIA)
+# ==============================================================================
+# Os DataFrames já lidos e normalizados pelo app são gravados em Arrow IPC sem
+# compressão: a reabertura é um `mmap` do arquivo (sem parse), e réplicas no mesmo
+# host compartilham as mesmas páginas do cache de disco do sistema operacional.
+
+def chave_cache(fontes, *extras):
+    """
+    Chave do cache: hash do (caminho, tamanho, mtime) de cada arquivo de origem existente
+    (diretórios são percorridos), da VERSAO_ESQUEMA e de parâmetros extras da carga.
+    Qualquer alteração nas origens gera uma chave nova.
+    """
+    registros = []
+    for fonte in fontes:
+        if os.path.isdir(fonte):
+            arquivos = sorted(
+                os.path.join(raiz, nome) for raiz, _, nomes in os.walk(fonte) for nome in nomes
+            )
+        elif os.path.exists(fonte):
+            arquivos = [fonte]
+        else:
+            arquivos = []
+        for arquivo in arquivos:
+            info = os.stat(arquivo)
+            registros.append([os.path.abspath(arquivo), info.st_size, info.st_mtime_ns])
+    conteudo = json.dumps([VERSAO_ESQUEMA, registros, [repr(e) for e in extras]])
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()[:16]
+
+def salvar_cache_arrow(frames, pasta, chave):
+    """
+    Grava {nome: DataFrame} em pasta/<chave>/<nome>.arrow (Arrow IPC, sem compressão).
+    A pasta da chave é montada num temporário e publicada com os.replace; versões
+    anteriores do cache são removidas. O cache é só uma otimização: falhas de escrita
+    (disco somente leitura, colunas sem tipo Arrow) retornam False sem interromper a carga.
+    """
+    if not pyarrow_disponivel():
+        return False
+    temporario = os.path.join(pasta, f"{chave}.tmp{os.getpid()}")
+    try:
+        os.makedirs(pasta, exist_ok=True)
+        if os.path.isdir(temporario):
+            shutil.rmtree(temporario)
+        os.makedirs(temporario)
+        for nome, df in frames.items():
+            tabela = pa.Table.from_pandas(df, preserve_index=False)
+            with pa.OSFile(os.path.join(temporario, nome + '.arrow'), 'wb') as destino:
+                with pa.ipc.new_file(destino, tabela.schema) as escritor:
+                    escritor.write_table(tabela)
+    except (OSError, pa.ArrowException):
+        shutil.rmtree(temporario, ignore_errors=True)
+        return False
+
+    try:
+        os.replace(temporario, os.path.join(pasta, chave))
+    except OSError:
+        # Outra réplica publicou a mesma chave primeiro: o conteúdo é equivalente
+        shutil.rmtree(temporario, ignore_errors=True)
+    for nome in os.listdir(pasta):
+        caminho = os.path.join(pasta, nome)
+        if nome != chave and '.tmp' not in nome and os.path.isdir(caminho):
+            shutil.rmtree(caminho, ignore_errors=True)
+    return True
+
+def ler_cache_arrow(pasta, chave, nomes):
+    """
+    Abre pasta/<chave>/<nome>.arrow via memory map e retorna {nome: DataFrame}.
+    Colunas numéricas sem nulos apontam direto para o arquivo mapeado (somente leitura).
+    Retorna None se o cache não existir ou estiver incompleto/corrompido.
+    """
+    if not pyarrow_disponivel():
+        return None
+    pasta_chave = os.path.join(pasta, chave)
+    frames = {}
+    try:
+        for nome in nomes:
+            caminho = os.path.join(pasta_chave, nome + '.arrow')
+            if not os.path.exists(caminho):
+                return None
+            with pa.memory_map(caminho, 'r') as origem:
+                tabela = pa.ipc.open_file(origem).read_all()
+            frames[nome] = tabela.to_pandas(split_blocks=True)
+    except (OSError, pa.ArrowException):
+        return None
+    return frames
+
+# ==============================================================================
+# 4. PLANO DE DADOS COMPARTILHADO ENTRE RÉPLICAS
+# ==============================================================================
+# Com várias réplicas do app no mesmo host, apontar a pasta do cache para memória
+# compartilhada (ex.: /dev/shm) faz do arquivo Arrow publicado o plano de dados comum:
+# um único processo carrega e publica, os demais só anexam o arquivo mapeado.
+
+def _trava_expirada(trava, validade):
+    try:
+        return time.time() - os.path.getmtime(trava) > validade
+    except OSError:
+        return False
+
+def _quebrar_trava_expirada(trava, validade, token):
+    """
+    Descarta a trava expirada renomeando-a para um nome próprio (só um dos processos
+    que aguardam consegue). Se, entre a checagem e o rename, outro já tinha descartado
+    a antiga e criado a sua, a trava tomada está fresca e é devolvida.
+    """
+    if not _trava_expirada(trava, validade):
+        return
+    privado = f"{trava}.{token}.expirada"
+    try:
+        os.rename(trava, privado)
+    except FileNotFoundError:
+        return
+    if not _trava_expirada(privado, validade):
+        # Se um terceiro já criou outra nesse intervalo, dois carregam a mesma chave;
+        # a publicação é atômica, então o custo é só trabalho repetido
+        with contextlib.suppress(FileExistsError):
+            os.link(privado, trava)
+    os.remove(privado)
+
+def _liberar_trava(trava, token):
+    """
+    Remove a trava só se ainda for deste processo (pode ter sido descartada por expirar).
+    """
+    with contextlib.suppress(FileNotFoundError):
+        with open(trava, encoding='utf-8') as f:
+            if f.read() != token:
+                return
+        os.remove(trava)
+
+def anexar_ou_publicar(pasta, chave, nomes, carregar, espera_max=300, intervalo=0.5):
+    """
+    Retorna {nome: DataFrame} anexado (memory map) a pasta/<chave>. Se a chave ainda não
+    foi publicada, só o processo que obtiver a trava pasta/<chave>.lock executa
+    `carregar()` e publica; os demais aguardam a publicação (até `espera_max` segundos)
+    e anexam ao mesmo arquivo. Travas mais antigas que `espera_max` (carregador que
+    morreu) são descartadas. Sem pyarrow ou sem escrita na pasta, carrega localmente.
+    """
+    frames = ler_cache_arrow(pasta, chave, nomes)
+    if frames is not None:
+        return frames
+
+    # A trava guarda um token (pid + nonce) que identifica o dono
+    trava = os.path.join(pasta, chave + '.lock')
+    token = f"{os.getpid()}-{uuid.uuid4().hex}"
+    try:
+        os.makedirs(pasta, exist_ok=True)
+        _quebrar_trava_expirada(trava, espera_max, token)
+        descritor = os.open(trava, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        try:
+            os.write(descritor, token.encode('utf-8'))
+        finally:
+            os.close(descritor)
+        dono = True
+    except FileExistsError:
+        dono = False
+    except OSError:
+        return carregar()
+
+    if not dono:
+        # Outra réplica está carregando: aguarda a publicação
+        limite = time.monotonic() + espera_max
+        while time.monotonic() < limite and os.path.exists(trava):
+            time.sleep(intervalo)
+        frames = ler_cache_arrow(pasta, chave, nomes)
+        return frames if frames is not None else carregar()
+
+    try:
+        frames = carregar()
+        if salvar_cache_arrow(frames, pasta, chave):
+            # O carregador também passa a usar a cópia mapeada (e libera a sua)
+            frames = ler_cache_arrow(pasta, chave, nomes) or frames
+        return frames
+    finally:
+        _liberar_trava(trava, token)
+
+# ==============================================================================
+# 5. CONSULTAS AGREGADAS SOBRE A CAMADA CURADA (MOTOR COLUNAR)
+# ==============================================================================
+# Alternativa à carga integral em pandas: o motor de execução do Arrow (Acero) lê o
+# Parquet em lotes, com poda de partições e projeção de colunas, e mantém em memória
+# só a tabela de grupos. Apenas o resultado agregado vira DataFrame.
+
+@medido
+def agregar_camada_curada(pasta, dimensoes, medidas, anos=None, filtros=None):
+    """
+    SELECT dimensoes, SUM(medidas) ... WHERE anos/filtros GROUP BY dimensoes, executado
+    em streaming sobre o dataset. Dimensões/medidas ausentes do dataset são ignoradas;
+    chaves nulas formam grupo próprio e somas sem valores dão 0, como em `analise.construir_cubo`.
+    No modelo estrela, o Acero agrupa pelas chave_<dim> e os atributos são anexados ao
+    resultado, que é reagrupado (várias chaves podem ter o mesmo rótulo).
+    Retorna None se o dataset não existir.
+    """
+    dataset = abrir_camada_curada(pasta)
+    if dataset is None:
+        return None
+
+    nomes = dataset.schema.names
+    tabelas_dim = carregar_dimensoes(pasta)
+    origem = _origem_atributos(nomes, tabelas_dim)
+    dims = [d for d in dimensoes if d in nomes or d in origem]
+    meds = [m for m in medidas if m in nomes]
+    do_estrela = [d for d in dims if d not in nomes]
+    chaves = [d for d in dims if d in nomes] + sorted({PREFIXO_CHAVE + origem[d] for d in do_estrela})
+    filtro = expressao_filtro(anos, traduzir_filtros(filtros, tabelas_dim, nomes))
+
+    etapas = [acero.Declaration('scan', acero.ScanNodeOptions(dataset, columns=chaves + meds, filter=filtro))]
+    if filtro is not None:
+        # O scan usa o filtro só para podar arquivos/row groups; o descarte das linhas é aqui
+        etapas.append(acero.Declaration('filter', acero.FilterNodeOptions(filtro)))
+    etapas.append(acero.Declaration('aggregate', acero.AggregateNodeOptions(
+        [(m, 'hash_sum', pc.ScalarAggregateOptions(min_count=0), m) for m in meds], keys=chaves
+    )))
+    df = acero.Declaration.from_sequence(etapas).to_table().unify_dictionaries().to_pandas()
+    if not do_estrela:
+        return df[dims + meds]
+    df = anexar_atributos(df, do_estrela, tabelas_dim, origem)
+    return df.groupby(dims, dropna=False, observed=True, sort=False)[meds].sum().reset_index()
+
+
+# ==============================================================================
+# 6. CACHE LRU EM MEMÓRIA (LIMITADO POR TAMANHO)
+# ==============================================================================
+# Guarda objetos caros de montar (ex.: figuras) por chave, com orçamento de bytes:
+# ao estourar, descarta os menos usados recentemente. Compartilhado entre sessões,
+# por isso protegido por trava.
+
+class CacheLRU:
+    """
+    Cache chave -> valor com despejo LRU quando a soma dos tamanhos passa de `max_bytes`.
+    `tamanho(valor)` estima o custo em bytes de cada entrada (padrão: 1 por entrada).
+    """
+
+    def __init__(self, max_bytes, tamanho=None):
+        self.max_bytes = max_bytes
+        self.tamanho = tamanho or (lambda valor: 1)
+        self.entradas = OrderedDict()
+        self.bytes_usados = 0
+        self.acertos = 0
+        self.falhas = 0
+        self._trava = threading.Lock()
+
+    def __len__(self):
+        return len(self.entradas)
+
+    def obter(self, chave, construir):
+        with self._trava:
+            if chave in self.entradas:
+                self.entradas.move_to_end(chave)
+                self.acertos += 1
+                return self.entradas[chave][0]
+            self.falhas += 1
+
+        # Montagem fora da trava: outras sessões não esperam por esta
+        valor = construir()
+        custo = self.tamanho(valor)
+        if custo > self.max_bytes:
+            return valor
+
+        with self._trava:
+            if chave in self.entradas:
+                self.bytes_usados -= self.entradas.pop(chave)[1]
+            self.entradas[chave] = (valor, custo)
+            self.bytes_usados += custo
+            while self.bytes_usados > self.max_bytes:
+                _, (_, custo_antigo) = self.entradas.popitem(last=False)
+                self.bytes_usados -= custo_antigo
+        return valor
+
+    def invalidar(self, predicado=None):
+        """Remove as entradas cuja chave satisfaz `predicado` (todas, se None)."""
+        with self._trava:
+            for chave in [c for c in self.entradas if predicado is None or predicado(c)]:
+                self.bytes_usados -= self.entradas.pop(chave)[1]
+
+_impressoes_frames = {}
+
+def _impressao_frame(df):
+    """
+    Hash do conteúdo de um DataFrame/Series. Memoizado por identidade do objeto, que
+    nos frames vindos de cache é estável entre reruns; o weakref limpa o registro
+    quando o objeto é coletado. Assume que frames já impressos não são alterados.
+    """
+    registro = _impressoes_frames.get(id(df))
+    if registro is not None and registro[0]() is df:
+        return registro[1]
+
+    colunas = list(df.columns) if isinstance(df, pd.DataFrame) else [df.name]
+    tipos = [str(t) for t in df.dtypes] if isinstance(df, pd.DataFrame) else [str(df.dtype)]
+    h = hashlib.sha256(repr((type(df).__name__, df.shape, colunas, tipos)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest = h.hexdigest()
+
+    chave = id(df)
+    _impressoes_frames[chave] = (weakref.ref(df, lambda _, k=chave: _impressoes_frames.pop(k, None)), digest)
+    return digest
+
+def impressao_entradas(*entradas):
+    """
+    Impressão digital das entradas de um gráfico: DataFrames/Series pelo conteúdo,
+    demais valores (números, textos, tuplas de filtros) pelo repr.
+    """
+    h = hashlib.sha256()
+    for entrada in entradas:
+        if isinstance(entrada, (pd.DataFrame, pd.Series)):
+            h.update(_impressao_frame(entrada).encode('ascii'))
+        else:
+            h.update(repr(entrada).encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()
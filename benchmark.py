@@ -0,0 +1,323 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import ETL
+from tratamento import ingerir_arquivos
+from instrumentacao import memoria_residente
+from analise import (
+    construir_cubo_despesa, construir_cubo_receita, preparar_visoes_ano, formatar_rotulos_valor,
+    kpis_balanco, kpis_receita, funil_execucao, ranking, mapa_calor_mensal,
+    fluxo_integrado, sankey_cadeia_despesa, sankey_receita
+)
+
+# ==============================================================================
+# 1. GERADOR DE DADOS SINTÉTICOS (MESMO ESQUEMA DO PORTAL)
+# ==============================================================================
+# Os arquivos seguem as colunas e os formatos dos originais: despesas com ';' e
+# ponto decimal, receitas com ';' e valores no padrão brasileiro ('1.234,56').
+
+COLUNAS_DESPESA_PORTAL = [
+    'data_extracao', 'orgao', 'nome_orgao', 'exercicio', 'mes', 'categoria', 'desc_categoria',
+    'natureza', 'desc_natureza', 'modalidade', 'desc_modalidade', 'elemento', 'desc_elemento',
+    'funcao', 'desc_funcao', 'vlemp', 'vlliq', 'vlpag', 'vlorcini'
+]
+COLUNAS_RECEITA_PORTAL = ['ano', 'mes', 'nome_origem', 'nome_especie', 'nome_tipo', 'valor_arrecadado', 'valor_orcado']
+
+ANOS_SINTETICOS = [2019, 2020, 2021, 2022, 2023]
+
+# Hierarquia econômica: categoria -> grupos de natureza (código, descrição)
+NATUREZAS = {
+    (3, 'DESPESAS CORRENTES'): [
+        (31, 'PESSOAL E ENCARGOS SOCIAIS'), (32, 'JUROS E ENCARGOS DA DÍVIDA'), (33, 'OUTRAS DESPESAS CORRENTES')
+    ],
+    (4, 'DESPESAS DE CAPITAL'): [
+        (44, 'INVESTIMENTOS'), (45, 'INVERSÕES FINANCEIRAS'), (46, 'AMORTIZAÇÃO DA DÍVIDA')
+    ],
+}
+MODALIDADES = [(3190, 'APLICAÇÕES DIRETAS'), (3191, 'APLICAÇÃO DIRETA - OPERAÇÕES INTRAORÇAMENTÁRIAS'), (3150, 'TRANSFERÊNCIAS A INSTITUIÇÕES PRIVADAS')]
+FUNCOES = [
+    'ADMINISTRAÇÃO', 'SAÚDE', 'EDUCAÇÃO', 'PREVIDÊNCIA SOCIAL', 'URBANISMO', 'ASSISTÊNCIA SOCIAL',
+    'SEGURANÇA PÚBLICA', 'TRANSPORTE', 'SANEAMENTO', 'CULTURA', 'GESTÃO AMBIENTAL', 'ENCARGOS ESPECIAIS',
+    'DESPORTO E LAZER', 'HABITAÇÃO', 'DIREITOS DA CIDADANIA', 'TRABALHO', 'COMÉRCIO E SERVIÇOS', 'LEGISLATIVA'
+]
+ORIGENS_RECEITA = [
+    'RECEITA TRIBUTÁRIA', 'RECEITA PATRIMONIAL', 'RECEITA DE SERVIÇOS', 'TRANSFERÊNCIAS CORRENTES',
+    'OUTRAS RECEITAS CORRENTES', 'OPERAÇÕES DE CRÉDITO', 'ALIENAÇÃO DE BENS', 'TRANSFERÊNCIAS DE CAPITAL'
+]
+
+def _dimensoes_despesa(rng, qtd_orgaos=40, elementos_por_natureza=25):
+    """
+    Tabelas de códigos/descrições usadas no sorteio das linhas.
+    """
+    orgaos = pd.DataFrame({
+        'orgao': np.arange(1, qtd_orgaos + 1),
+        'nome_orgao': [f"SECRETARIA MUNICIPAL {i:03d}" for i in range(1, qtd_orgaos + 1)],
+    })
+    linhas = []
+    for (cod_cat, desc_cat), naturezas in NATUREZAS.items():
+        for cod_nat, desc_nat in naturezas:
+            for j in range(elementos_por_natureza):
+                linhas.append((cod_cat, desc_cat, cod_nat, desc_nat, cod_nat * 10000 + 9000 + j, f"ELEMENTO {cod_nat}.{j:02d} - {desc_nat}"))
+    elementos = pd.DataFrame(linhas, columns=['categoria', 'desc_categoria', 'natureza', 'desc_natureza', 'elemento', 'desc_elemento'])
+    modalidades = pd.DataFrame(MODALIDADES, columns=['modalidade', 'desc_modalidade'])
+    funcoes = pd.DataFrame({'funcao': np.arange(1, len(FUNCOES) + 1), 'desc_funcao': FUNCOES})
+    return orgaos, elementos, modalidades, funcoes
+
+def _bloco_despesa(rng, n, ano, dims):
+    """
+    Sorteia `n` linhas de despesa do exercício `ano` (valores com cauda longa, como nos dados reais).
+    """
+    orgaos, elementos, modalidades, funcoes = dims
+    partes = [
+        orgaos.iloc[rng.integers(0, len(orgaos), n)].reset_index(drop=True),
+        elementos.iloc[rng.integers(0, len(elementos), n)].reset_index(drop=True),
+        modalidades.iloc[rng.integers(0, len(modalidades), n)].reset_index(drop=True),
+        funcoes.iloc[rng.integers(0, len(funcoes), n)].reset_index(drop=True),
+    ]
+    df = pd.concat(partes, axis=1)
+    vlemp = np.round(rng.lognormal(mean=9, sigma=2.2, size=n), 2)
+    vlliq = np.round(vlemp * rng.uniform(0.7, 1.0, n), 2)
+    vlpag = np.round(vlliq * rng.uniform(0.8, 1.0, n), 2)
+    vlorcini = np.where(rng.random(n) < 0.2, np.round(vlemp * rng.uniform(1.0, 12.0, n), 2), 0.0)
+
+    df['data_extracao'] = '2025-11-15 01:11:44'
+    df['exercicio'] = ano
+    df['mes'] = rng.integers(1, 13, n)
+    df['vlemp'], df['vlliq'], df['vlpag'], df['vlorcini'] = vlemp, vlliq, vlpag, vlorcini
+    return df[COLUNAS_DESPESA_PORTAL]
+
+def _moeda_br(valores):
+    """
+    Formata floats não negativos como '1.234.567,89' com operações de string vetorizadas.
+    """
+    centavos = np.round(np.asarray(valores) * 100).astype('int64')
+    inteiros = pd.Series(centavos // 100).astype(str).str.replace(r'(\d)(?=(\d{3})+$)', r'\1.', regex=True)
+    return inteiros + ',' + pd.Series(centavos % 100).astype(str).str.zfill(2)
+
+def gerar_dados_sinteticos(pasta, linhas, semente=42, tamanho_bloco=1_000_000):
+    """
+    Gera `pasta/despesas/despesas_AAAA.csv` (total de `linhas`, divididas entre os anos) e
+    `pasta/receitas/receita.csv` (1 linha de receita para cada 20 de despesa).
+    Grava em blocos de `tamanho_bloco` linhas para suportar volumes de 10M+ sem estourar memória.
+    """
+    rng = np.random.default_rng(semente)
+    dims = _dimensoes_despesa(rng)
+    pasta_despesas = os.path.join(pasta, 'despesas')
+    pasta_receitas = os.path.join(pasta, 'receitas')
+    os.makedirs(pasta_despesas, exist_ok=True)
+    os.makedirs(pasta_receitas, exist_ok=True)
+
+    por_ano = np.full(len(ANOS_SINTETICOS), linhas // len(ANOS_SINTETICOS))
+    por_ano[:linhas % len(ANOS_SINTETICOS)] += 1
+    for ano, total in zip(ANOS_SINTETICOS, por_ano):
+        caminho = os.path.join(pasta_despesas, f"despesas_{ano}.csv")
+        with open(caminho, 'w', encoding='utf-8', newline='') as f:
+            for inicio in range(0, total, tamanho_bloco):
+                bloco = _bloco_despesa(rng, min(tamanho_bloco, total - inicio), ano, dims)
+                bloco.to_csv(f, sep=';', index=False, header=inicio == 0, float_format='%.2f')
+
+    n_rec = max(100, linhas // 20)
+    origem = rng.integers(0, len(ORIGENS_RECEITA), n_rec)
+    especie = rng.integers(0, 6, n_rec)
+    arrecadado = rng.lognormal(mean=13, sigma=2.0, size=n_rec)
+    nomes_origem = np.array(ORIGENS_RECEITA, dtype=object)[origem]
+    df_rec = pd.DataFrame({
+        'ano': rng.choice(ANOS_SINTETICOS, n_rec),
+        'mes': rng.integers(1, 13, n_rec),
+        'nome_origem': nomes_origem,
+        'nome_especie': [f"{o[:14]} ESP {e}" for o, e in zip(nomes_origem, especie)],
+        'nome_tipo': [f"TIPO {o[:8]} {e}-{t}" for o, e, t in zip(nomes_origem, especie, rng.integers(0, 15, n_rec))],
+        'valor_arrecadado': _moeda_br(arrecadado),
+        'valor_orcado': _moeda_br(arrecadado * rng.uniform(0.9, 1.2, n_rec)),
+    })
+    df_rec[COLUNAS_RECEITA_PORTAL].to_csv(os.path.join(pasta_receitas, 'receita.csv'), sep=';', index=False)
+    return pasta_despesas, pasta_receitas
+
+# ==============================================================================
+# 2. MEDIÇÃO (TEMPO DE PAREDE E PICO DE MEMÓRIA)
+# ==============================================================================
+
+class AmostradorMemoria(threading.Thread):
+    """
+    Thread que amostra a RSS a cada `intervalo` segundos e guarda o pico observado.
+    Diferente do tracemalloc, não instrumenta as alocações (o tempo medido não é afetado)
+    e enxerga também a memória do Arrow e dos buffers nativos.
+    """
+    def __init__(self, intervalo=0.005):
+        super().__init__(daemon=True)
+        self.intervalo = intervalo
+        self.inicial = memoria_residente()
+        self.pico = self.inicial
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.is_set():
+            atual = memoria_residente()
+            if atual is not None and atual > self.pico:
+                self.pico = atual
+            self._parar.wait(self.intervalo)
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+        return None if self.inicial is None else self.pico - self.inicial
+
+@contextlib.contextmanager
+def medir(resultados, etapa, linhas):
+    """
+    Mede o tempo de parede e o pico de memória (crescimento da RSS sobre o início) do bloco,
+    anexando o registro em `resultados`. A saída padrão das funções medidas (prints do ETL)
+    é suprimida.
+    Se o bloco lançar exceção, o amostrador é parado mesmo assim e nada é registrado.
+    """
+    amostrador = AmostradorMemoria()
+    amostrador.start()
+    inicio = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        pico = amostrador.parar()
+    resultados.append({
+        'etapa': etapa, 'linhas': linhas, 'segundos': round(segundos, 4),
+        'pico_mb': None if pico is None else round(pico / 2**20, 2),
+    })
+
+# ==============================================================================
+# 3. CENÁRIOS: ETAPAS DO ETL E BLOCOS DE AGREGAÇÃO DO APP
+# ==============================================================================
+
+def medir_etl(pasta, linhas, workers, resultados):
+    """
+    Etapas do ETL.py: leitura dos anuais, unificação (concat + CSV), carga/normalização
+    (inclui a camada curada) e preparação do Sankey.
+    """
+    pasta_despesas = os.path.join(pasta, 'despesas')
+    arquivo_saida = os.path.join(pasta_despesas, 'despesas_unificado.csv')
+    arquivos = sorted(
+        os.path.join(pasta_despesas, a) for a in os.listdir(pasta_despesas)
+        if a.startswith('despesas_') and a.endswith('.csv') and a != 'despesas_unificado.csv'
+    )
+
+    with medir(resultados, 'etl.leitura', linhas):
+        lidos = ingerir_arquivos(arquivos, workers=workers)
+    with medir(resultados, 'etl.unificacao', linhas):
+        df_final = pd.concat([r['df'] for r in lidos if r['df'] is not None], ignore_index=True)
+        df_final.to_csv(arquivo_saida, index=False, sep=';', encoding='utf-8', decimal=',')
+    del lidos, df_final
+
+    with medir(resultados, 'etl.normalizacao', linhas):
+        df_receita, df_despesa, base_path = ETL.carregar_para_analise(arquivo_saida, base_path=pasta)
+    with medir(resultados, 'etl.sankey', linhas):
+        ETL.preparar_sankey(df_receita, df_despesa, base_path)
+    return df_receita, df_despesa
+
+def medir_app(df_receita, df_despesa, linhas, resultados):
+    """
+    Blocos de agregação do APP.py executados fora do Streamlit, na mesma sequência
+    de chamadas do app (ano único, parâmetros padrão dos sliders).
+    """
+    with medir(resultados, 'app.cubos', linhas):
+        cubo_desp = construir_cubo_despesa(df_despesa)
+        cubo_rec = construir_cubo_receita(df_receita)
+
+    ano = int(df_despesa['ano_exercicio'].max())
+    with medir(resultados, 'app.visoes_ano', linhas):
+        _, _, cubo_rec_ano, cubo_ano = preparar_visoes_ano(df_receita, df_despesa, cubo_rec, cubo_desp, [ano])
+
+    with medir(resultados, 'app.kpis', linhas):
+        kpis_balanco(cubo_rec_ano, cubo_ano)
+        kpis_receita(cubo_rec_ano)
+        funil_execucao(cubo_ano)
+
+    with medir(resultados, 'app.sankey_integrado', linhas):
+        fluxo_integrado(cubo_rec_ano, cubo_ano, 8, 8)
+
+    with medir(resultados, 'app.ranking', linhas):
+        df_ranking = ranking(cubo_ano, 'desc_funcao', n=10)
+        formatar_rotulos_valor(df_ranking['valor_realizado'], bilhoes=True)
+
+    with medir(resultados, 'app.heatmap', linhas):
+        mapa_calor_mensal(cubo_ano, 'desc_funcao', decrescente=True)
+
+    with medir(resultados, 'app.sankey_despesa', linhas):
+        sankey_cadeia_despesa(cubo_ano, 20)
+
+    with medir(resultados, 'app.sankey_receita', linhas):
+        sankey_receita(cubo_rec_ano, 15)
+
+# ==============================================================================
+# 4. EXECUÇÃO E HISTÓRICO
+# ==============================================================================
+# Cada execução anexa uma linha JSON por etapa ao histórico, com data e commit,
+# permitindo acompanhar a evolução do tempo/memória conforme o volume cresce.
+
+def interpretar_linhas(texto):
+    """
+    Converte '10k', '1M', '10M' ou '5000' em número de linhas.
+    """
+    texto = texto.strip().lower()
+    multiplicador = {'k': 1_000, 'm': 1_000_000}.get(texto[-1], 1)
+    return int(float(texto.rstrip('km')) * multiplicador)
+
+def commit_atual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def executar(tamanhos, pasta, workers=1, historico=None, regerar=False):
+    """
+    Gera (ou reaproveita) os dados de cada tamanho e mede ETL + APP.
+    Retorna a lista de registros e, se `historico` for informado, anexa-os ao arquivo JSONL.
+    """
+    registros = []
+    execucao = {'data': datetime.now().isoformat(timespec='seconds'), 'commit': commit_atual(), 'workers': workers}
+
+    for linhas in tamanhos:
+        pasta_tamanho = os.path.join(pasta, f"linhas_{linhas}")
+        if regerar or not os.path.exists(os.path.join(pasta_tamanho, 'receitas', 'receita.csv')):
+            print(f"Gerando {linhas:,} linhas sintéticas em {pasta_tamanho} ...")
+            gerar_dados_sinteticos(pasta_tamanho, linhas)
+
+        resultados = []
+        df_receita, df_despesa = medir_etl(pasta_tamanho, linhas, workers, resultados)
+        medir_app(df_receita, df_despesa, linhas, resultados)
+        del df_receita, df_despesa
+
+        for r in resultados:
+            pico = '-' if r['pico_mb'] is None else f"{r['pico_mb']:.1f}"
+            print(f"{linhas:>12,} | {r['etapa']:<22} | {r['segundos']:>9.3f} s | {pico:>9} MB")
+        registros.extend({**execucao, **r} for r in resultados)
+
+    if historico:
+        with open(historico, 'a', encoding='utf-8') as f:
+            for r in registros:
+                f.write(json.dumps(r, ensure_ascii=False) + '\n')
+    return registros
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark das etapas do ETL e das agregações do dashboard")
+    parser.add_argument('--linhas', nargs='+', default=['10k', '1M', '10M'], help="Volumes de despesa a gerar (ex: 10k 1M 10M)")
+    parser.add_argument('--pasta', default=os.path.join('data', 'benchmark'), help="Pasta dos dados sintéticos")
+    parser.add_argument('--workers', type=int, default=1, help="Processos para a leitura dos arquivos anuais (0 = todos os núcleos)")
+    parser.add_argument('--historico', default='benchmark_historico.jsonl', help="Arquivo JSONL onde os resultados são acumulados")
+    parser.add_argument('--regerar', action='store_true', help="Regera os dados sintéticos mesmo se já existirem")
+    args = parser.parse_args()
+
+    executar([interpretar_linhas(t) for t in args.linhas], args.pasta, workers=args.workers,
+             historico=args.historico, regerar=args.regerar)
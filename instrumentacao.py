@@ -0,0 +1,197 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:  # psutil é opcional: sem ele, a memória é lida de /proc (Linux)
+    psutil = None
+
+# ==============================================================================
+# 1. MEDIÇÃO DE SEÇÕES (TEMPO DE PAREDE, LINHAS E MEMÓRIA)
+# ==============================================================================
+# Cada seção medida gera um registro {secao, nivel, linhas, linhas_saida, segundos, bytes}.
+# Os registros de uma execução (um rerun do painel) ficam numa lista por contexto,
+# que o Streamlit isola por sessão; os totais por seção acumulam no processo inteiro.
+# `bytes` é a variação da memória do processo durante a seção: as sessões são threads
+# do mesmo processo, então inclui o que outras sessões alocaram no mesmo intervalo.
+# Serve de indício num rerun isolado e por isso não entra nos totais por seção.
+
+logger = logging.getLogger('painel.instrumentacao')
+
+def memoria_residente():
+    """
+    Memória residente (RSS) atual do processo em bytes, ou None se não houver como medir.
+    Usa o psutil quando instalado; sem ele, lê /proc (Linux).
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def memoria_alocada():
+    """
+    Bytes alocados no processo no momento: pelo tracemalloc quando ativo (PYTHONTRACEMALLOC=1,
+    só o heap do Python, mais lento), senão pela RSS (barata, inclui Arrow e buffers nativos).
+    As duas medidas são do processo inteiro, não da thread que chama.
+    """
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return memoria_residente()
+
+_registros_execucao = contextvars.ContextVar('registros_execucao', default=None)
+_nivel_secao = contextvars.ContextVar('nivel_secao', default=0)
+_totais = {}
+_trava_totais = threading.Lock()
+
+def iniciar_execucao():
+    """
+    Começa a coleta de uma execução no contexto atual e retorna a lista de registros,
+    preenchida na ordem de entrada das seções (seções aninhadas com `nivel` maior).
+    """
+    registros = []
+    _registros_execucao.set(registros)
+    return registros
+
+def _qtd_linhas(objeto):
+    if isinstance(objeto, (pd.DataFrame, pd.Series)):
+        return len(objeto)
+    if isinstance(objeto, tuple):
+        return next((len(o) for o in objeto if isinstance(o, pd.DataFrame)), None)
+    return None
+
+@contextlib.contextmanager
+def medir_secao(secao, linhas=None):
+    """
+    Mede o bloco: tempo de parede, variação da memória do processo e linhas processadas.
+    O registro é entregue ao bloco para que ele complete `linhas`/`linhas_saida`.
+    """
+    registro = {'secao': secao, 'nivel': _nivel_secao.get(), 'linhas': linhas, 'linhas_saida': None}
+    registros = _registros_execucao.get()
+    if registros is not None:
+        registros.append(registro)
+
+    token = _nivel_secao.set(registro['nivel'] + 1)
+    memoria_inicial = memoria_alocada()
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    finally:
+        registro['segundos'] = time.perf_counter() - inicio
+        memoria_final = memoria_alocada()
+        registro['bytes'] = None if memoria_inicial is None or memoria_final is None else memoria_final - memoria_inicial
+        _nivel_secao.reset(token)
+        _acumular(registro)
+
+def _acumular(registro):
+    with _trava_totais:
+        total = _totais.setdefault(registro['secao'], {
+            'execucoes': 0, 'segundos': 0.0, 'segundos_max': 0.0, 'linhas': 0
+        })
+        total['execucoes'] += 1
+        total['segundos'] += registro['segundos']
+        total['segundos_max'] = max(total['segundos_max'], registro['segundos'])
+        total['linhas'] += registro['linhas'] or 0
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(registro, ensure_ascii=False, default=str))
+
+def medido(funcao):
+    """
+    Decorador: mede cada chamada de `funcao` como a seção '<módulo>.<nome>', com as
+    linhas do primeiro DataFrame recebido e as do resultado.
+    """
+    secao = f"{funcao.__module__}.{funcao.__name__}"
+
+    @functools.wraps(funcao)
+    def envoltorio(*args, **kwargs):
+        entrada = next((len(a) for a in args if isinstance(a, pd.DataFrame)), None)
+        with medir_secao(secao, linhas=entrada) as registro:
+            resultado = funcao(*args, **kwargs)
+            registro['linhas_saida'] = _qtd_linhas(resultado)
+        return resultado
+    return envoltorio
+
+def totais_por_secao():
+    """Cópia dos totais acumulados no processo, por seção."""
+    with _trava_totais:
+        return {secao: dict(total) for secao, total in _totais.items()}
+
+# ==============================================================================
+# 2. EXPORTAÇÃO (LOGS ESTRUTURADOS E FORMATO TEXTO DO PROMETHEUS)
+# ==============================================================================
+
+def exportar_jsonl(registros, **contexto):
+    """Registros de uma execução em JSON Lines, cada linha acrescida dos campos de `contexto`."""
+    return ''.join(
+        json.dumps({**contexto, **registro}, ensure_ascii=False, default=str) + '\n'
+        for registro in registros
+    )
+
+def _rotulo(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+METRICAS_PROMETHEUS = [
+    ('secao_execucoes_total', 'counter', 'execucoes', 'Execuções da seção.'),
+    ('secao_segundos_total', 'counter', 'segundos', 'Tempo de parede acumulado da seção (s).'),
+    ('secao_segundos_max', 'gauge', 'segundos_max', 'Maior tempo de parede de uma execução da seção (s).'),
+    ('secao_linhas_total', 'counter', 'linhas', 'Linhas de entrada processadas pela seção.'),
+]
+
+def exportar_prometheus(versao=None, prefixo='painel'):
+    """
+    Totais do processo no formato texto de exposição do Prometheus. A métrica
+    `<prefixo>_info{versao=...}` permite comparar as séries entre releases. A memória
+    sai como medida do processo (RSS), sem atribuição por seção.
+    """
+    totais = totais_por_secao()
+    linhas = [
+        f"# HELP {prefixo}_info Versão do painel em execução.",
+        f"# TYPE {prefixo}_info gauge",
+        f'{prefixo}_info{{versao="{_rotulo(versao or "desconhecida")}"}} 1',
+    ]
+    rss = memoria_residente()
+    if rss is not None:
+        linhas += [
+            f"# HELP {prefixo}_processo_memoria_residente_bytes Memória residente (RSS) do processo (bytes).",
+            f"# TYPE {prefixo}_processo_memoria_residente_bytes gauge",
+            f"{prefixo}_processo_memoria_residente_bytes {rss}",
+        ]
+    for nome, tipo, campo, ajuda in METRICAS_PROMETHEUS:
+        linhas.append(f"# HELP {prefixo}_{nome} {ajuda}")
+        linhas.append(f"# TYPE {prefixo}_{nome} {tipo}")
+        for secao in sorted(totais):
+            linhas.append(f'{prefixo}_{nome}{{secao="{_rotulo(secao)}"}} {totais[secao][campo]}')
+    return '\n'.join(linhas) + '\n'
+
+_ultima_gravacao = {}
+_trava_gravacao = threading.Lock()
+
+def salvar_prometheus(caminho, versao=None, intervalo=0):
+    """
+    Grava a exposição em `caminho` de forma atômica (coletor textfile do node_exporter),
+    no máximo uma vez a cada `intervalo` segundos por caminho. Retorna True se gravou.
+    O temporário tem nome único: sessões são threads do mesmo processo e podem gravar juntas.
+    """
+    agora = time.monotonic()
+    with _trava_gravacao:
+        if agora - _ultima_gravacao.get(caminho, float('-inf')) < intervalo:
+            return False
+        _ultima_gravacao[caminho] = agora
+
+    pasta, nome = os.path.split(os.path.abspath(caminho))
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=pasta, prefix=nome + '.', suffix='.tmp', delete=False) as f:
+        f.write(exportar_prometheus(versao))
+    os.replace(f.name, caminho)
+    return True
@@ -0,0 +1,96 @@
+import pandas as pd
+
+from analise import agregar_arvore, colapsar_top_n, rotulo_livre, IndiceTabela, ROTULO_OUTROS
+
+def _despesas():
+    return pd.DataFrame({
+        'desc_funcao': ['SAÚDE', 'SAÚDE', 'SAÚDE', 'EDUCAÇÃO', 'CULTURA'],
+        'desc_elemento': ['PESSOAL', 'MATERIAL', 'DIÁRIAS', 'PESSOAL', 'DIÁRIAS'],
+        'valor_realizado': [100.0, 40.0, 2.0, 80.0, 3.0],
+    })
+
+CAMINHO = ['desc_funcao', 'desc_elemento']
+
+# ==============================================================================
+# Árvores pré-agregadas
+# ==============================================================================
+
+def _folhas(arvore):
+    return {tuple(linha[:-2]): linha[-2] for linha in arvore.itertuples(index=False, name=None)}
+
+def test_arvore_sem_agrupamento_soma_por_folha():
+    arvore = agregar_arvore(_despesas(), CAMINHO)
+    assert list(arvore.columns) == CAMINHO + ['valor_realizado', 'agrupado']
+    assert arvore['valor_realizado'].sum() == 225.0
+    assert not arvore['agrupado'].any()
+
+def test_folhas_pequenas_vao_para_outros_sob_o_pai():
+    arvore = agregar_arvore(_despesas(), CAMINHO, valor_minimo=10)
+    folhas = _folhas(arvore)
+    assert folhas[('SAÚDE', ROTULO_OUTROS)] == 2.0
+    # Pai sem filhos visíveis é recolhido no "outros" do nível de cima
+    assert folhas[(ROTULO_OUTROS, ROTULO_OUTROS)] == 3.0
+    assert arvore.loc[arvore['agrupado'], 'valor_realizado'].sum() == 5.0
+    assert arvore['valor_realizado'].sum() == 225.0
+
+def test_profundidade_e_max_folhas():
+    arvore = agregar_arvore(_despesas(), CAMINHO, profundidade=1, max_folhas=2)
+    assert list(arvore.columns) == ['desc_funcao', 'valor_realizado', 'agrupado']
+    assert _folhas(arvore) == {('SAÚDE',): 142.0, ('EDUCAÇÃO',): 80.0, (ROTULO_OUTROS,): 3.0}
+
+def test_categoria_real_com_o_rotulo_de_outros_nao_se_funde():
+    df = _despesas()
+    df.loc[4, 'desc_funcao'] = ROTULO_OUTROS
+    arvore = agregar_arvore(df, CAMINHO, valor_minimo=10)
+    rotulo = f"{ROTULO_OUTROS} (2)"
+    folhas = _folhas(arvore)
+    assert (ROTULO_OUTROS, 'DIÁRIAS') not in folhas
+    assert folhas[(rotulo, rotulo)] == 3.0
+    assert folhas[('SAÚDE', rotulo)] == 2.0
+    assert not arvore.duplicated(CAMINHO).any()
+
+def test_colapsar_top_n():
+    rotulos = pd.Series(['A', 'B', 'C', None, 'A'])
+    obtido = colapsar_top_n(rotulos, [5, 4, 1, 1, 5], 1, 'RESTO')
+    assert obtido.tolist() == ['A', 'RESTO', 'RESTO', 'RESTO', 'A']
+    assert list(obtido.cat.categories) == ['A', 'RESTO']
+
+def test_colapsar_top_n_com_rotulo_ocupado():
+    obtido = colapsar_top_n(pd.Series(['RESTO', 'B', 'C']), [10, 2, 1], 1, 'RESTO')
+    assert obtido.tolist() == ['RESTO', 'RESTO (2)', 'RESTO (2)']
+
+def test_rotulo_livre():
+    assert rotulo_livre('X', ['A']) == 'X'
+    assert rotulo_livre('X', ['X', 'X (2)']) == 'X (3)'
+
+# ==============================================================================
+# Índice da tabela detalhada
+# ==============================================================================
+
+def _indice():
+    df = pd.DataFrame({
+        'desc_elemento': ['MATERIAL DE CONSUMO', 'DIÁRIAS', 'material permanente', None, 'OBRAS'],
+        'valor_realizado': [30.0, 5.0, 20.0, 50.0, 10.0],
+    })
+    return IndiceTabela(df, 'desc_elemento')
+
+def test_indice_ordena_por_valor_decrescente():
+    linhas, total, maior = _indice().pagina()
+    assert linhas['valor_realizado'].tolist() == [50.0, 30.0, 20.0, 10.0, 5.0]
+    assert (total, maior) == (5, 50.0)
+
+def test_indice_busca_sem_diferenciar_maiusculas():
+    linhas, total, _ = _indice().pagina('Material')
+    assert linhas['desc_elemento'].tolist() == ['MATERIAL DE CONSUMO', 'material permanente']
+    assert total == 2
+    # Termos curtos (sem trigramas) e termos ausentes
+    assert _indice().pagina('ob')[1] == 1
+    assert _indice().pagina('inexistente')[1:] == (0, None)
+
+def test_indice_valor_minimo_e_paginacao():
+    indice = _indice()
+    assert indice.pagina(valor_minimo=20)[1] == 3
+    assert indice.pagina('material', valor_minimo=25)[0]['valor_realizado'].tolist() == [30.0]
+    pagina_2, total, _ = indice.pagina(numero=2, tamanho=2)
+    assert pagina_2['valor_realizado'].tolist() == [20.0, 10.0]
+    assert total == 5
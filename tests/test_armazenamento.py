@@ -0,0 +1,182 @@
+import gc
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from armazenamento import (
+    checksums_particoes, particoes_alteradas, substituir_particoes, salvar_camada_curada,
+    ler_camada_curada, registro_cargas, registrar_carga, carga_incremental,
+    anexar_ou_publicar, _liberar_trava, CacheLRU
+)
+from tratamento import REGRAS_CLASSIFICACAO
+
+def _despesas(valor_fev=20.0, extras=()):
+    linhas = [(2023, 1, 'SAÚDE', 10.0), (2023, 1, 'EDUCAÇÃO', 5.0), (2023, 2, 'SAÚDE', valor_fev), (2023, 3, 'CULTURA', 7.0), *extras]
+    df = pd.DataFrame(linhas, columns=['ano_exercicio', 'mes', 'desc_funcao', 'valor_realizado'])
+    return df.assign(desc_funcao=df['desc_funcao'].astype('category'))
+
+# ==============================================================================
+# Checksums e troca de partições
+# ==============================================================================
+
+def test_checksum_muda_so_na_particao_alterada():
+    antes = checksums_particoes(_despesas())
+    depois = checksums_particoes(_despesas(valor_fev=99.0))
+    assert set(antes) == {'2023-01', '2023-02', '2023-03'}
+    assert antes['2023-01']['linhas'] == 2
+    assert particoes_alteradas(antes, depois) == ['2023-02']
+    assert particoes_alteradas(antes, antes) == []
+
+def test_particoes_novas_e_removidas_contam_como_alteradas():
+    antes = checksums_particoes(_despesas())
+    depois = checksums_particoes(_despesas()[lambda d: d['mes'] != 3])
+    assert particoes_alteradas(antes, depois) == ['2023-03']
+    assert particoes_alteradas(depois, antes) == ['2023-03']
+
+def test_substituir_particoes_equivale_a_recarga():
+    anterior = _despesas()
+    atual = _despesas(valor_fev=99.0, extras=[(2023, 2, 'ASSISTÊNCIA SOCIAL', 1.0)])
+
+    alteradas = particoes_alteradas(checksums_particoes(anterior), checksums_particoes(atual))
+    assert alteradas == ['2023-02']
+    novas = atual[atual['mes'].isin([2])]
+    trocado = substituir_particoes(anterior, novas, alteradas)
+
+    ordem = ['mes', 'valor_realizado']
+    esperado = atual.sort_values(ordem, ignore_index=True)
+    obtido = trocado.sort_values(ordem, ignore_index=True)
+    assert obtido['desc_funcao'].astype(str).tolist() == esperado['desc_funcao'].astype(str).tolist()
+    assert obtido['valor_realizado'].tolist() == esperado['valor_realizado'].tolist()
+    # A nova categoria entra no dicionário sem recodificar as linhas mantidas
+    assert 'ASSISTÊNCIA SOCIAL' in trocado['desc_funcao'].cat.categories
+
+def test_camada_curada_incremental_regrava_so_o_mes_alterado(tmp_path):
+    pytest.importorskip('pyarrow')
+    pasta = str(tmp_path / 'despesas')
+    assert salvar_camada_curada(_despesas(), pasta, incremental=True) == ['2023-01', '2023-02', '2023-03']
+    assert salvar_camada_curada(_despesas(), pasta, incremental=True) == []
+    assert salvar_camada_curada(_despesas(valor_fev=99.0), pasta, incremental=True) == ['2023-02']
+
+    lido = ler_camada_curada(pasta, colunas=['ano_exercicio', 'mes', 'desc_funcao', 'valor_realizado'])
+    lido = lido.sort_values(['mes', 'valor_realizado'], ignore_index=True)
+    assert lido['valor_realizado'].tolist() == [5.0, 10.0, 99.0, 7.0]
+
+# ==============================================================================
+# Cargas incrementais
+# ==============================================================================
+
+PARTICOES = {'despesas': {'2023-01': {'sha256': 'a', 'linhas': 2}}}
+
+def _carregar(cargas, particoes=PARTICOES, base=REGRAS_CLASSIFICACAO):
+    chamadas = []
+    carga_incremental(
+        cargas, 'cubos', particoes,
+        completa=lambda: chamadas.append('completa'),
+        parcial=lambda anterior, alteradas: chamadas.append(('parcial', alteradas)),
+        base=base
+    )
+    return chamadas
+
+def test_mesmas_particoes_e_regras_reaproveitam_a_carga():
+    cargas, cubo = registro_cargas(), _despesas()
+    registrar_carga(cargas, 'cubos', PARTICOES, REGRAS_CLASSIFICACAO, (cubo,))
+    assert _carregar(cargas) == [('parcial', {'despesas': []})]
+
+    particoes = {'despesas': {**PARTICOES['despesas'], '2023-02': {'sha256': 'b', 'linhas': 1}}}
+    assert _carregar(cargas, particoes) == [('parcial', {'despesas': ['2023-02']})]
+
+def test_mudanca_so_nas_regras_refaz_a_carga_completa():
+    cargas, cubo = registro_cargas(), _despesas()
+    registrar_carga(cargas, 'cubos', PARTICOES, REGRAS_CLASSIFICACAO, (cubo,))
+    regras = [r if r[0] != 'eh_capital' else ('eh_capital', 'desc_categoria', 'CAPITAL|INVEST') for r in REGRAS_CLASSIFICACAO]
+    assert _carregar(cargas, base=regras) == ['completa']
+
+def test_resultado_liberado_nao_e_reaproveitado():
+    cargas, cubo = registro_cargas(), _despesas()
+    registrar_carga(cargas, 'cubos', PARTICOES, REGRAS_CLASSIFICACAO, (cubo,))
+    del cubo
+    gc.collect()
+    assert _carregar(cargas) == ['completa']
+
+# ==============================================================================
+# Trava de publicação entre réplicas
+# ==============================================================================
+
+def _frames():
+    return {'despesas': _despesas().assign(desc_funcao=lambda d: d['desc_funcao'].astype(str))}
+
+def test_trava_expirada_e_tomada(tmp_path):
+    pytest.importorskip('pyarrow')
+    pasta = str(tmp_path)
+    trava = os.path.join(pasta, 'chave.lock')
+    with open(trava, 'w', encoding='utf-8') as f:
+        f.write('1-carregador-que-morreu')
+    antigo = time.time() - 60
+    os.utime(trava, (antigo, antigo))
+
+    carregados = []
+    frames = anexar_ou_publicar(pasta, 'chave', ['despesas'], lambda: carregados.append(1) or _frames(), espera_max=5)
+    assert carregados == [1]
+    assert len(frames['despesas']) == 4
+    assert not os.path.exists(trava)
+    assert not [nome for nome in os.listdir(pasta) if nome.endswith('.expirada')]
+
+    # Publicada a chave, as próximas chamadas só anexam
+    anexar_ou_publicar(pasta, 'chave', ['despesas'], lambda: carregados.append(2) or _frames())
+    assert carregados == [1]
+
+def test_trava_fresca_de_outro_dono_e_respeitada(tmp_path):
+    pytest.importorskip('pyarrow')
+    pasta = str(tmp_path)
+    trava = os.path.join(pasta, 'chave.lock')
+    with open(trava, 'w', encoding='utf-8') as f:
+        f.write('1-outro')
+
+    # Sem publicação dentro da espera, carrega localmente e não mexe na trava alheia
+    frames = anexar_ou_publicar(pasta, 'chave', ['despesas'], _frames, espera_max=0.2, intervalo=0.05)
+    assert len(frames['despesas']) == 4
+    assert os.path.exists(trava)
+
+def test_liberar_trava_so_remove_a_propria(tmp_path):
+    trava = str(tmp_path / 'chave.lock')
+    with open(trava, 'w', encoding='utf-8') as f:
+        f.write('1-novo-dono')
+    _liberar_trava(trava, '1-dono-antigo')
+    assert os.path.exists(trava)
+    _liberar_trava(trava, '1-novo-dono')
+    assert not os.path.exists(trava)
+
+# ==============================================================================
+# Cache LRU
+# ==============================================================================
+
+def test_cache_lru_despeja_o_menos_usado():
+    cache = CacheLRU(max_bytes=10, tamanho=len)
+    montagens = []
+    def montar(valor):
+        return lambda: montagens.append(valor) or valor
+
+    cache.obter('a', montar('aaaa'))
+    cache.obter('b', montar('bbbb'))
+    assert cache.obter('a', montar('outro')) == 'aaaa'
+    cache.obter('c', montar('cccc'))
+
+    assert set(cache.entradas) == {'a', 'c'}
+    assert cache.bytes_usados == 8
+    assert (cache.acertos, cache.falhas) == (1, 3)
+    assert montagens == ['aaaa', 'bbbb', 'cccc']
+
+def test_cache_lru_nao_guarda_valor_maior_que_o_limite():
+    cache = CacheLRU(max_bytes=3, tamanho=len)
+    assert cache.obter('grande', lambda: 'abcd') == 'abcd'
+    assert len(cache) == 0 and cache.bytes_usados == 0
+
+def test_cache_lru_invalidar():
+    cache = CacheLRU(max_bytes=100, tamanho=len)
+    for chave in [('fig', 1), ('fig', 2), ('outro', 1)]:
+        cache.obter(chave, lambda: 'xx')
+    cache.invalidar(lambda chave: chave[0] == 'fig')
+    assert list(cache.entradas) == [('outro', 1)]
+    assert cache.bytes_usados == 2
@@ -0,0 +1,49 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tratamento import limpar_moeda, limpar_moeda_vetorizado
+
+# Corpus de equivalência: formatos do portal, nulos/vazios, separadores de milhar,
+# negativos e entradas que `float()` aceita mas não são valores monetários.
+CORPUS = [
+    # Padrão brasileiro (milhar '.' e decimal ',')
+    '1.000,00', '1.234.567,89', '-1.234,56', '0,01', '12,', ',5', '1,5',
+    # Padrão com ponto decimal
+    '1000.00', '1.234', '.5', '+5', '-7', '1e3', ' 12 ', '\t3,50\n',
+    # Nulos e vazios
+    None, np.nan, pd.NA, '', '  ',
+    # Lixo
+    'abc', '-', '--1', '(1,00)', '1 000', '0x10', 'R$ 10,00', 'nan,0',
+    # Aceitos por float(), rejeitados pelos dois
+    '1_000', '1_000,5', 'nan', 'NaN', '１２', '١٢',
+    # Infinitos (mantidos pelos dois)
+    'inf', '-inf', 'Infinity',
+]
+
+def _iguais(a, b):
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+@pytest.mark.parametrize('valor', CORPUS, ids=repr)
+def test_vetorizado_equivale_a_limpar_moeda(valor):
+    esperado = limpar_moeda(valor)
+    obtido = limpar_moeda_vetorizado(pd.Series([valor], dtype=object)).iloc[0]
+    assert _iguais(obtido, esperado)
+
+def test_vetorizado_na_coluna_inteira():
+    serie = pd.Series(CORPUS, dtype=object, index=range(10, 10 + len(CORPUS)))
+    obtido = limpar_moeda_vetorizado(serie)
+    assert obtido.dtype == 'float64'
+    assert obtido.index.equals(serie.index)
+    assert all(_iguais(o, limpar_moeda(v)) for o, v in zip(obtido, CORPUS))
+
+@pytest.mark.parametrize('valor', ['1_000', 'nan', 'NaN', '１２', '١٢', None, '', 'abc'], ids=repr)
+def test_nao_monetarios_viram_zero(valor):
+    assert limpar_moeda(valor) == 0.0
+    assert limpar_moeda_vetorizado(pd.Series([valor], dtype=object)).iloc[0] == 0.0
+
+def test_coluna_numerica_passa_direto():
+    obtido = limpar_moeda_vetorizado(pd.Series([1.5, np.nan, -2.0]))
+    assert obtido.tolist() == [1.5, 0.0, -2.0]
@@ -0,0 +1,307 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# 1. CONVERSÃO DE VALORES MONETÁRIOS
+# ==============================================================================
+
+def limpar_moeda(valor):
+    """
+    Converte strings no formato monetário brasileiro (ex: '1.000,00') para float Python.
+    Trata valores nulos e vazios, retornando 0.0 em caso de erro.
+    Mantida como referência célula a célula para a versão vetorizada abaixo.
+    """
+    if pd.isna(valor) or valor == '':
+        return 0.0
+    valor_str = str(valor).strip()
+
+    # `float()` aceita o que não é valor monetário do portal: '1_000', dígitos não ASCII
+    # ('１２') e o texto 'nan'. Esses casos também viram 0.0, como na versão vetorizada.
+    if not valor_str.isascii() or '_' in valor_str:
+        return 0.0
+
+    # Remove separador de milhar (.) e substitui decimal (,) por ponto
+    if ',' in valor_str:
+        valor_str = valor_str.replace('.', '').replace(',', '.')
+    try:
+        numero = float(valor_str)
+    except ValueError:
+        return 0.0
+    return 0.0 if np.isnan(numero) else numero
+
+def limpar_moeda_vetorizado(serie):
+    """
+    Versão coluna a coluna de `limpar_moeda`: converte uma Series (ou array) inteira
+    de strings monetárias para float64 em poucas operações vetorizadas.
+    Aceita '1.000,00', '1000.00', vazios/NaN (-> 0.0) e lixo (-> 0.0).
+    Equivalente a `limpar_moeda` célula a célula (ver tests/test_tratamento.py).
+    """
+    serie = pd.Series(serie, copy=False)
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype('float64').fillna(0.0)
+
+    texto = serie.astype('string').str.strip()
+
+    # Só as células com vírgula seguem o padrão brasileiro (milhar '.' e decimal ',')
+    tem_virgula = texto.str.contains(',', regex=False, na=False)
+    texto_br = texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    texto = texto.where(~tem_virgula, texto_br)
+
+    valores = pd.to_numeric(texto, errors='coerce')
+    return pd.Series(valores, index=serie.index, dtype='float64').fillna(0.0)
+
+def dtypes_moeda(colunas):
+    """
+    Monta o dicionário `dtype=` do read_csv que mantém as colunas monetárias como texto,
+    permitindo o uso do engine C do pandas (sem `converters=`).
+    """
+    return {c: str for c in colunas}
+
+def converter_colunas_moeda(df, colunas):
+    """
+    Aplica `limpar_moeda_vetorizado` nas colunas monetárias presentes no DataFrame.
+    """
+    for c in colunas:
+        if c in df.columns:
+            df[c] = limpar_moeda_vetorizado(df[c])
+    return df
+
+# ==============================================================================
+# 2. NORMALIZAÇÃO E CODIFICAÇÃO CATEGÓRICA DAS HIERARQUIAS
+# ==============================================================================
+
+# Colunas de hierarquia (textos longos e muito repetidos) guardadas como categorias
+COLUNAS_CATEGORICAS_DESPESA = [
+    'nome_orgao', 'desc_funcao', 'desc_categoria', 'desc_natureza',
+    'desc_elemento', 'desc_modalidade'
+]
+COLUNAS_CATEGORICAS_RECEITA = ['nome_origem', 'nome_especie', 'nome_tipo']
+
+def normalizar_categoria(serie):
+    """
+    Normaliza (strip + upper) e converte a coluna para `category`.
+    A normalização roda só sobre o dicionário (valores distintos), não sobre cada linha;
+    rótulos que colidem após a normalização passam a compartilhar o mesmo código.
+    Nulos continuam nulos.
+    """
+    cat = pd.Categorical(serie)
+    normalizadas = pd.Index(cat.categories.astype(str)).str.strip().str.upper()
+    dicionario = normalizadas.unique().sort_values()
+    novos_codigos = dicionario.get_indexer(normalizadas)
+    codigos = np.where(cat.codes >= 0, novos_codigos[cat.codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=dicionario), index=serie.index, name=serie.name)
+
+def normalizar_categorias(df, colunas):
+    """
+    Aplica `normalizar_categoria` nas colunas presentes. Como o DataFrame reúne todos
+    os anos, o dicionário de cada coluna é único e compartilhado entre os exercícios.
+    """
+    for c in colunas:
+        if c in df.columns:
+            df[c] = normalizar_categoria(df[c])
+    return df
+
+# ==============================================================================
+# 3. CLASSIFICAÇÃO POR REGRAS (MARCADORES DE RECEITA E DESPESA)
+# ==============================================================================
+
+# Tabela de regras: (coluna marcador, coluna de origem, padrão regex sem diferenciar
+# maiúsculas). Cada regra vira uma coluna booleana calculada na carga, de modo que os
+# filtros do painel são máscaras prontas em vez de buscas por texto a cada interação.
+REGRAS_CLASSIFICACAO = [
+    ('eh_receita_propria', 'nome_origem', 'TRIBUTÁRIA|PATRIMONIAL|SERVIÇOS'),
+    ('eh_tributaria', 'nome_origem', 'TRIBUTÁRIA'),
+    ('eh_transferencia', 'nome_origem', 'TRANSFER'),
+    ('eh_corrente', 'desc_categoria', 'CORRENTES'),
+    ('eh_capital', 'desc_categoria', 'CAPITAL'),
+]
+
+def carregar_regras_classificacao(caminho):
+    """
+    Lê a tabela de regras de um CSV (sep=';', colunas marcador;coluna;padrao).
+    Se o arquivo não existir, retorna as regras padrão (REGRAS_CLASSIFICACAO).
+    """
+    if not os.path.exists(caminho):
+        return REGRAS_CLASSIFICACAO
+    regras = pd.read_csv(caminho, sep=';', dtype=str, encoding='utf-8')
+    return list(regras[['marcador', 'coluna', 'padrao']].itertuples(index=False, name=None))
+
+def impressao_regras(regras):
+    """
+    Impressão digital do conteúdo das regras (não do arquivo): ETL e app chegam à mesma
+    impressão sempre que classificam com as mesmas regras, em qualquer pasta.
+    """
+    return hashlib.sha256(repr([tuple(r) for r in regras]).encode('utf-8')).hexdigest()[:8]
+
+def mascara_padrao(serie, padrao):
+    """
+    Máscara booleana das linhas cujo valor casa com `padrao` (nulos -> False).
+    Em colunas `category` a busca roda só sobre o dicionário e é expandida pelos códigos.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        casa = np.asarray(serie.cat.categories.astype(str).str.contains(padrao, case=False, regex=True), dtype=bool)
+        # Código -1 (nulo) cai na posição extra, que é sempre False
+        casa = np.append(casa, False)
+        return pd.Series(casa[serie.cat.codes.to_numpy()], index=serie.index)
+    return serie.astype('string').str.contains(padrao, case=False, na=False).astype(bool)
+
+def classificar(df, regras=REGRAS_CLASSIFICACAO):
+    """
+    Grava uma coluna booleana por regra cuja coluna de origem está presente no DataFrame.
+    Deve rodar após `normalizar_categorias` (padrões escritos em maiúsculas).
+    """
+    for marcador, coluna, padrao in regras:
+        if coluna in df.columns:
+            df[marcador] = mascara_padrao(df[coluna], padrao)
+    return df
+
+# ==============================================================================
+# 4. LEITURA DOS ARQUIVOS DE ORIGEM
+# ==============================================================================
+
+COLUNAS_MOEDA_DESPESA = ['vlpag', 'vlorcini', 'vlemp', 'vlliq']
+
+# Códigos numéricos do portal de cada nível da hierarquia, renomeados para cod_*.
+# Não são chave única do rótulo (órgãos renomeados entre anos; o código do elemento
+# embute categoria/natureza/modalidade), por isso os gráficos seguem agrupando pelo
+# rótulo codificado (`category`) e os códigos ficam como referência ao portal.
+CODIGOS_DESPESA = {
+    'orgao': 'cod_orgao', 'funcao': 'cod_funcao', 'elemento': 'cod_elemento',
+    'categoria': 'cod_categoria', 'natureza': 'cod_natureza', 'modalidade': 'cod_modalidade'
+}
+
+# Seleção de colunas de interesse (incluindo hierarquia orçamentária) e renomeação
+# para os termos padronizados com o app
+COLUNAS_DESPESA = [
+    'exercicio', 'mes', 'orgao', 'nome_orgao', 'funcao', 'desc_funcao', 'elemento', 'desc_elemento',
+    'categoria', 'desc_categoria', 'natureza', 'desc_natureza', 'modalidade', 'desc_modalidade',
+    'vlorcini', 'vlpag', 'vlemp', 'vlliq'
+]
+RENOMEAR_DESPESA = {
+    'exercicio': 'ano_exercicio',
+    'vlpag': 'valor_realizado',
+    'vlorcini': 'valor_orcado',
+    'vlemp': 'valor_empenhado',
+    'vlliq': 'valor_liquidado',
+    **CODIGOS_DESPESA
+}
+COLUNAS_DESPESA_PADRAO = [RENOMEAR_DESPESA.get(c, c) for c in COLUNAS_DESPESA]
+
+def ler_arquivo_despesa(arquivo):
+    """
+    Lê um CSV anual de despesas do portal (sep=';'), tentando UTF-8 e depois Latin1,
+    e converte as colunas monetárias. Lança a exceção original se ambas falharem.
+    """
+    tipos_moeda = dtypes_moeda(COLUNAS_MOEDA_DESPESA)
+    try:
+        # Tenta leitura padrão UTF-8
+        df = pd.read_csv(arquivo, sep=';', encoding='utf-8', dtype=tipos_moeda)
+    except:
+        # Fallback para Latin1 (comum em dados governamentais antigos)
+        df = pd.read_csv(arquivo, sep=';', encoding='latin1', dtype=tipos_moeda)
+    return converter_colunas_moeda(df, COLUNAS_MOEDA_DESPESA)
+
+def padronizar_despesas(df):
+    """
+    Seleciona as colunas de interesse e aplica a renomeação padrão das despesas.
+    Idempotente: aceita tanto os nomes originais do portal quanto os já renomeados.
+    """
+    df = df.rename(columns=RENOMEAR_DESPESA)
+    df = df[[c for c in COLUNAS_DESPESA_PADRAO if c in df.columns]].copy()
+    for col in CODIGOS_DESPESA.values():
+        if col in df.columns:
+            # Lidos como float no unificado ("18,0"); inteiros de 32 bits com nulos
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Int32')
+    return df
+
+# ==============================================================================
+# 5. INGESTÃO PARALELA (POOL DE PROCESSOS)
+# ==============================================================================
+
+def ler_arquivo_com_metricas(arquivo):
+    """
+    Executa `ler_arquivo_despesa` medindo tempo e linhas. Erros são devolvidos
+    no resultado (e não lançados) para não derrubar o pool inteiro.
+    """
+    inicio = time.perf_counter()
+    df, erro = None, None
+    try:
+        df = ler_arquivo_despesa(arquivo)
+    except Exception as e:
+        erro = str(e)
+    return {
+        'arquivo': arquivo,
+        'df': df,
+        'linhas': 0 if df is None else len(df),
+        'segundos': time.perf_counter() - inicio,
+        'erro': erro,
+    }
+
+def ingerir_arquivos(arquivos, workers=1):
+    """
+    Lê vários arquivos anuais, em série (workers=1) ou em paralelo num pool de processos.
+    workers <= 0 usa todos os núcleos. O resultado segue a ordem de `arquivos`,
+    garantindo saída idêntica à execução serial.
+    """
+    arquivos = list(arquivos)
+    if workers is None or workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(arquivos))
+
+    if workers <= 1:
+        return [ler_arquivo_com_metricas(a) for a in arquivos]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(ler_arquivo_com_metricas, arquivos))
+
+# ==============================================================================
+# 6. UNIFICAÇÃO EM STREAMING (BLOCOS DE TAMANHO LIMITADO)
+# ==============================================================================
+
+def escrever_despesas_em_blocos(arquivos, arquivo_saida, tamanho_bloco=200_000):
+    """
+    Lê cada arquivo em blocos de `tamanho_bloco` linhas, converte as colunas monetárias,
+    padroniza (seleção/renomeação) e anexa ao unificado. Só um bloco fica em memória.
+    Se a leitura UTF-8 falhar no meio do arquivo, o trecho já gravado é descartado
+    e o arquivo é relido em Latin1. O unificado é trocado atomicamente ao final.
+    Retorna as métricas por arquivo (linhas, blocos, segundos, erro).
+    """
+    tipos_moeda = dtypes_moeda(COLUNAS_MOEDA_DESPESA)
+    temporario = arquivo_saida + '.tmp'
+    metricas = []
+
+    with open(temporario, 'w', encoding='utf-8', newline='') as saida:
+        cabecalho_escrito = False
+        for arquivo in arquivos:
+            inicio = time.perf_counter()
+            posicao, cabecalho_antes = saida.tell(), cabecalho_escrito
+            resultado = {'arquivo': arquivo, 'linhas': 0, 'blocos': 0, 'erro': None}
+
+            for encoding in ('utf-8', 'latin1'):
+                try:
+                    leitor = pd.read_csv(arquivo, sep=';', encoding=encoding, dtype=tipos_moeda, chunksize=tamanho_bloco)
+                    for bloco in leitor:
+                        bloco = padronizar_despesas(converter_colunas_moeda(bloco, COLUNAS_MOEDA_DESPESA))
+                        bloco = bloco.reindex(columns=COLUNAS_DESPESA_PADRAO)
+                        bloco.to_csv(saida, index=False, sep=';', decimal=',', header=not cabecalho_escrito)
+                        cabecalho_escrito = True
+                        resultado['linhas'] += len(bloco)
+                        resultado['blocos'] += 1
+                    resultado['erro'] = None
+                    break
+                except Exception as e:
+                    # Desfaz o que foi gravado deste arquivo antes de tentar o próximo encoding
+                    saida.seek(posicao)
+                    saida.truncate()
+                    cabecalho_escrito = cabecalho_antes
+                    resultado.update(linhas=0, blocos=0, erro=str(e))
+
+            resultado['segundos'] = time.perf_counter() - inicio
+            metricas.append(resultado)
+
+    os.replace(temporario, arquivo_saida)
+    return metricas